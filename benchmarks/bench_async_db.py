@@ -0,0 +1,73 @@
+"""
+Бенчмарк: конкурентные чаты и синхронные/асинхронные вызовы базы данных.
+
+Имитирует медленный round-trip до Postgres и сравнивает, сколько времени
+занимает обработка N одновременных чатов при прямом синхронном вызове
+Database из корутины и через AsyncDatabase.
+
+Запуск:
+    python benchmarks/bench_async_db.py --chats 50 --latency 0.05
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils.database import Database, AsyncDatabase
+
+
+class SlowDatabase(Database):
+    """Database без подключения, каждый вызов которого занимает latency секунд"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def get_statistics(self, chat_id, start_date=None, end_date=None):
+        time.sleep(self.latency)
+        return {'total_income': 0, 'total_expense': 0, 'balance': 0, 'categories': {}}
+
+    def close(self):
+        pass
+
+
+async def run_sync(db: SlowDatabase, chats: int) -> float:
+    async def handler(chat_id):
+        db.get_statistics(chat_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(chat_id) for chat_id in range(chats)))
+    return time.perf_counter() - started
+
+
+async def run_async(db: AsyncDatabase, chats: int) -> float:
+    async def handler(chat_id):
+        await db.get_statistics(chat_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(chat_id) for chat_id in range(chats)))
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    slow_db = SlowDatabase(args.latency)
+    async_db = AsyncDatabase(slow_db)
+
+    sync_time = asyncio.run(run_sync(slow_db, args.chats))
+    async_time = asyncio.run(run_async(async_db, args.chats))
+    async_db.close()
+
+    print(f"Чатов: {args.chats}, задержка запроса: {args.latency * 1000:.0f} мс")
+    print(f"Синхронный Database:  {sync_time:.3f} с")
+    print(f"AsyncDatabase:        {async_time:.3f} с (потоков: {async_db.executor._max_workers})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+Бенчмарк: импорт банковской выписки и экспорт транзакций в CSV.
+
+Создает выписку в формате CSV (разделитель ";", суммы с десятичной запятой,
+описания операций без категорий бота) и загружает ее в SQLite базу через
+Database.import_csv, затем выгружает транзакции чата через export_csv.
+Для сравнения те же строки записываются по одной через add_transaction,
+как при отправке сообщений в чат (на части строк с пересчетом на весь файл).
+
+С --bot импорт и экспорт дополнительно проверяются через src/main.py и
+фейковый Bot API: документ с подписью /import и команда /export.
+
+Запуск:
+    python benchmarks/bench_import_export.py --rows 100000
+"""
+import os
+import sys
+import time
+import random
+import signal
+import resource
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from models.transaction import Transaction
+from utils.database import Database
+from utils.message_parser import MessageParser
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+CHAT_ID = 1
+DESCRIPTIONS = [
+    'Магазин Пятерочка', 'Яндекс Такси', 'Метро', 'Аптека 36,6', 'Кино Октябрь',
+    'Ресторан', 'Курсы английского', 'Оплата квартиры', 'Перевод', 'Зарплата',
+]
+
+
+def make_statement(path: str, rows: int):
+    now = datetime.now()
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('"Дата операции";"Сумма операции";"Валюта";"Описание"\n')
+        for _ in range(rows):
+            timestamp = now - timedelta(minutes=random.randint(0, 60 * 24 * 365))
+            description = random.choice(DESCRIPTIONS)
+            sign = '+' if description == 'Зарплата' else '-'
+            amount = f'{random.randint(1, 500000) / 100:.2f}'.replace('.', ',')
+            f.write(f'"{timestamp:%d.%m.%Y %H:%M:%S}";"{sign}{amount}";"RUB";"{description}"\n')
+
+
+def classify(text: str):
+    return MessageParser.classify(text, CHAT_ID)
+
+
+def bench_direct(directory: str, statement: str, rows: int, baseline_rows: int):
+    db = Database(write_behind=False, database_url=f'sqlite:///{os.path.join(directory, "direct.db")}')
+    categories = list(MessageParser.DEFAULT_CATEGORIES)
+
+    started = time.perf_counter()
+    imported, skipped = db.import_csv(CHAT_ID, 1, statement, classify, categories)
+    import_seconds = time.perf_counter() - started
+    print(f"import_csv:      {imported} строк за {import_seconds:6.2f} с ({imported / import_seconds:,.0f} строк/с), пропущено {skipped}")
+
+    export_path = os.path.join(directory, 'export.csv')
+    started = time.perf_counter()
+    exported = db.export_csv(CHAT_ID, export_path)
+    export_seconds = time.perf_counter() - started
+    print(f"export_csv:      {exported} строк за {export_seconds:6.2f} с, {os.path.getsize(export_path) / 1024 / 1024:.1f} МБ")
+
+    mismatches = db.check_daily_totals(CHAT_ID)
+    print(f"daily_totals:    расхождений {len(mismatches)}")
+
+    # По одной транзакции, как обработчик сообщений
+    started = time.perf_counter()
+    now = datetime.now()
+    for i in range(baseline_rows):
+        db.add_transaction(Transaction(
+            amount=100, type='expense', category='другое', description='',
+            user_id=1, chat_id=CHAT_ID + 1, timestamp=now
+        ))
+    per_row = (time.perf_counter() - started) / baseline_rows
+    print(f"add_transaction: {per_row * 1000:.2f} мс/строка, {rows} строк - около {per_row * rows:,.0f} с")
+    print(f"Пиковая память процесса: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} МБ")
+    db.close()
+
+
+def bench_bot(directory: str, statement: str, timeout: float):
+    from fake_bot_api import FakeBotAPI
+
+    api = FakeBotAPI()
+    api.start()
+    env = dict(os.environ)
+    env.update({
+        'TELEGRAM_BOT_TOKEN': '123456:bench',
+        'TELEGRAM_API_BASE_URL': api.base_url,
+        'TELEGRAM_API_BASE_FILE_URL': api.base_file_url,
+        'PYTHONPATH': os.path.join(ROOT, 'src'),
+        'DATABASE_PATH': os.path.join(directory, 'bot.db'),
+    })
+    for variable in ('DATABASE_URL', 'DATABASE_PUBLIC_URL', 'SHARD_WORKERS', 'ARCHIVE_PATH'):
+        env.pop(variable, None)
+
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'src', 'main.py')],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        if not api.wait_for_request('getUpdates', timeout):
+            raise RuntimeError("Бот не запустился")
+        with open(statement, 'rb') as f:
+            content = f.read()
+
+        started = time.monotonic()
+        api.push_document(CHAT_ID, content, 'statement.csv', caption='/import')
+        if not api.wait_for_sent(1, timeout):
+            raise RuntimeError("Бот не ответил на /import")
+        print(f"/import через бота: ответ через {api.sent[-1].time - started:6.2f} с")
+
+        started = time.monotonic()
+        api.push_update(CHAT_ID, '/export')
+        if not api.wait_for_sent(2, timeout):
+            raise RuntimeError("Бот не ответил на /export")
+        reply = api.sent[-1]
+        print(f"/export через бота: {reply.method}, {reply.bytes / 1024 / 1024:.1f} МБ, ответ через {reply.time - started:6.2f} с")
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--baseline-rows', type=int, default=500, help="Строк для замера записи по одной")
+    parser.add_argument('--bot', action='store_true', help="Проверить /import и /export через бота")
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args()
+
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as directory:
+        statement = os.path.join(directory, 'statement.csv')
+        make_statement(statement, args.rows)
+        print(f"Выписка: {args.rows} строк, {os.path.getsize(statement) / 1024 / 1024:.1f} МБ\n")
+        bench_direct(directory, statement, args.rows, args.baseline_rows)
+        if args.bot:
+            print()
+            bench_bot(directory, statement, args.timeout)
+
+
+if __name__ == '__main__':
+    main()
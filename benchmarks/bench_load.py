@@ -0,0 +1,282 @@
+"""
+Нагрузочный тест: src/main.py против локального фейкового Bot API.
+
+Создает временную SQLite базу с историей транзакций множества чатов,
+запускает бота и отправляет ему синтетический поток обновлений с заданной
+интенсивностью (--rate, обновлений в секунду; 0 - все сразу): записи
+расходов и доходов, /stats и /report в пропорции --mix. Задержка каждого
+обновления - от постановки в очередь getUpdates до ответа бота на это
+сообщение (ответы цитируют сообщение, поэтому сопоставляются по
+reply_to_message_id).
+
+Выводит p50/p95/p99 задержки по обработчикам, пропускную способность и
+пиковую память: сумму RSS процесса бота и его дочерних процессов (пул
+отрисовки графиков, шарды) по замерам раз в --rss-interval секунд.
+Результаты можно сохранить (--save) и сравнить с прошлым прогоном
+(--compare), как в bench_micro.py.
+
+Запуск:
+    python benchmarks/bench_load.py --chats 2000 --messages 20000 --rate 300
+"""
+import os
+import sys
+import math
+import time
+import random
+import signal
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import regression
+from fake_bot_api import FakeBotAPI
+from models.transaction import Transaction
+from utils.database import Database, transaction_to_row
+from utils.rollups import rebuild_daily_totals
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+CATEGORIES = ['продукты', 'транспорт', 'развлечения', 'здоровье', 'образование', 'другое']
+TRANSACTION_TEXTS = [
+    '500 продукты', '250 такси', '1200 аптека', '800 кино', '450 кофе',
+    '3000 курсы английского', '50000+ зарплата', '500 продукты, 200 такси',
+]
+HANDLERS = ('message', 'stats', 'report')
+PERCENTILES = (50, 95, 99)
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """"message=0.85,stats=0.1,report=0.05" -> веса обработчиков"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in HANDLERS:
+            raise argparse.ArgumentTypeError(f"Неизвестный обработчик: {name}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def fill(path: str, chats: int, rows: int, days: int):
+    """История транзакций, равномерно распределенная по чатам и дням"""
+    db = Database(write_behind=False, database_url=f'sqlite:///{path}')
+    now = datetime.now()
+    batch_size = 50000
+    for offset in range(0, rows, batch_size):
+        batch = [
+            transaction_to_row(Transaction(
+                amount=random.randint(1, 5000),
+                type=random.choice(['income', 'expense', 'expense', 'expense']),
+                category=random.choice(CATEGORIES),
+                description='',
+                user_id=1,
+                chat_id=-random.randint(1, chats),
+                timestamp=now - timedelta(minutes=random.randint(0, 60 * 24 * days))
+            ))
+            for _ in range(min(batch_size, rows - offset))
+        ]
+        with db.engine.begin() as connection:
+            connection.execute(Transaction.__table__.insert(), batch)
+    session = db.Session()
+    rebuild_daily_totals(session)
+    session.commit()
+    session.close()
+    db.close()
+
+
+def make_traffic(chats: int, messages: int, mix: Dict[str, float]):
+    handlers = random.choices(list(mix), weights=list(mix.values()), k=messages)
+    traffic = []
+    for handler in handlers:
+        text = random.choice(TRANSACTION_TEXTS) if handler == 'message' else f'/{handler}'
+        # Идентификаторы групповых чатов отрицательные
+        traffic.append((-random.randint(1, chats), handler, text))
+    return traffic
+
+
+def process_tree_rss(pid: int) -> int:
+    """Сумма RSS процесса и всех его потомков в байтах (Linux, /proc)"""
+    parents = {}
+    rss = {}
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                stat = f.read()
+            with open(f'/proc/{name}/statm') as f:
+                resident = int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        # Имя процесса в скобках может содержать пробелы
+        fields = stat[stat.rfind(')') + 2:].split()
+        parents[int(name)] = int(fields[1])
+        rss[int(name)] = resident * page_size
+
+    total = 0
+    tree = {pid}
+    changed = True
+    while changed:
+        changed = False
+        for child, parent in parents.items():
+            if parent in tree and child not in tree:
+                tree.add(child)
+                changed = True
+    for member in tree:
+        total += rss.get(member, 0)
+    return total
+
+
+class RSSSampler(threading.Thread):
+    """Периодически замеряет RSS дерева процессов бота и хранит максимум"""
+
+    def __init__(self, pid: int, interval: float):
+        super().__init__(name='rss-sampler', daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, process_tree_rss(self.pid))
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль по методу ближайшего ранга"""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+
+def run(database_path: str, traffic, rate: float, api_latency: float, rss_interval: float, timeout: float) -> dict:
+    api = FakeBotAPI(latency=api_latency)
+    api.start()
+    env = dict(os.environ)
+    env.update({
+        'TELEGRAM_BOT_TOKEN': '123456:bench',
+        'TELEGRAM_API_BASE_URL': api.base_url,
+        'PYTHONPATH': os.path.join(ROOT, 'src'),
+        'DATABASE_PATH': database_path,
+    })
+    for variable in ('DATABASE_URL', 'DATABASE_PUBLIC_URL', 'ARCHIVE_PATH', 'DIGEST_PATH'):
+        env.pop(variable, None)
+
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'src', 'main.py')],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    sampler = RSSSampler(process.pid, rss_interval)
+    sampler.start()
+    pushed = {}
+    try:
+        if not api.wait_for_request('getUpdates', timeout):
+            raise RuntimeError("Бот не запустился")
+
+        # Обновления ставятся в очередь по расписанию, не дожидаясь ответов
+        started = time.monotonic()
+        for i, (chat_id, handler, text) in enumerate(traffic):
+            if rate > 0:
+                delay = started + i / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            pushed_at = time.monotonic()
+            update = api.push_update(chat_id, text)
+            pushed[update['message']['message_id']] = (handler, pushed_at)
+        completed = api.wait_for_sent(len(traffic), timeout)
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        sampler.stop()
+        api.stop()
+
+    latencies = defaultdict(list)
+    first_reply = {}
+    for sent in api.sent:
+        if sent.reply_to in pushed and sent.reply_to not in first_reply:
+            first_reply[sent.reply_to] = sent.time
+            handler, pushed_at = pushed[sent.reply_to]
+            latencies[handler].append(sent.time - pushed_at)
+    elapsed = (max(first_reply.values()) if first_reply else time.monotonic()) - started
+    return {
+        'completed': completed,
+        'answered': len(first_reply),
+        'elapsed': elapsed,
+        'throughput': len(first_reply) / elapsed if elapsed > 0 else 0.0,
+        'latencies': latencies,
+        'peak_rss': sampler.peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--history', type=int, default=200000, help="Транзакций в базе до начала теста")
+    parser.add_argument('--history-days', type=int, default=90)
+    parser.add_argument('--mix', type=parse_mix, default='message=0.85,stats=0.1,report=0.05')
+    parser.add_argument('--rate', type=float, default=300, help="Обновлений в секунду (0 - все сразу)")
+    parser.add_argument('--api-latency', type=float, default=0.05, help="Задержка фейкового API на отправку, с")
+    parser.add_argument('--rss-interval', type=float, default=0.2)
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--save', help="Сохранить результаты в JSON")
+    parser.add_argument('--compare', help="Сравнить с результатами из JSON")
+    parser.add_argument('--threshold', type=float, default=0.15, help="Допустимое ухудшение при сравнении")
+    args = parser.parse_args()
+
+    random.seed(0)
+    traffic = make_traffic(args.chats, args.messages, args.mix)
+    with tempfile.TemporaryDirectory() as tmp:
+        database_path = os.path.join(tmp, 'load.db')
+        fill(database_path, args.chats, args.history, args.history_days)
+        print(
+            f"Чатов: {args.chats}, обновлений: {args.messages}, истории: {args.history} транзакций, "
+            f"интенсивность: {args.rate or 'без ограничения'}/с, задержка API: {args.api_latency * 1000:.0f} мс\n"
+        )
+        result = run(database_path, traffic, args.rate, args.api_latency, args.rss_interval, args.timeout)
+
+    results = {}
+    print(f"{'обработчик':<10} {'запросов':>9} " + ' '.join(f"{'p' + str(q) + ', мс':>10}" for q in PERCENTILES))
+    for handler in HANDLERS:
+        values = result['latencies'].get(handler)
+        if not values:
+            continue
+        row = []
+        for q in PERCENTILES:
+            value = percentile(values, q)
+            results[f'{handler}_p{q}'] = value
+            row.append(f"{value * 1000:10.1f}")
+        print(f"{handler:<10} {len(values):>9} " + ' '.join(row))
+
+    results['throughput'] = result['throughput']
+    results['peak_rss_mb'] = result['peak_rss'] / 1024 / 1024
+    status = '' if result['completed'] else f" (ответов получено {result['answered']} из {len(traffic)})"
+    print(f"\nПропускная способность: {result['throughput']:.1f} обновлений/с за {result['elapsed']:.1f} с{status}")
+    print(f"Пиковая память бота (с дочерними процессами): {results['peak_rss_mb']:.0f} МБ")
+
+    if args.save:
+        regression.save(args.save, results, chats=args.chats, messages=args.messages, rate=args.rate)
+    if args.compare:
+        regressions = regression.compare(results, args.compare, args.threshold, higher_is_better={'throughput'})
+        if regressions:
+            print(f"\nУхудшились: {', '.join(regressions)}")
+            sys.exit(1)
+    if not result['completed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Микробенчмарк: пропускная способность MessageParser.
+
+Сравнивает предкомпилированный KeywordMatcher с прежней реализацией
+(re.search на каждый вызов и перебор ключевых слов подстроками).
+
+Запуск:
+    python benchmarks/bench_message_parser.py --messages 100000
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils.message_parser import MessageParser, ParsedTransaction
+
+SAMPLES = [
+    "500 продукты",
+    "1000+ зарплата",
+    "250 такси до дома",
+    "1200.50 аптека",
+    "купили билеты в кино 800",
+    "3000 курсы английского",
+    "450 кофе с собой",
+    "500 продукты, 200 такси",
+    "привет, как дела?",
+]
+
+
+def legacy_parse_message(text: str):
+    """Прежняя реализация MessageParser.parse_message"""
+    amount_match = re.search(r'(\d+(?:\.\d{1,2})?)', text)
+    if not amount_match:
+        return None
+    amount = float(amount_match.group(1))
+    transaction_type = 'expense'
+    if any(keyword in text.lower() for keyword in MessageParser.INCOME_KEYWORDS):
+        transaction_type = 'income'
+    category = 'другое'
+    text_lower = text.lower()
+    for cat, keywords in MessageParser.DEFAULT_CATEGORIES.items():
+        if any(keyword in text_lower for keyword in keywords):
+            category = cat
+            break
+    return ParsedTransaction(amount=amount, type=transaction_type, category=category, description=text.strip())
+
+
+def measure(name: str, func, messages):
+    started = time.perf_counter()
+    for text in messages:
+        func(text)
+    elapsed = time.perf_counter() - started
+    print(f"{name:<32} {len(messages) / elapsed:12,.0f} сообщений/с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=100000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    messages = [random.choice(SAMPLES) for _ in range(args.messages)]
+    # Пользовательский словарь чата увеличивает число ключевых слов
+    MessageParser.set_chat_categories(1, {f'категория {i}': [f'слово{i}', f'термин{i}'] for i in range(200)})
+
+    measure("Прежний parse_message", legacy_parse_message, messages)
+    measure("parse_message", MessageParser.parse_message, messages)
+    measure("parse_entries", MessageParser.parse_entries, messages)
+    measure("parse_entries (400 слов чата)", lambda text: MessageParser.parse_entries(text, 1), messages)
+
+
+if __name__ == '__main__':
+    main()
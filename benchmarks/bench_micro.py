@@ -0,0 +1,166 @@
+"""
+Микробенчмарки горячих функций бота.
+
+    parse_message         MessageParser.parse_message на типичных сообщениях
+    get_statistics        Database.get_statistics за 30 дней (локальная SQLite)
+    create_pie_chart:*    Visualizer.create_pie_chart для расходов и доходов
+    create_time_series    Visualizer.create_time_series
+    create_category_bar   Visualizer.create_category_bar_chart
+
+Каждая функция вызывается пачками, пока пачка не займет --min-time секунд;
+из --repeat пачек берется лучшее время на вызов (как в timeit), оно меньше
+всего зависит от шума. Результаты можно сохранить (--save) и сравнить с
+сохраненным прогоном (--compare): при замедлении больше --threshold скрипт
+завершается с кодом 1.
+
+Запуск:
+    python benchmarks/bench_micro.py --save baseline.json
+    python benchmarks/bench_micro.py --compare baseline.json --threshold 0.1
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from statistics import median
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import regression
+from models.transaction import Transaction
+from utils.database import Database, transaction_to_row
+from utils.message_parser import MessageParser
+from utils.rollups import rebuild_daily_totals
+from utils.visualization import Visualizer, warm_up
+
+CHAT_ID = 1
+CATEGORIES = ['продукты', 'транспорт', 'развлечения', 'здоровье', 'образование', 'другое']
+SAMPLES = [
+    "500 продукты",
+    "1000+ зарплата",
+    "250 такси до дома",
+    "1200.50 аптека",
+    "купили билеты в кино 800",
+    "3000 курсы английского",
+    "450 кофе с собой",
+    "привет, как дела?",
+]
+
+
+def make_transactions(rows: int, days: int):
+    now = datetime.now()
+    return [
+        Transaction(
+            amount=random.randint(1, 5000),
+            type=random.choice(['income', 'expense', 'expense', 'expense']),
+            category=random.choice(CATEGORIES),
+            description='',
+            user_id=1,
+            chat_id=CHAT_ID,
+            timestamp=now - timedelta(minutes=random.randint(0, 60 * 24 * days))
+        )
+        for _ in range(rows)
+    ]
+
+
+def make_database(path: str, rows: int) -> Database:
+    db = Database(write_behind=False, database_url=f'sqlite:///{path}')
+    with db.engine.begin() as connection:
+        connection.execute(Transaction.__table__.insert(), [transaction_to_row(t) for t in make_transactions(rows, 90)])
+    session = db.Session()
+    rebuild_daily_totals(session)
+    session.commit()
+    session.close()
+    return db
+
+
+def measure(func, repeat: int, min_time: float):
+    """(лучшее, медианное) время одного вызова в секундах"""
+    func()
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            break
+        loops = max(loops * 2, int(loops * min_time / max(elapsed, 1e-9)))
+    timings = [elapsed / loops]
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        timings.append((time.perf_counter() - started) / loops)
+    return min(timings), median(timings)
+
+
+def cases(db: Database, transactions):
+    messages = iter(SAMPLES * 1000)
+    start_date = datetime.now() - timedelta(days=30)
+
+    def parse_message():
+        nonlocal messages
+        text = next(messages, None)
+        if text is None:
+            messages = iter(SAMPLES * 1000)
+            text = next(messages)
+        MessageParser.parse_message(text)
+
+    return {
+        'parse_message': parse_message,
+        'get_statistics': lambda: db.get_statistics(CHAT_ID, start_date),
+        'create_pie_chart:expense': lambda: Visualizer.create_pie_chart(transactions, 'expense'),
+        'create_pie_chart:income': lambda: Visualizer.create_pie_chart(transactions, 'income'),
+        'create_time_series': lambda: Visualizer.create_time_series(transactions),
+        'create_category_bar': lambda: Visualizer.create_category_bar_chart(transactions),
+    }
+
+
+def format_time(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:9.2f} мкс"
+    return f"{seconds * 1e3:9.2f} мс"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=20000, help="Транзакций в базе для get_statistics")
+    parser.add_argument('--chart-rows', type=int, default=2000, help="Транзакций на графиках")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2, help="Минимальная длительность пачки, с")
+    parser.add_argument('--only', nargs='+', help="Запустить только эти бенчмарки (по префиксу имени)")
+    parser.add_argument('--save', help="Сохранить результаты в JSON")
+    parser.add_argument('--compare', help="Сравнить с результатами из JSON")
+    parser.add_argument('--threshold', type=float, default=0.15, help="Допустимое замедление при сравнении")
+    args = parser.parse_args()
+
+    random.seed(0)
+    warm_up()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db = make_database(os.path.join(tmp, 'bench.db'), args.rows)
+        transactions = make_transactions(args.chart_rows, 30)
+        print(f"Строк в базе: {args.rows}, на графиках: {args.chart_rows}\n")
+        for name, func in cases(db, transactions).items():
+            if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                continue
+            best, typical = measure(func, args.repeat, args.min_time)
+            results[name] = best
+            print(f"{name:<28} лучшее {format_time(best)}   медиана {format_time(typical)}")
+        db.close()
+
+    if args.save:
+        regression.save(args.save, results, rows=args.rows, chart_rows=args.chart_rows)
+    if args.compare:
+        regressions = regression.compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"\nЗамедлились: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Бенчмарк: доставка /report в Telegram.
+
+Запускает src/main.py против локального фейкового Bot API с задержкой
+загрузки, пропорциональной размеру запроса, и несколько раз запрашивает
+/report по заполненной SQLite базе. Кэш графиков и повторное использование
+результата отключены, поэтому каждый отчет строится заново. Для каждого
+варианта кодирования и отправки выводятся объем отправленных данных и
+время от сообщения /report до последнего ответа.
+
+Варианты:
+    photos-png     отдельные фото в PNG (как до альбомов)
+    group-png8     альбом, PNG с палитрой (по умолчанию)
+    group-webp     альбом, WebP
+    group-jpeg     альбом, JPEG
+
+Запуск:
+    python benchmarks/bench_report_delivery.py --rows 20000 --reports 5 --bandwidth 1000000
+"""
+import os
+import sys
+import time
+import random
+import signal
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+from statistics import median
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from fake_bot_api import FakeBotAPI
+from models.transaction import Transaction
+from utils.database import Database, transaction_to_row
+from utils.rollups import rebuild_daily_totals
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+CHAT_ID = 1
+VARIANTS = {
+    'photos-png': {'CHART_FORMAT': 'png', 'REPORT_MEDIA_GROUP': '0'},
+    'group-png8': {'CHART_FORMAT': 'png8', 'REPORT_MEDIA_GROUP': '1'},
+    'group-webp': {'CHART_FORMAT': 'webp', 'REPORT_MEDIA_GROUP': '1'},
+    'group-jpeg': {'CHART_FORMAT': 'jpeg', 'REPORT_MEDIA_GROUP': '1'},
+}
+
+
+class BandwidthBotAPI(FakeBotAPI):
+    """Фейковый API, который "загружает" файлы с ограниченной скоростью"""
+
+    def __init__(self, bandwidth: float, **kwargs):
+        super().__init__(**kwargs)
+        self.bandwidth = bandwidth
+
+    def handle(self, method: str, params: dict, size: int):
+        if self.bandwidth and method.startswith('send'):
+            time.sleep(size / self.bandwidth)
+        return super().handle(method, params, size)
+
+
+def fill(path: str, rows: int):
+    db = Database(write_behind=False, database_url=f'sqlite:///{path}')
+    now = datetime.now()
+    categories = ['продукты', 'транспорт', 'развлечения', 'здоровье', 'другое']
+    batch = [
+        transaction_to_row(Transaction(
+            amount=random.randint(1, 5000),
+            type=random.choice(['income', 'expense']),
+            category=random.choice(categories),
+            description='',
+            user_id=1,
+            chat_id=CHAT_ID,
+            timestamp=now - timedelta(minutes=random.randint(0, 60 * 24 * 29))
+        ))
+        for _ in range(rows)
+    ]
+    with db.engine.begin() as connection:
+        connection.execute(Transaction.__table__.insert(), batch)
+    session = db.Session()
+    rebuild_daily_totals(session)
+    session.commit()
+    session.close()
+    db.close()
+
+
+def run_variant(name: str, database_path: str, reports: int, bandwidth: float, latency: float, timeout: float) -> dict:
+    api = BandwidthBotAPI(bandwidth, latency=latency)
+    api.start()
+    env = dict(os.environ)
+    env.update(VARIANTS[name])
+    env.update({
+        'TELEGRAM_BOT_TOKEN': '123456:bench',
+        'TELEGRAM_API_BASE_URL': api.base_url,
+        'PYTHONPATH': os.path.join(ROOT, 'src'),
+        'DATABASE_PATH': database_path,
+        # Каждый отчет строится заново
+        'CHART_CACHE_MAX_BYTES': '0',
+    })
+    for variable in ('DATABASE_URL', 'DATABASE_PUBLIC_URL', 'SHARD_WORKERS'):
+        env.pop(variable, None)
+
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'src', 'main.py')],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    latencies = []
+    sent_bytes = []
+    try:
+        if not api.wait_for_request('getUpdates', timeout):
+            raise RuntimeError("Бот не запустился")
+        # Первый отчет прогревает процессы графиков и не учитывается
+        for run in range(reports + 1):
+            before = len(api.sent)
+            expected = 1 if VARIANTS[name]['REPORT_MEDIA_GROUP'] == '1' else 3
+            started = time.monotonic()
+            api.push_update(CHAT_ID, '/report')
+            if not api.wait_for_sent(before + expected, timeout):
+                raise RuntimeError("Бот не отправил отчет")
+            if run:
+                replies = api.sent[before:]
+                latencies.append(replies[-1].time - started)
+                sent_bytes.append(sum(reply.bytes for reply in replies))
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        api.stop()
+    return {'latency': median(latencies), 'bytes': median(sent_bytes)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--reports', type=int, default=5)
+    parser.add_argument('--bandwidth', type=float, default=1000000, help="Скорость загрузки, байт/с (0 - без ограничения)")
+    parser.add_argument('--api-latency', type=float, default=0.1, help="Задержка ответа API на отправку, с")
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--variants', nargs='+', choices=list(VARIANTS), default=list(VARIANTS))
+    args = parser.parse_args()
+
+    random.seed(0)
+    print(f"Строк: {args.rows}, скорость загрузки: {args.bandwidth / 1000:.0f} КБ/с, задержка API: {args.api_latency * 1000:.0f} мс\n")
+    with tempfile.TemporaryDirectory() as tmp:
+        database_path = os.path.join(tmp, 'bench.db')
+        fill(database_path, args.rows)
+        for name in args.variants:
+            result = run_variant(name, database_path, args.reports, args.bandwidth, args.api_latency, args.timeout)
+            print(f"{name:<12} отправлено {result['bytes'] / 1024:8.1f} КБ   до последнего ответа {result['latency']:6.3f} с")
+
+
+if __name__ == '__main__':
+    main()
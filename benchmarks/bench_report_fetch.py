@@ -0,0 +1,92 @@
+"""
+Бенчмарк: выборка транзакций для /report.
+
+Сравнивает старый путь (ORM-объекты из get_transactions и отдельный
+DataFrame для каждого из трех графиков) с колоночной выборкой
+get_transaction_columns и одним общим DataFrame. Замеряет время и пиковую
+память (tracemalloc) на локальной SQLite базе.
+
+Запуск:
+    python benchmarks/bench_report_fetch.py --rows 100000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import pandas as pd
+from models.transaction import Transaction
+from utils.database import Database, transaction_to_row
+from utils.chart_renderer import columns_to_frame
+
+CHAT_ID = 1
+
+
+def fill(db: Database, rows: int):
+    now = datetime.now()
+    categories = ['продукты', 'транспорт', 'развлечения', 'здоровье', 'другое']
+    batch = [
+        transaction_to_row(Transaction(
+            amount=random.randint(1, 5000),
+            type=random.choice(['income', 'expense']),
+            category=random.choice(categories),
+            description='',
+            user_id=1,
+            chat_id=CHAT_ID,
+            timestamp=now - timedelta(minutes=random.randint(0, 60 * 24 * 29))
+        ))
+        for _ in range(rows)
+    ]
+    with db.engine.begin() as connection:
+        connection.execute(Transaction.__table__.insert(), batch)
+
+
+def orm_path(db: Database, start_date: datetime):
+    transactions = db.get_transactions(CHAT_ID, start_date)
+    # Каждый график строил свой DataFrame из списка словарей
+    frames = [
+        pd.DataFrame([{'category': t.category, 'amount': t.amount} for t in transactions if t.type == 'expense']),
+        pd.DataFrame([{'category': t.category, 'amount': t.amount} for t in transactions if t.type == 'income']),
+        pd.DataFrame([{'date': t.timestamp.date(), 'amount': t.amount, 'type': t.type} for t in transactions]),
+    ]
+    return frames
+
+
+def columnar_path(db: Database, start_date: datetime):
+    return columns_to_frame(db.get_transaction_columns(CHAT_ID, start_date))
+
+
+def measure(name: str, func, *args):
+    tracemalloc.start()
+    started = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<28} {elapsed:8.3f} с   пик памяти {peak / 1024 / 1024:8.1f} МБ")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(write_behind=False, database_url=f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        fill(db, args.rows)
+        start_date = datetime.now() - timedelta(days=30)
+
+        print(f"Строк в чате: {args.rows}")
+        measure("ORM + 3 DataFrame", orm_path, db, start_date)
+        measure("Колонки + 1 DataFrame", columnar_path, db, start_date)
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
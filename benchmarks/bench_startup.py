@@ -0,0 +1,114 @@
+"""
+Бенчмарк: время холодного старта бота.
+
+Запускает src/main.py с -X importtime против локального фейкового Bot API,
+отправляет одно сообщение /start и замеряет время от запуска процесса до
+ответа бота (time-to-first-update). Выводит самые дорогие импорты верхнего
+уровня и проверяет, какие тяжелые пакеты загружены до первого ответа.
+
+Переменные окружения базы данных берутся из текущего окружения; если они
+не заданы, используется временная SQLite база (DATABASE_PATH).
+
+Запуск:
+    python benchmarks/bench_startup.py --runs 3
+"""
+import os
+import sys
+import time
+import signal
+import argparse
+import tempfile
+import subprocess
+from statistics import median
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fake_bot_api import FakeBotAPI
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+HEAVY_PACKAGES = ('matplotlib', 'seaborn', 'pandas', 'plotly')
+
+
+def parse_importtime(lines):
+    """Возвращает [(cumulative_us, module)] для импортов верхнего уровня"""
+    top = []
+    for line in lines:
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        # Вложенность импорта обозначается отступом по два пробела
+        name = name.rstrip('\n')[1:]
+        if not name.startswith(' '):
+            top.append((int(cumulative_us), name))
+    return top
+
+
+def run_once(timeout: float, tmp_dir: str):
+    api = FakeBotAPI()
+    api.start()
+    api.push_update(chat_id=1, text='/start')
+
+    env = dict(os.environ)
+    env.update({
+        'TELEGRAM_BOT_TOKEN': '123456:bench',
+        'TELEGRAM_API_BASE_URL': api.base_url,
+        'PYTHONPATH': os.path.join(ROOT, 'src'),
+    })
+    if not any(env.get(name) for name in ('DATABASE_URL', 'DATABASE_PUBLIC_URL', 'DATABASE_PATH')):
+        env['DATABASE_PATH'] = os.path.join(tmp_dir, 'bench.db')
+    with tempfile.TemporaryFile(mode='w+') as stderr:
+        started = time.monotonic()
+        process = subprocess.Popen(
+            [sys.executable, '-X', 'importtime', os.path.join(ROOT, 'src', 'main.py')],
+            env=env, stdout=subprocess.DEVNULL, stderr=stderr
+        )
+        try:
+            replied = api.wait_for_sent(1, timeout)
+            first_update = api.sent[0].time - started if replied else None
+        finally:
+            process.send_signal(signal.SIGINT)
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            api.stop()
+
+        stderr.seek(0)
+        lines = stderr.readlines()
+
+    top = parse_importtime(lines)
+    return first_update, top, [line for line in lines if not line.startswith('import time:')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    timings = []
+    top = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for run in range(args.runs):
+            first_update, top, log = run_once(args.timeout, tmp_dir)
+            if first_update is None:
+                print("Бот не ответил за отведенное время. Лог процесса:")
+                print(''.join(log[-20:]))
+                sys.exit(1)
+            timings.append(first_update)
+            print(f"Запуск {run + 1}: ответ на первое обновление через {first_update:.3f} с")
+
+    print(f"\nTime-to-first-update, медиана: {median(timings):.3f} с")
+    # В вывод -X importtime попадают и процессы пула графиков, и фоновый прогрев
+    print("\nСамые дорогие импорты верхнего уровня (последний запуск, все процессы):")
+    for cumulative_us, module in sorted(top, reverse=True)[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} мс  {module}")
+    # Тяжелые пакеты могут загружаться фоновым прогревом уже после старта
+    loaded = {module.split('.')[0] for _, module in top}
+    for package in HEAVY_PACKAGES:
+        print(f"  {package}: {'загружен' if package in loaded else 'не загружен'}")
+
+
+if __name__ == '__main__':
+    main()
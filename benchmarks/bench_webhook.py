@@ -0,0 +1,191 @@
+"""
+Бенчмарк: пропускная способность polling и webhook режимов.
+
+Запускает src/main.py против локального фейкового Bot API и временной
+SQLite базы, отправляет сообщения из множества чатов и ждет ответа на
+каждое. Сравниваются режимы:
+
+    polling-sequential  polling, по одному обновлению (CONCURRENT_UPDATES=1)
+    polling             polling с параллельной обработкой чатов
+    webhook             встроенный webhook-сервер с параллельной обработкой
+    sharded             polling с распределением чатов по процессам-шардам
+                        (SHARD_WORKERS, по умолчанию 2)
+
+Также проверяется, что ответы в каждом чате идут в порядке сообщений.
+
+Запуск:
+    python benchmarks/bench_webhook.py --chats 50 --messages 500 --api-latency 0.05
+"""
+import os
+import sys
+import json
+import time
+import socket
+import random
+import signal
+import argparse
+import tempfile
+import subprocess
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fake_bot_api import FakeBotAPI
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+MODES = ('polling-sequential', 'polling', 'webhook', 'sharded')
+# Параллельных соединений, которыми тест отправляет обновления на webhook
+WEBHOOK_CONNECTIONS = 16
+TEXTS = ['500 продукты', '250 такси', '1200 аптека', '50000+ зарплата', '/stats']
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def make_traffic(chats: int, messages: int):
+    random.seed(0)
+    return [(random.randint(1, chats), random.choice(TEXTS)) for _ in range(messages)]
+
+
+def wait_for_port(port: int, timeout: float) -> bool:
+    """Ждет, пока webhook-сервер бота начнет принимать соединения.
+
+    PTB вызывает setWebhook до запуска своего HTTP-сервера, поэтому вызов
+    setWebhook еще не означает готовность.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def post_update(port: int, update: dict):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        connection.request('POST', '/telegram', json.dumps(update), {'Content-Type': 'application/json'})
+        connection.getresponse().read()
+    finally:
+        connection.close()
+
+
+def check_order(api: FakeBotAPI) -> bool:
+    """Ответы каждого чата должны идти в порядке исходных сообщений"""
+    last = {}
+    for sent in api.sent:
+        if sent.reply_to is None:
+            continue
+        if sent.reply_to < last.get(sent.chat_id, 0):
+            return False
+        last[sent.chat_id] = sent.reply_to
+    return True
+
+
+def run_mode(mode: str, traffic, api_latency: float, timeout: float, tmp_dir: str) -> dict:
+    api = FakeBotAPI(latency=api_latency)
+    api.start()
+
+    env = dict(os.environ)
+    env.update({
+        'TELEGRAM_BOT_TOKEN': '123456:bench',
+        'TELEGRAM_API_BASE_URL': api.base_url,
+        'PYTHONPATH': os.path.join(ROOT, 'src'),
+        'DATABASE_PATH': os.path.join(tmp_dir, f'{mode}.db'),
+        'CONCURRENT_UPDATES': '1' if mode == 'polling-sequential' else env.get('CONCURRENT_UPDATES', '64'),
+    })
+    for name in ('DATABASE_URL', 'DATABASE_PUBLIC_URL'):
+        env.pop(name, None)
+    if mode == 'sharded':
+        env['SHARD_WORKERS'] = env.get('SHARD_WORKERS') or '2'
+    else:
+        env.pop('SHARD_WORKERS', None)
+    port = None
+    if mode == 'webhook':
+        port = free_port()
+        env.update({
+            'BOT_MODE': 'webhook',
+            'WEBHOOK_URL': f'http://127.0.0.1:{port}',
+            'WEBHOOK_LISTEN': '127.0.0.1',
+            'WEBHOOK_PORT': str(port),
+        })
+
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'src', 'main.py')],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        ready_method = 'setWebhook' if mode == 'webhook' else 'getUpdates'
+        if not api.wait_for_request(ready_method, timeout):
+            raise RuntimeError(f"Бот не запустился в режиме {mode}")
+        if mode == 'webhook' and not wait_for_port(port, timeout):
+            raise RuntimeError("Webhook-сервер бота не принимает соединения")
+        if mode == 'sharded':
+            # Каждый шард при запуске вызывает getMe
+            shards = int(env['SHARD_WORKERS'])
+            deadline = time.monotonic() + timeout
+            while api.requests.get('getMe', 0) < shards + 1 and time.monotonic() < deadline:
+                time.sleep(0.1)
+
+        started = time.monotonic()
+        if mode == 'webhook':
+            # Чат всегда отправляется одним потоком, как Telegram доставляет
+            # обновления чата по порядку; иначе порядок нарушил бы сам тест
+            lanes = [[] for _ in range(WEBHOOK_CONNECTIONS)]
+            for chat_id, text in traffic:
+                lanes[chat_id % WEBHOOK_CONNECTIONS].append(api.make_update(chat_id, text))
+            with ThreadPoolExecutor(max_workers=WEBHOOK_CONNECTIONS) as pool:
+                list(pool.map(lambda lane: [post_update(port, update) for update in lane], lanes))
+        else:
+            for chat_id, text in traffic:
+                api.push_update(chat_id, text)
+
+        completed = api.wait_for_sent(len(traffic), timeout)
+        elapsed = (api.sent[-1].time if api.sent else time.monotonic()) - started
+        return {
+            'mode': mode,
+            'completed': completed,
+            'replies': len(api.sent),
+            'elapsed': elapsed,
+            'throughput': len(api.sent) / elapsed if elapsed > 0 else 0.0,
+            'ordered': check_order(api),
+        }
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--api-latency', type=float, default=0.05, help="Задержка фейкового API на отправку, с")
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    traffic = make_traffic(args.chats, args.messages)
+    print(f"Чатов: {args.chats}, сообщений: {args.messages}, задержка API: {args.api_latency * 1000:.0f} мс\n")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for mode in args.modes:
+            result = run_mode(mode, traffic, args.api_latency, args.timeout, tmp_dir)
+            status = '' if result['completed'] else ' (не все ответы получены)'
+            print(
+                f"{mode:<20} {result['throughput']:8.1f} обновлений/с  "
+                f"за {result['elapsed']:6.2f} с  порядок в чатах: "
+                f"{'сохранен' if result['ordered'] else 'НАРУШЕН'}{status}"
+            )
+
+
+if __name__ == '__main__':
+    main()
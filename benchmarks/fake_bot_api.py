@@ -0,0 +1,248 @@
+"""
+Локальная замена Telegram Bot API для бенчмарков.
+
+Реализует методы, которыми пользуется бот: getMe, getUpdates, sendMessage,
+sendPhoto, sendDocument, sendMediaGroup, getFile (и скачивание файлов) и
+служебные вызовы вебхуков. Обновления добавляются через push_update() и
+push_document(), ответы бота сохраняются в sent.
+"""
+import json
+import time
+import threading
+from dataclasses import dataclass
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+BOT_USER = {
+    'id': 1000000,
+    'is_bot': True,
+    'first_name': 'Bench',
+    'username': 'bench_bot',
+    'can_join_groups': True,
+    'can_read_all_group_messages': True,
+    'supports_inline_queries': False,
+}
+
+
+@dataclass
+class SentMessage:
+    """Ответ бота, полученный фейковым API"""
+    time: float
+    method: str
+    chat_id: int
+    bytes: int
+    reply_to: Optional[int] = None
+
+
+def _parse_body(content_type: str, body: bytes) -> Dict[str, object]:
+    """Разбирает параметры запроса python-telegram-bot (form, multipart или JSON)"""
+    params = {}
+    if content_type.startswith('multipart/form-data'):
+        message = BytesParser().parsebytes(
+            b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body
+        )
+        for part in message.get_payload():
+            name = part.get_param('name', header='content-disposition')
+            if part.get_filename() is None:
+                params[name] = part.get_payload(decode=True).decode()
+    elif content_type.startswith('application/json'):
+        params = json.loads(body or b'{}')
+    else:
+        params = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+    return params
+
+
+class FakeBotAPI:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, poll_timeout: float = 0.5, latency: float = 0.0):
+        self.poll_timeout = poll_timeout
+        # Искусственная задержка ответа на отправку сообщений (сетевой round-trip)
+        self.latency = latency
+        self.updates: List[dict] = []
+        self.sent: List[SentMessage] = []
+        self.requests: Dict[str, int] = {}
+        # Файлы, которые бот может скачать: file_id -> содержимое
+        self.files: Dict[str, bytes] = {}
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.condition = threading.Condition()
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/bot'
+
+    @property
+    def base_file_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/file/bot'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='fake-bot-api', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_update(self, chat_id: int, text: str, user_id: Optional[int] = None) -> dict:
+        """Создает обновление с текстовым сообщением (команды получают entities)"""
+        with self.condition:
+            update_id = self.next_update_id
+            self.next_update_id += 1
+            message_id = self.next_message_id
+            self.next_message_id += 1
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'group', 'title': f'chat {chat_id}'},
+            'from': {'id': user_id or chat_id, 'is_bot': False, 'first_name': 'User'},
+            'text': text,
+        }
+        if text.startswith('/'):
+            command = text.split()[0]
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        return {'update_id': update_id, 'message': message}
+
+    def push_update(self, chat_id: int, text: str, user_id: Optional[int] = None) -> dict:
+        """Ставит сообщение в очередь getUpdates"""
+        update = self.make_update(chat_id, text, user_id)
+        with self.condition:
+            self.updates.append(update)
+            self.condition.notify_all()
+        return update
+
+    def push_document(self, chat_id: int, content: bytes, file_name: str, caption: str = '', user_id: Optional[int] = None) -> dict:
+        """Ставит в очередь сообщение с файлом, который бот может скачать через getFile"""
+        update = self.make_update(chat_id, '', user_id)
+        message = update['message']
+        del message['text']
+        file_id = f'file{update["update_id"]}'
+        self.files[file_id] = content
+        message['document'] = {'file_id': file_id, 'file_unique_id': file_id, 'file_name': file_name, 'file_size': len(content)}
+        if caption:
+            message['caption'] = caption
+        with self.condition:
+            self.updates.append(update)
+            self.condition.notify_all()
+        return update
+
+    def wait_for_sent(self, count: int, timeout: float) -> bool:
+        """Ждет, пока бот отправит не меньше count сообщений"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while len(self.sent) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def wait_for_request(self, method: str, timeout: float) -> bool:
+        """Ждет первого вызова метода API ботом"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while not self.requests.get(method):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def _get_updates(self, params: dict) -> List[dict]:
+        offset = int(params.get('offset') or 0)
+        timeout = min(float(params.get('timeout') or 0), self.poll_timeout)
+        limit = int(params.get('limit') or 100)
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            # Подтвержденные обновления больше не нужны
+            self.updates = [u for u in self.updates if u['update_id'] >= offset]
+            while not self.updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            return self.updates[:limit]
+
+    def _record_sent(self, method: str, params: dict, size: int, messages: int = 1) -> dict:
+        chat_id = int(params.get('chat_id') or 0)
+        reply_to = params.get('reply_to_message_id')
+        with self.condition:
+            self.sent.append(SentMessage(time.monotonic(), method, chat_id, size, int(reply_to) if reply_to else None))
+            message_id = self.next_message_id
+            self.next_message_id += messages
+            self.condition.notify_all()
+        return {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'group', 'title': f'chat {chat_id}'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+
+    def handle(self, method: str, params: dict, size: int):
+        with self.condition:
+            self.requests[method] = self.requests.get(method, 0) + 1
+            self.condition.notify_all()
+        if self.latency and method.startswith('send'):
+            time.sleep(self.latency)
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            return self._get_updates(params)
+        if method == 'getFile':
+            file_id = params.get('file_id')
+            return {'file_id': file_id, 'file_unique_id': file_id,
+                    'file_size': len(self.files.get(file_id, b'')), 'file_path': f'documents/{file_id}'}
+        if method in ('sendMessage', 'sendPhoto', 'sendDocument'):
+            return self._record_sent(method, params, size)
+        if method == 'sendMediaGroup':
+            count = max(len(json.loads(params.get('media') or '[]')), 1)
+            message = self._record_sent(method, params, size, count)
+            return [dict(message, message_id=message['message_id'] + i) for i in range(count)]
+        # deleteWebhook, setWebhook, close и прочие служебные методы
+        return True
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length)
+                method = self.path.rsplit('/', 1)[-1]
+                params = _parse_body(self.headers.get('Content-Type', ''), body)
+                result = api.handle(method, params, length)
+                payload = json.dumps({'ok': True, 'result': result}).encode()
+                try:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Бот закрыл соединение long polling при остановке
+                    pass
+
+            def do_GET(self):
+                # Скачивание файла: /file/bot<token>/documents/<file_id>
+                if self.path.startswith('/file/'):
+                    content = api.files.get(self.path.rsplit('/', 1)[-1])
+                    if content is None:
+                        self.send_error(404)
+                        return
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+                    return
+                self.do_POST()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
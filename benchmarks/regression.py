@@ -0,0 +1,65 @@
+"""
+Сохранение результатов бенчмарков и сравнение с базовым прогоном.
+
+Результат - словарь {метрика: значение}. save() пишет его в JSON вместе с
+версией Python и коммитом, compare() печатает изменение каждой метрики
+относительно базового файла и возвращает метрики, ухудшившиеся больше
+порога. По умолчанию меньшее значение лучше (время, память); метрики из
+higher_is_better (например, пропускная способность) сравниваются наоборот.
+"""
+import os
+import json
+import platform
+import subprocess
+from datetime import datetime
+from typing import Dict, Iterable, List
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, timeout=10
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+def save(path: str, results: Dict[str, float], **meta):
+    data = {
+        'meta': dict(meta, python=platform.python_version(), commit=_commit(),
+                     created=datetime.now().isoformat(timespec='seconds')),
+        'results': results,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def load(path: str) -> Dict[str, float]:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['results']
+
+
+def compare(results: Dict[str, float], baseline_path: str, threshold: float,
+            higher_is_better: Iterable[str] = ()) -> List[str]:
+    """Печатает сравнение с базовым прогоном и возвращает ухудшившиеся метрики"""
+    baseline = load(baseline_path)
+    higher_is_better = set(higher_is_better)
+    regressions = []
+    print(f"\nСравнение с {baseline_path} (порог {threshold:.0%}):")
+    for name, value in results.items():
+        base = baseline.get(name)
+        if not base:
+            print(f"  {name:<40} нет в базовом прогоне")
+            continue
+        change = value / base - 1
+        worse = -change if name in higher_is_better else change
+        mark = ''
+        if worse > threshold:
+            mark = '  РЕГРЕССИЯ'
+            regressions.append(name)
+        elif worse < -threshold:
+            mark = '  улучшение'
+        print(f"  {name:<40} {base:12.6g} -> {value:12.6g}  {change:+7.1%}{mark}")
+    return regressions
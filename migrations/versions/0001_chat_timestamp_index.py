@@ -0,0 +1,35 @@
+"""Индекс (chat_id, timestamp) для таблицы transactions
+
+Revision ID: 0001
+Revises: 0000
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0001'
+down_revision: Union[str, None] = '0000'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEX_NAME = 'ix_transactions_chat_id_timestamp'
+
+
+def _index_exists() -> bool:
+    # Таблицу и индекс может уже создать Database._init_db через create_all
+    inspector = sa.inspect(op.get_bind())
+    return any(ix['name'] == INDEX_NAME for ix in inspector.get_indexes('transactions'))
+
+
+def upgrade() -> None:
+    if not _index_exists():
+        op.create_index(INDEX_NAME, 'transactions', ['chat_id', 'timestamp'])
+
+
+def downgrade() -> None:
+    if _index_exists():
+        op.drop_index(INDEX_NAME, table_name='transactions')
@@ -0,0 +1,56 @@
+"""Таблица daily_totals с дневными суммами по категориям
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Таблицу может уже создать Database._init_db через create_all
+    if sa.inspect(op.get_bind()).has_table('daily_totals'):
+        return
+    daily_totals = op.create_table(
+        'daily_totals',
+        sa.Column('chat_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('category', sa.String(), nullable=False),
+        sa.Column('amount', sa.Float(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('chat_id', 'day', 'type', 'category'),
+    )
+    # Дневные суммы по уже записанным транзакциям
+    transactions = sa.table(
+        'transactions',
+        sa.column('chat_id', sa.Integer()),
+        sa.column('timestamp', sa.DateTime()),
+        sa.column('type', sa.String()),
+        sa.column('category', sa.String()),
+        sa.column('amount', sa.Float()),
+    )
+    if op.get_bind().dialect.name == 'sqlite':
+        # SQLite не умеет CAST в DATE, date() возвращает ту же строку ГГГГ-ММ-ДД
+        day = sa.func.date(transactions.c.timestamp)
+    else:
+        day = sa.cast(transactions.c.timestamp, sa.Date)
+    columns = (transactions.c.chat_id, day, transactions.c.type, transactions.c.category)
+    op.execute(daily_totals.insert().from_select(
+        ['chat_id', 'day', 'type', 'category', 'amount', 'count'],
+        sa.select(*columns, sa.func.sum(transactions.c.amount), sa.func.count()).group_by(*columns)
+    ))
+
+
+def downgrade() -> None:
+    op.drop_table('daily_totals')
@@ -0,0 +1,34 @@
+"""Таблица chat_categories с категориями чатов
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Таблицу может уже создать Database._init_db через create_all
+    if sa.inspect(op.get_bind()).has_table('chat_categories'):
+        return
+    op.create_table(
+        'chat_categories',
+        sa.Column('chat_id', sa.Integer(), nullable=False),
+        sa.Column('keyword', sa.String(), nullable=False),
+        sa.Column('category', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('chat_id', 'keyword'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('chat_categories')
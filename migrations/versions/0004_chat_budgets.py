@@ -0,0 +1,34 @@
+"""Таблица chat_budgets с месячными бюджетами категорий
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Таблицу может уже создать Database._init_db через create_all
+    if sa.inspect(op.get_bind()).has_table('chat_budgets'):
+        return
+    op.create_table(
+        'chat_budgets',
+        sa.Column('chat_id', sa.Integer(), nullable=False),
+        sa.Column('category', sa.String(), nullable=False),
+        sa.Column('amount', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('chat_id', 'category'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('chat_budgets')
@@ -0,0 +1,36 @@
+"""Таблица processed_updates с обработанными обновлениями Telegram
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Таблицу может уже создать Database._init_db через create_all
+    if sa.inspect(op.get_bind()).has_table('processed_updates'):
+        return
+    op.create_table(
+        'processed_updates',
+        sa.Column('update_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('chat_id', sa.Integer(), nullable=False),
+        sa.Column('processed_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('update_id'),
+    )
+    op.create_index('ix_processed_updates_processed_at', 'processed_updates', ['processed_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_processed_updates_processed_at', table_name='processed_updates')
+    op.drop_table('processed_updates')
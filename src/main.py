@@ -1,13 +1,27 @@
 import os
+import time
+import asyncio
 import logging
+import tempfile
 from datetime import datetime, timedelta
+from datetime import time as day_time
+from typing import Optional
 from dotenv import load_dotenv
-from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram import Chat, InputMediaPhoto, Message, Update
+from telegram.ext import (
+    Application, ApplicationHandlerStop, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes
+)
 
-from utils.database import Database
+from utils.database import Database, AsyncDatabase
 from utils.message_parser import MessageParser
-from utils.visualization import Visualizer
+from utils.archive import month_start, next_month
+from utils.chart_renderer import CHART_EXTENSIONS, CHART_FORMAT, ChartRenderer, chart_filename
+from utils.chart_cache import ChartCache, REPORT_CHART_KINDS
+from utils.single_flight import SingleFlight
+from utils.update_processor import ChatOrderedUpdateProcessor
+from utils.digests import DigestStore, DutyCycle, parse_month, previous_month
+from utils.sharding import ShardedDispatcher, connection_budget_per_shard, shard_for
+from utils.metrics import DIGESTS, Gauge, TELEGRAM_SEND_SECONDS, TELEGRAM_SENT_BYTES, start_metrics_server, track_handler
 from models.transaction import Transaction
 
 # Загрузка переменных окружения
@@ -20,9 +34,82 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Инициализация базы данных
-db = Database()
+# База данных, пул процессов для графиков, кэш /report и объединение построения
+# дайджестов создаются в init_services(), чтобы импорт модуля (например, процессом-шардом)
+# не открывал соединения
+db = None
+chart_renderer = None
+chart_cache = None
+single_flight = None
+digest_store = None
+
+# Номер процесса-шарда и число шардов (в одном процессе - 0 и 1)
+shard_index, shard_count = 0, 1
+
+STATS_DAYS = 30
+
+REPORT_DAYS = 30
+
+# Графики /report отправляются одним альбомом (0 - отдельными фото)
+REPORT_MEDIA_GROUP = os.getenv("REPORT_MEDIA_GROUP", "1") == "1"
+
+# Bot API отдает ботам файлы не больше 20 МБ
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024
+
+# Доля бюджета, при достижении которой в подтверждении появляется предупреждение
+BUDGET_WARNING_SHARE = float(os.getenv("BUDGET_WARNING_SHARE", "0.8"))
+# Как часто суммы бюджетов в памяти сверяются с базой, секунд
+BUDGET_RECONCILE_INTERVAL = float(os.getenv("BUDGET_RECONCILE_INTERVAL", "600"))
+
+# Фоновая задача сверки бюджетов, запускается в post_init
+budget_reconciler = None
+
+# Сколько часов хранятся отметки обработанных обновлений (защита от повторной доставки)
+PROCESSED_UPDATES_TTL_HOURS = float(os.getenv("PROCESSED_UPDATES_TTL_HOURS", "48"))
+# Фоновая задача удаления старых отметок, запускается в post_init
+processed_updates_pruner = None
 
+# Обновления, которые записывают транзакции: обычные сообщения и /import
+IMPORT_CAPTION = filters.Document.ALL & filters.CaptionRegex(r'^/import(@\w+)?(\s|$)')
+WRITE_UPDATES = (filters.TEXT & ~filters.COMMAND) | filters.Regex(r'^/import(@\w+)?(\s|$)') | IMPORT_CAPTION
+
+# Месячные дайджесты строятся задачей JobQueue в часы низкой нагрузки
+DIGEST_TIME = os.getenv("DIGEST_TIME", "03:30")
+# Сколько часов после DIGEST_TIME задача может работать
+DIGEST_WINDOW_HOURS = float(os.getenv("DIGEST_WINDOW_HOURS", "3"))
+# Доля одного ядра на отрисовку графиков и доля времени на запросы к базе
+DIGEST_CPU_BUDGET = float(os.getenv("DIGEST_CPU_BUDGET", "0.5"))
+DIGEST_DB_BUDGET = float(os.getenv("DIGEST_DB_BUDGET", "0.2"))
+# Отправлять дайджест прошедшего месяца в чат
+DIGEST_PUSH = os.getenv("DIGEST_PUSH", "0") == "1"
+
+def _stats_gauge(name: str, documentation: str, get_source):
+    """Метрика из stats() сервиса, который создается в init_services()"""
+    def collect():
+        source = get_source()
+        return {(stat,): value for stat, value in source.stats().items()} if source is not None else {}
+    Gauge(name, documentation, collect, ['stat'])
+
+_stats_gauge('chart_cache_stats', 'Состояние кэша графиков /report', lambda: chart_cache)
+_stats_gauge('single_flight_stats', 'Объединение одновременного построения месячных дайджестов', lambda: single_flight)
+
+def init_services(pool_size=None, max_overflow=None, chart_workers=None, metrics_port=None):
+    """Создает базу данных, пул отрисовки графиков, кэши отчетов и объединение построения дайджестов"""
+    global db, chart_renderer, chart_cache, single_flight, digest_store
+    db = AsyncDatabase(Database(pool_size=pool_size, max_overflow=max_overflow))
+    chart_renderer = ChartRenderer(chart_workers)
+    chart_cache = ChartCache()
+    single_flight = SingleFlight()
+    # Дайджесты закрытых месяцев хранятся на диске, если задан DIGEST_PATH
+    digest_path = os.getenv("DIGEST_PATH")
+    digest_store = DigestStore(digest_path) if digest_path else None
+    # HTTP-эндпоинт /metrics включается переменной METRICS_PORT
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    # Создаем процессы отрисовки до старта event loop, графический стек они загрузят сами
+    chart_renderer.start()
+
+@track_handler("start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
     await update.message.reply_text(
@@ -32,10 +119,15 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "1000+ зарплата\n\n"
         "Доступные команды:\n"
         "/stats - статистика за последний месяц\n"
-        "/report - подробный отчет\n"
+        "/report - подробный отчет (/report ГГГГ-ММ - за месяц)\n"
+        "/category - свои категории\n"
+        "/budget - бюджеты на месяц\n"
+        "/export - выгрузка в CSV\n"
+        "/import - загрузка CSV или выписки\n"
         "/help - справка"
     )
 
+@track_handler("help")
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /help"""
     await update.message.reply_text(
@@ -47,23 +139,22 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "2. Отправляйте сообщения о доходах:\n"
         "   - 50000+ зарплата\n"
         "   - 1000+ доход\n\n"
-        "3. Используйте команды:\n"
+        "3. Несколько записей можно отправить одним сообщением:\n"
+        "   - 500 продукты, 200 такси\n\n"
+        "4. Используйте команды:\n"
         "   /stats - статистика за месяц\n"
-        "   /report - подробный отчет\n"
+        "   /report - подробный отчет, /report 2024-03 - итоги месяца\n"
+        "   /category - свои категории и ключевые слова\n"
+        "   /budget - месячные бюджеты категорий\n"
+        "   /export - все записи чата в CSV\n"
+        "   /import - загрузить CSV или банковскую выписку (файл с подписью /import)\n"
         "   /help - эта справка"
     )
 
-async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /stats"""
-    chat_id = update.effective_chat.id
-    start_date = datetime.now() - timedelta(days=30)
-    
-    # Получаем статистику
-    stats = db.get_statistics(chat_id, start_date)
-    
-    # Создаем сообщение
+def format_statistics(title: str, stats: dict) -> str:
+    """Текст статистики: итоги и топ категорий расходов"""
     message = (
-        f"📊 Статистика за последние 30 дней:\n\n"
+        f"📊 {title}:\n\n"
         f"💰 Доходы: {stats['total_income']:.2f}\n"
         f"💸 Расходы: {stats['total_expense']:.2f}\n"
         f"📈 Баланс: {stats['balance']:.2f}\n\n"
@@ -78,73 +169,584 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reverse=True
         )[:5]:
             message += f"- {category}: {amount:.2f}\n"
+    return message
+
+@track_handler("stats")
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /stats"""
+    chat_id = update.effective_chat.id
+    start_date = datetime.now() - timedelta(days=STATS_DAYS)
     
-    await update.message.reply_text(message)
+    stats = await db.get_statistics(chat_id, start_date)
+    
+    await update.message.reply_text(format_statistics(f"Статистика за последние {STATS_DAYS} дней", stats))
 
-async def report(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /report"""
+def reply_to_id(message: Message) -> Optional[int]:
+    """Как reply_* у Message: в группах ответ цитирует сообщение, в личном чате - нет"""
+    return message.message_id if message.chat.type != Chat.PRIVATE else None
+
+async def send_charts(bot, chat_id: int, charts, reply_to_message_id: Optional[int] = None) -> bool:
+    """Отправляет графики отчета (REPORT_CHART_KINDS). Возвращает False, если графиков нет"""
+    images = [(kind, chart) for kind, chart in zip(REPORT_CHART_KINDS, charts) if chart]
+    if not images:
+        return False
+    
+    # Альбом - одна загрузка вместо нескольких (в альбоме от 2 до 10 фото)
+    if REPORT_MEDIA_GROUP and len(images) > 1:
+        TELEGRAM_SENT_BYTES.inc(sum(len(chart) for _, chart in images), method='sendMediaGroup')
+        with TELEGRAM_SEND_SECONDS.time(method='sendMediaGroup'):
+            await bot.send_media_group(
+                chat_id,
+                [InputMediaPhoto(chart, filename=chart_filename(kind)) for kind, chart in images],
+                reply_to_message_id=reply_to_message_id
+            )
+        return True
+    
+    for kind, chart in images:
+        TELEGRAM_SENT_BYTES.inc(len(chart), method='sendPhoto')
+        with TELEGRAM_SEND_SECONDS.time(method='sendPhoto'):
+            await bot.send_photo(chat_id, chart, filename=chart_filename(kind), reply_to_message_id=reply_to_message_id)
+    return True
+
+def month_end(month: datetime) -> datetime:
+    """Последний момент месяца (конец диапазона включается в выборку)"""
+    return next_month(month) - timedelta(microseconds=1)
+
+async def render_month_digest(chat_id: int, month: datetime) -> dict:
+    """Статистика и графики чата за календарный месяц"""
+    end_date = month_end(month)
+    stats = await db.get_statistics(chat_id, month, end_date)
+    columns = await db.get_transaction_columns(chat_id, month, end_date)
+    if len(columns['amount']):
+        # График динамики - за весь месяц, а не за последние дни
+        rendered = await chart_renderer.render_report(columns, days=None)
+    else:
+        rendered = [None, None, None]
+    return {'stats': stats, 'charts': [chart.getvalue() if chart else None for chart in rendered], 'sent': False}
+
+async def get_month_digest(chat_id: int, month: datetime) -> dict:
+    """Дайджест закрытого месяца: готовый из DIGEST_PATH или построенный и сохраненный.
+
+    Ночная задача prerender_digests и /report ГГГГ-ММ могут запросить
+    дайджест одного чата одновременно: строится он один раз.
+    """
+    return await single_flight.run((chat_id, month), lambda: load_or_render_month_digest(chat_id, month))
+
+async def load_or_render_month_digest(chat_id: int, month: datetime) -> dict:
+    fingerprint = await db.get_month_fingerprint(chat_id, month)
+    if digest_store is not None:
+        digest = digest_store.load(chat_id, month, fingerprint, CHART_FORMAT)
+        if digest is not None:
+            DIGESTS.inc(result='cached')
+            return digest
+    digest = await render_month_digest(chat_id, month)
+    # Архивация не меняет отпечаток месяца, но пока она идет, строки месяца
+    # могут быть не видны ни в таблице, ни в архиве. Проверка после отрисовки
+    # видит файл архива или его .tmp, если отрисовка попала в это окно
+    if digest_store is not None and not db.is_month_archived(chat_id, month):
+        digest_store.save(
+            chat_id, month, fingerprint, CHART_FORMAT, digest['stats'], digest['charts'],
+            CHART_EXTENSIONS.get(CHART_FORMAT, 'png')
+        )
+    DIGESTS.inc(result='rendered')
+    return digest
+
+async def month_report(update: Update, context: ContextTypes.DEFAULT_TYPE, month: datetime):
+    """Отчет /report ГГГГ-ММ за календарный месяц"""
     chat_id = update.effective_chat.id
-    start_date = datetime.now() - timedelta(days=30)
+    if month > datetime.now():
+        await update.message.reply_text("Этот месяц еще не начался")
+        return
     
-    # Получаем транзакции
-    transactions = db.get_transactions(chat_id, start_date)
+    if month < month_start(datetime.now()):
+        # Закрытый месяц не меняется: отчет берется из сохраненных дайджестов
+        digest = await get_month_digest(chat_id, month)
+    else:
+        digest = await render_month_digest(chat_id, month)
     
-    if not transactions:
-        await update.message.reply_text("Нет данных за последние 30 дней")
+    if not digest['stats']['categories']:
+        await update.message.reply_text(f"Нет данных за {month:%m.%Y}")
+        return
+    await update.message.reply_text(format_statistics(f"Итоги за {month:%m.%Y}", digest['stats']))
+    await send_charts(context.bot, chat_id, digest['charts'], reply_to_id(update.message))
+
+@track_handler("report")
+async def report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /report: последние 30 дней или /report ГГГГ-ММ - календарный месяц"""
+    if context.args:
+        try:
+            month = parse_month(context.args[0])
+        except ValueError:
+            await update.message.reply_text("Укажите месяц в формате ГГГГ-ММ, например: /report 2024-03")
+            return
+        await month_report(update, context, month)
         return
     
-    # Создаем графики
-    visualizer = Visualizer()
+    chat_id = update.effective_chat.id
+    start_date = datetime.now() - timedelta(days=REPORT_DAYS)
     
-    # Круговая диаграмма расходов
-    expense_chart = visualizer.create_pie_chart(transactions, 'expense')
-    if expense_chart:
-        await update.message.reply_photo(expense_chart)
+    # Окно отчета сдвигается раз в сутки, версия данных - при каждой транзакции
+    window = (REPORT_DAYS, start_date.date())
+    version = db.get_data_version(chat_id)
     
-    # Круговая диаграмма доходов
-    income_chart = visualizer.create_pie_chart(transactions, 'income')
-    if income_chart:
-        await update.message.reply_photo(income_chart)
+    charts = chart_cache.get_report(chat_id, window, version)
+    if charts is None:
+        # Получаем только нужные графикам колонки транзакций
+        columns = await db.get_transaction_columns(chat_id, start_date)
+        
+        # Создаем графики параллельно: расходы, доходы и динамика по времени
+        if len(columns['amount']):
+            rendered = await chart_renderer.render_report(columns)
+        else:
+            rendered = [None, None, None]
+        charts = chart_cache.put_report(chat_id, window, version, rendered)
     
-    # График по времени
-    time_chart = visualizer.create_time_series(transactions)
-    if time_chart:
-        await update.message.reply_photo(time_chart)
+    if not await send_charts(context.bot, chat_id, charts, reply_to_id(update.message)):
+        await update.message.reply_text(f"Нет данных за последние {REPORT_DAYS} дней")
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик текстовых сообщений"""
-    if not update.message or not update.message.text:
-        return
+@track_handler("category")
+async def category_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /category: пользовательские категории чата"""
+    chat_id = update.effective_chat.id
     
-    # Парсим сообщение
-    parsed = MessageParser.parse_message(update.message.text)
-    if not parsed:
+    if len(context.args) < 2:
+        categories = await db.get_chat_categories(chat_id)
+        message = (
+            "Добавить ключевые слова к категории:\n"
+            "/category <категория> <слово> [слово ...]\n"
+            "Например: /category кафе кофе латте\n"
+        )
+        if categories:
+            message += "\nКатегории этого чата:\n"
+            for category, keywords in categories.items():
+                message += f"- {category}: {', '.join(keywords)}\n"
+        await update.message.reply_text(message)
         return
     
-    # Создаем транзакцию
-    transaction = Transaction(
-        id=None,
-        amount=parsed.amount,
-        type=parsed.type,
-        category=parsed.category,
-        description=parsed.description,
-        user_id=update.effective_user.id,
-        chat_id=update.effective_chat.id,
-        timestamp=datetime.now()
+    category, keywords = context.args[0], context.args[1:]
+    categories = await db.add_chat_keywords(chat_id, category, keywords)
+    MessageParser.set_chat_categories(chat_id, categories)
+    await update.message.reply_text(
+        f"Категория {category.lower()}: {', '.join(categories[category.lower()])}"
     )
+
+def format_budgets(budgets) -> str:
+    lines = []
+    for category, spent, limit in budgets:
+        lines.append(f"- {category}: {spent:.2f} из {limit:.2f} ({spent / limit:.0%})")
+    return "\n".join(lines)
+
+@track_handler("budget")
+async def budget_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /budget: месячные бюджеты категорий"""
+    chat_id = update.effective_chat.id
     
-    # Сохраняем в базу
-    db.add_transaction(transaction)
+    if len(context.args) != 2:
+        budgets = await db.get_budgets(chat_id)
+        message = (
+            "Задать месячный бюджет категории:\n"
+            "/budget <категория> <сумма>\n"
+            "Например: /budget продукты 30000\n"
+            "Сумма 0 удаляет бюджет.\n"
+        )
+        if budgets:
+            message += "\nБюджеты этого месяца:\n" + format_budgets(budgets)
+        await update.message.reply_text(message)
+        return
     
-    # Отправляем подтверждение
+    category, amount = context.args
+    try:
+        amount = float(amount.replace(',', '.'))
+    except ValueError:
+        await update.message.reply_text("Сумма бюджета должна быть числом, например: /budget продукты 30000")
+        return
+    if amount < 0:
+        await update.message.reply_text("Сумма бюджета не может быть отрицательной")
+        return
+    
+    budgets = await db.set_chat_budget(chat_id, category, amount)
+    if amount > 0:
+        message = f"Бюджет {category.lower()} на месяц: {amount:.2f}"
+    else:
+        message = f"Бюджет {category.lower()} удален"
+    if budgets:
+        message += "\n\nБюджеты этого месяца:\n" + format_budgets(budgets)
+    await update.message.reply_text(message)
+
+async def load_chat_categories(chat_id: int):
+    """Категории чата загружаются из базы один раз"""
+    if not MessageParser.has_chat_categories(chat_id):
+        MessageParser.set_chat_categories(chat_id, await db.get_chat_categories(chat_id))
+
+@track_handler("export")
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /export: все транзакции чата в CSV"""
+    chat_id = update.effective_chat.id
+    
+    # Транзакции пишутся в файл порциями прямо из курсора базы
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f"transactions_{chat_id}.csv")
+        count = await db.export_csv(chat_id, path)
+        if not count:
+            await update.message.reply_text("В этом чате пока нет записей")
+            return
+        
+        TELEGRAM_SENT_BYTES.inc(os.path.getsize(path), method='sendDocument')
+        with open(path, 'rb') as f, TELEGRAM_SEND_SECONDS.time(method='sendDocument'):
+            await update.message.reply_document(
+                f,
+                filename=os.path.basename(path),
+                caption=f"Записей: {count}"
+            )
+
+@track_handler("import")
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик /import: CSV или выписка в подписи к файлу или в ответе на сообщение с файлом"""
+    message = update.message
+    document = message.document
+    if document is None and message.reply_to_message is not None:
+        document = message.reply_to_message.document
+    if document is None:
+        await message.reply_text(
+            "Отправьте CSV-файл с подписью /import или ответьте /import на сообщение с файлом.\n\n"
+            "Подходят файлы /export и банковские выписки в CSV с колонками даты и суммы. "
+            "Категории определяются по описанию, как в обычных сообщениях. "
+            "Сумма со знаком минус - расход, со знаком плюс - доход."
+        )
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await message.reply_text("Файл больше 20 МБ, разделите его на части")
+        return
+    
+    chat_id = update.effective_chat.id
+    await load_chat_categories(chat_id)
+    categories = list(MessageParser.matcher(chat_id).category_names)
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "import.csv")
+        telegram_file = await document.get_file()
+        await telegram_file.download_to_drive(path)
+        try:
+            imported, skipped = await db.import_csv(
+                chat_id,
+                update.effective_user.id,
+                path,
+                lambda text: MessageParser.classify(text, chat_id),
+                categories,
+                update_id=update.update_id
+            )
+        except ValueError as e:
+            await message.reply_text(f"Не удалось загрузить файл: {e}")
+            return
+    
+    text = f"📥 Загружено записей: {imported}"
+    if skipped:
+        text += f"\nПропущено строк: {skipped}"
+    await message.reply_text(text)
+
+def format_budget_alert(category: str, spent: float, added: float, limit: float) -> str:
+    """Предупреждение о бюджете после новых расходов или пустая строка"""
+    before = spent - added
+    if spent > limit:
+        if before <= limit:
+            return f"🚨 Превышен бюджет {category}: {spent:.2f} из {limit:.2f}"
+        return f"⚠️ Бюджет {category} уже превышен: {spent:.2f} из {limit:.2f}"
+    if spent >= limit * BUDGET_WARNING_SHARE > before:
+        return f"⚠️ Израсходовано {spent / limit:.0%} бюджета {category}: {spent:.2f} из {limit:.2f}"
+    return ""
+
+def format_confirmation(parsed) -> str:
     type_emoji = "💰" if parsed.type == "income" else "💸"
-    await update.message.reply_text(
+    return (
         f"{type_emoji} Записано:\n"
         f"Сумма: {parsed.amount:.2f}\n"
         f"Тип: {'доход' if parsed.type == 'income' else 'расход'}\n"
         f"Категория: {parsed.category}"
     )
 
+@track_handler("handle_message")
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик текстовых сообщений"""
+    if not update.message or not update.message.text:
+        return
+    
+    chat_id = update.effective_chat.id
+    
+    await load_chat_categories(chat_id)
+    
+    # Парсим сообщение: в нем может быть несколько записей
+    entries = MessageParser.parse_entries(update.message.text, chat_id)
+    if not entries:
+        return
+    
+    # Создаем транзакции
+    transactions = [
+        Transaction(
+            id=None,
+            amount=parsed.amount,
+            type=parsed.type,
+            category=parsed.category,
+            description=parsed.description,
+            user_id=update.effective_user.id,
+            chat_id=chat_id,
+            timestamp=datetime.now()
+        )
+        for parsed in entries
+    ]
+    
+    # Сохраняем в базу одной транзакцией вместе с отметкой обновления
+    await db.add_transactions(transactions, update.update_id)
+    
+    # Бюджеты проверяются по суммам в памяти: по одному поиску на категорию
+    added = {}
+    for parsed in entries:
+        if parsed.type == 'expense':
+            added[parsed.category] = added.get(parsed.category, 0) + parsed.amount
+    alerts = []
+    for category, amount in added.items():
+        status = await db.get_budget_status(chat_id, category)
+        if status is not None:
+            alert = format_budget_alert(category, status[0], amount, status[1])
+            if alert:
+                alerts.append(alert)
+    
+    # Отправляем подтверждение
+    await update.message.reply_text("\n\n".join([format_confirmation(parsed) for parsed in entries] + alerts))
+
+async def skip_processed_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Не пускает к обработчикам обновление, записи которого уже сохранены.
+
+    Такое обновление доставляется повторно, например, после перезапуска
+    шарда или при повторной отправке webhook, и не должно записаться дважды.
+    """
+    if await db.is_update_processed(update.update_id):
+        logger.warning(f"Обновление {update.update_id} чата {update.effective_chat.id} уже обработано, пропускаю")
+        raise ApplicationHandlerStop
+
+async def prerender_digests(context: ContextTypes.DEFAULT_TYPE):
+    """Задача JobQueue: строит дайджесты прошедшего месяца для активных чатов.
+
+    Работает не дольше DIGEST_WINDOW_HOURS и после каждого чата делает паузу,
+    чтобы отрисовка занимала не больше DIGEST_CPU_BUDGET ядра, а запросы -
+    не больше DIGEST_DB_BUDGET времени. Готовые дайджесты пропускаются,
+    поэтому незавершенная работа продолжится на следующую ночь.
+    """
+    month = previous_month()
+    deadline = time.monotonic() + DIGEST_WINDOW_HOURS * 3600
+    cpu_budget = DutyCycle(DIGEST_CPU_BUDGET)
+    db_budget = DutyCycle(DIGEST_DB_BUDGET)
+    
+    chats = [
+        chat_id for chat_id in await db.get_active_chats(month)
+        if shard_for(chat_id, shard_count) == shard_index
+    ]
+    done = 0
+    for chat_id in chats:
+        if time.monotonic() > deadline:
+            logger.info(f"Дайджесты за {month:%Y-%m}: окно истекло, построено {done} из {len(chats)}")
+            return
+        
+        # Счетчики занятости учитывают и обычные запросы пользователей,
+        # поэтому в часы нагрузки задача сама замедляется
+        cpu_before, db_before = chart_renderer.busy_seconds, db.busy_seconds
+        digest = await get_month_digest(chat_id, month)
+        cpu_used = chart_renderer.busy_seconds - cpu_before
+        db_used = db.busy_seconds - db_before
+        
+        if DIGEST_PUSH and not digest['sent'] and digest['stats']['categories']:
+            try:
+                await context.bot.send_message(chat_id, format_statistics(f"Итоги за {month:%m.%Y}", digest['stats']))
+                await send_charts(context.bot, chat_id, digest['charts'])
+                if digest_store is not None:
+                    digest_store.mark_sent(chat_id, month)
+                DIGESTS.inc(result='sent')
+            except Exception as e:
+                logger.error(f"Не удалось отправить дайджест в чат {chat_id}: {str(e)}")
+        done += 1
+        
+        await asyncio.sleep(max(cpu_budget.pause(cpu_used), db_budget.pause(db_used)))
+    logger.info(f"Дайджесты за {month:%Y-%m} готовы: {done} чат(ов)")
+
+def schedule_jobs(application: Application):
+    """Ночная задача построения дайджестов (нужен python-telegram-bot[job-queue])"""
+    if digest_store is None:
+        return
+    if DIGEST_CPU_BUDGET == 0 or DIGEST_DB_BUDGET == 0:
+        logger.info("DIGEST_CPU_BUDGET или DIGEST_DB_BUDGET равен 0: дайджесты строятся только по запросу")
+        return
+    for name, share in (("DIGEST_CPU_BUDGET", DIGEST_CPU_BUDGET), ("DIGEST_DB_BUDGET", DIGEST_DB_BUDGET)):
+        if not 0 < share <= 1:
+            logger.error(f"{name}={share} вне диапазона (0, 1], ночное построение дайджестов не запущено")
+            return
+    if application.job_queue is None:
+        logger.warning("JobQueue недоступна (нет APScheduler), дайджесты строятся только по запросу")
+        return
+    hour, minute = (int(part) for part in DIGEST_TIME.split(':'))
+    # Время задается в местном часовом поясе сервера
+    tz = datetime.now().astimezone().tzinfo
+    application.job_queue.run_daily(prerender_digests, day_time(hour, minute, tzinfo=tz), name="digests")
+
+async def reconcile_budgets_periodically():
+    """Периодически сверяет суммы бюджетов в памяти с базой"""
+    while True:
+        await asyncio.sleep(BUDGET_RECONCILE_INTERVAL)
+        try:
+            fixed = await db.reconcile_budgets()
+            if fixed:
+                logger.warning(f"Сверка бюджетов: исправлено чатов: {fixed}")
+        except Exception as e:
+            logger.error(f"Ошибка сверки бюджетов: {str(e)}")
+
+async def prune_processed_updates_periodically():
+    """Раз в час удаляет отметки обновлений, которые уже не доставят повторно"""
+    while True:
+        try:
+            older_than = datetime.now() - timedelta(hours=PROCESSED_UPDATES_TTL_HOURS)
+            deleted = await db.prune_processed_updates(older_than)
+            if deleted:
+                logger.info(f"Удалено отметок обработанных обновлений: {deleted}")
+        except Exception as e:
+            logger.error(f"Ошибка удаления отметок обработанных обновлений: {str(e)}")
+        await asyncio.sleep(3600)
+
+async def flush_writes():
+    """Барьер перед подтверждением обновлений шарда: записи должны быть в базе"""
+    await db.flush_writes()
+
+async def post_init(application: Application):
+    """Фоновая загрузка графического стека, сверка бюджетов и очистка отметок после старта бота"""
+    global budget_reconciler, processed_updates_pruner
+    chart_renderer.warm_up_in_background()
+    if BUDGET_RECONCILE_INTERVAL > 0:
+        budget_reconciler = asyncio.create_task(reconcile_budgets_periodically())
+    # В режиме шардов отметки чистит каждый шард: запрос идемпотентен
+    processed_updates_pruner = asyncio.create_task(prune_processed_updates_periodically())
+
+async def post_shutdown(application: Application):
+    """Освобождение ресурсов при остановке бота"""
+    for task in (budget_reconciler, processed_updates_pruner):
+        if task is not None:
+            task.cancel()
+    logger.info(f"Объединение построения дайджестов: {single_flight.stats()}")
+    db.close()
+    chart_renderer.close()
+
+def add_handlers(application: Application):
+    # Группа -1 проверяется раньше обработчиков, которые записывают транзакции
+    application.add_handler(MessageHandler(WRITE_UPDATES, skip_processed_update), group=-1)
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("stats", stats))
+    application.add_handler(CommandHandler("report", report))
+    application.add_handler(CommandHandler("category", category_command))
+    application.add_handler(CommandHandler("budget", budget_command))
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(CommandHandler("import", import_command))
+    # Команда в подписи к файлу не распознается CommandHandler
+    application.add_handler(MessageHandler(IMPORT_CAPTION, import_command))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+
+def build_application(token: str, post_init=None, post_shutdown=None, updater: bool = True) -> Application:
+    """Создает приложение: чаты обрабатываются параллельно, обновления одного чата - по порядку"""
+    concurrent_updates = int(os.getenv("CONCURRENT_UPDATES", "64"))
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(ChatOrderedUpdateProcessor(concurrent_updates))
+    )
+    if post_init:
+        builder = builder.post_init(post_init)
+    if post_shutdown:
+        builder = builder.post_shutdown(post_shutdown)
+    # Процесс-шард получает обновления от диспетчера, а не из Bot API
+    if not updater:
+        builder = builder.updater(None)
+    
+    # Адрес Bot API можно переопределить, например, для локального тестового сервера
+    base_url = os.getenv("TELEGRAM_API_BASE_URL")
+    if base_url:
+        builder = builder.base_url(base_url)
+    base_file_url = os.getenv("TELEGRAM_API_BASE_FILE_URL")
+    if base_file_url:
+        builder = builder.base_file_url(base_file_url)
+    
+    return builder.build()
+
+def create_shard_application(index: int, count: int) -> Application:
+    """Приложение процесса-шарда со своей долей соединений с базой"""
+    global shard_index, shard_count
+    shard_index, shard_count = index, count
+    budget = int(os.getenv("DB_CONNECTION_BUDGET", "15"))
+    metrics_port = int(os.getenv("METRICS_PORT", "0"))
+    init_services(
+        pool_size=connection_budget_per_shard(budget, count),
+        max_overflow=0,
+        chart_workers=int(os.getenv("SHARD_CHART_WORKERS", "1")),
+        # Каждый шард отдает свои метрики на следующем по порядку порту
+        metrics_port=metrics_port + index + 1 if metrics_port else None
+    )
+    application = build_application(
+        os.getenv("TELEGRAM_BOT_TOKEN"),
+        post_init=post_init,
+        post_shutdown=post_shutdown,
+        updater=False
+    )
+    add_handlers(application)
+    schedule_jobs(application)
+    return application
+
+def run_webhook(application: Application):
+    """Запуск встроенного webhook-сервера python-telegram-bot"""
+    webhook_url = os.getenv("WEBHOOK_URL")
+    if not webhook_url:
+        logger.error("Для BOT_MODE=webhook требуется WEBHOOK_URL")
+        return
+    
+    url_path = os.getenv("WEBHOOK_PATH", "telegram")
+    application.run_webhook(
+        listen=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+        # Railway передает порт сервиса в PORT
+        port=int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8443"))),
+        url_path=url_path,
+        webhook_url=f"{webhook_url.rstrip('/')}/{url_path}",
+        secret_token=os.getenv("WEBHOOK_SECRET_TOKEN") or None,
+        max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+    )
+
+def run(application: Application):
+    """Запуск бота в режиме polling или webhook"""
+    if os.getenv("BOT_MODE", "polling") == "webhook":
+        run_webhook(application)
+    else:
+        application.run_polling()
+
+def run_sharded(token: str, shards: int):
+    """Получает обновления в одном процессе и распределяет их по процессам-шардам"""
+    # С отложенной записью шард подтверждает обновления после сброса очереди
+    write_behind = os.getenv('DB_WRITE_BEHIND', '0') == '1'
+    dispatcher = ShardedDispatcher(
+        create_shard_application,
+        shards,
+        health_timeout=float(os.getenv("SHARD_HEALTH_TIMEOUT", "30")),
+        ack_barrier=flush_writes if write_behind else None,
+        ack_interval=float(os.getenv('DB_WRITE_FLUSH_INTERVAL', '1.0')),
+        max_deliveries=int(os.getenv("SHARD_MAX_DELIVERIES", "3"))
+    )
+    
+    async def forward(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        dispatcher.route(update)
+    
+    async def stop_shards(application: Application):
+        dispatcher.stop()
+    
+    application = build_application(token, post_shutdown=stop_shards)
+    application.add_handler(TypeHandler(Update, forward))
+    
+    # Таблицы создаем до запуска шардов, чтобы они не создавали их одновременно
+    Database(write_behind=False, pool_size=1, max_overflow=0).close()
+    dispatcher.start()
+    run(application)
+
 def main():
     """Запуск бота"""
     # Получаем токен из переменных окружения
@@ -153,18 +755,26 @@ def main():
         logger.error("Не найден TELEGRAM_BOT_TOKEN")
         return
     
-    # Создаем приложение
-    application = Application.builder().token(token).build()
+    # Несколько процессов-шардов, каждый обслуживает свою часть чатов
+    shards = int(os.getenv("SHARD_WORKERS", "1"))
+    if shards > 1:
+        try:
+            connection_budget_per_shard(int(os.getenv("DB_CONNECTION_BUDGET", "15")), shards)
+        except ValueError as e:
+            logger.error(str(e))
+            return
+        run_sharded(token, shards)
+        return
     
-    # Добавляем обработчики
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("stats", stats))
-    application.add_handler(CommandHandler("report", report))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    init_services(metrics_port=int(os.getenv("METRICS_PORT", "0")))
+    application = build_application(token, post_init=post_init, post_shutdown=post_shutdown)
+    
+    # Добавляем обработчики и фоновые задачи
+    add_handlers(application)
+    schedule_jobs(application)
     
     # Запускаем бота
-    application.run_polling()
+    run(application)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main() 
@@ -0,0 +1,74 @@
+"""
+Служебные команды для обслуживания базы данных.
+
+Запуск:
+    python src/manage.py backfill-rollups [--chat-id ID]
+    python src/manage.py check-rollups [--chat-id ID]
+    python src/manage.py archive [--chat-id ID] [--older-than-days N]
+"""
+import os
+import sys
+import logging
+import argparse
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+
+from utils.database import Database
+
+logger = logging.getLogger(__name__)
+
+def backfill_rollups(db: Database, args) -> int:
+    """Пересчитывает таблицу daily_totals по транзакциям"""
+    count = db.rebuild_daily_totals(args.chat_id)
+    print(f"Записано дневных сумм: {count}")
+    return 0
+
+def check_rollups(db: Database, args) -> int:
+    """Сверяет daily_totals с транзакциями"""
+    mismatches = db.check_daily_totals(args.chat_id)
+    for m in mismatches:
+        print(
+            f"chat={m['chat_id']} day={m['day']} {m['type']}/{m['category']}: "
+            f"ожидалось {m['expected_amount']:.2f} ({m['expected_count']}), "
+            f"в daily_totals {m['actual_amount']:.2f} ({m['actual_count']})"
+        )
+    print(f"Расхождений: {len(mismatches)}")
+    return 1 if mismatches else 0
+
+def archive(db: Database, args) -> int:
+    """Переносит старые транзакции в файлы архива (ARCHIVE_PATH)"""
+    older_than = datetime.now() - timedelta(days=args.older_than_days)
+    moved = db.archive_transactions(older_than, args.chat_id)
+    print(f"Перенесено в архив транзакций: {moved}")
+    return 0
+
+COMMANDS = {
+    'backfill-rollups': backfill_rollups,
+    'check-rollups': check_rollups,
+    'archive': archive,
+}
+
+def main() -> int:
+    load_dotenv()
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.WARNING
+    )
+
+    parser = argparse.ArgumentParser(description="Обслуживание базы данных бота")
+    parser.add_argument('command', choices=sorted(COMMANDS))
+    parser.add_argument('--chat-id', type=int, default=None, help="Ограничить одним чатом")
+    parser.add_argument(
+        '--older-than-days', type=int, default=int(os.getenv('ARCHIVE_AFTER_DAYS', '365')),
+        help="Архивировать полные месяцы старше указанного числа дней"
+    )
+    args = parser.parse_args()
+
+    db = Database(write_behind=False)
+    try:
+        return COMMANDS[args.command](db, args)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
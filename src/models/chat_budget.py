@@ -0,0 +1,10 @@
+from sqlalchemy import Column, Integer, Float, String
+from models.transaction import Base
+
+class ChatBudget(Base):
+    """Месячный лимит расходов чата по категории"""
+    __tablename__ = 'chat_budgets'
+
+    chat_id = Column(Integer, primary_key=True)
+    category = Column(String, primary_key=True)
+    amount = Column(Float, nullable=False)
@@ -0,0 +1,10 @@
+from sqlalchemy import Column, Integer, String
+from models.transaction import Base
+
+class ChatCategory(Base):
+    """Ключевое слово пользовательской категории чата"""
+    __tablename__ = 'chat_categories'
+
+    chat_id = Column(Integer, primary_key=True)
+    keyword = Column(String, primary_key=True)
+    category = Column(String, nullable=False)
@@ -0,0 +1,13 @@
+from sqlalchemy import Column, Integer, Float, String, Date
+from models.transaction import Base
+
+class DailyTotal(Base):
+    """Сумма транзакций чата за день по типу и категории"""
+    __tablename__ = 'daily_totals'
+
+    chat_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    type = Column(String, primary_key=True)  # 'income' или 'expense'
+    category = Column(String, primary_key=True)
+    amount = Column(Float, nullable=False, default=0)
+    count = Column(Integer, nullable=False, default=0)
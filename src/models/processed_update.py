@@ -0,0 +1,15 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, DateTime
+from models.transaction import Base
+
+class ProcessedUpdate(Base):
+    """Обновление Telegram, записи которого уже сохранены в базе.
+
+    Строка добавляется в той же транзакции базы, что и записи обновления,
+    поэтому повторно доставленное обновление можно распознать и пропустить.
+    """
+    __tablename__ = 'processed_updates'
+
+    update_id = Column(Integer, primary_key=True, autoincrement=False)
+    chat_id = Column(Integer, nullable=False)
+    processed_at = Column(DateTime, nullable=False, default=datetime.now, index=True)
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, Float, String, DateTime, create_engine
+from sqlalchemy import Column, Integer, Float, String, DateTime, Index, create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -17,6 +17,15 @@ class Transaction(Base):
     chat_id = Column(Integer, nullable=False)
     timestamp = Column(DateTime, nullable=False, default=datetime.now)
 
+    # Обновление Telegram, из которого получена запись. Не хранится в таблице:
+    # при записи по нему добавляется строка processed_updates
+    update_id = None
+
+    __table_args__ = (
+        # Все запросы бота фильтруют по чату и диапазону дат
+        Index('ix_transactions_chat_id_timestamp', 'chat_id', 'timestamp'),
+    )
+
     @classmethod
     def create_expense(cls, amount: float, category: str, description: str, user_id: int, chat_id: int) -> 'Transaction':
         return cls(
@@ -0,0 +1,218 @@
+import os
+import re
+import logging
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from models.transaction import Transaction
+
+# pyarrow импортируется при первом обращении к архиву, чтобы не замедлять запуск бота
+
+logger = logging.getLogger(__name__)
+
+# Колонки файла архива - все колонки таблицы transactions
+ARCHIVE_COLUMNS = ('id', 'amount', 'type', 'category', 'description', 'user_id', 'chat_id', 'timestamp')
+
+MONTH_FILE = re.compile(r'^(\d{4})-(\d{2})\.arrow$')
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+def next_month(month: datetime) -> datetime:
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+def _schema():
+    import pyarrow as pa
+    return pa.schema([
+        ('id', pa.int64()),
+        ('amount', pa.float64()),
+        ('type', pa.string()),
+        ('category', pa.string()),
+        ('description', pa.string()),
+        ('user_id', pa.int64()),
+        ('chat_id', pa.int64()),
+        ('timestamp', pa.timestamp('us')),
+    ])
+
+def rows_to_table(rows: Iterable[Tuple]):
+    """Собирает таблицу Arrow из строк (колонки ARCHIVE_COLUMNS)"""
+    import pyarrow as pa
+    columns = list(zip(*rows)) or [[] for _ in ARCHIVE_COLUMNS]
+    schema = _schema()
+    return pa.table([pa.array(values, type=schema.field(name).type) for name, values in zip(ARCHIVE_COLUMNS, columns)], schema=schema)
+
+class TransactionArchive:
+    """Архив старых транзакций: по файлу Arrow IPC на каждый месяц каждого чата.
+
+    Файлы лежат в {root}/chat_{chat_id}/{ГГГГ-ММ}.arrow без сжатия и читаются
+    через memory map, поэтому чтение колонок не копирует данные. Новый файл
+    сначала пишется во временный .tmp и заменяет старый атомарно (commit_month).
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _chat_dir(self, chat_id: int) -> str:
+        return os.path.join(self.root, f'chat_{chat_id}')
+
+    def month_path(self, chat_id: int, month: datetime) -> str:
+        return os.path.join(self._chat_dir(chat_id), f'{month:%Y-%m}.arrow')
+
+    def chats(self) -> List[int]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            int(name[len('chat_'):]) for name in os.listdir(self.root)
+            if name.startswith('chat_') and name[len('chat_'):].lstrip('-').isdigit()
+        )
+
+    def months(self, chat_id: int) -> List[datetime]:
+        directory = self._chat_dir(chat_id)
+        if not os.path.isdir(directory):
+            return []
+        months = []
+        for name in os.listdir(directory):
+            match = MONTH_FILE.match(name)
+            if match:
+                months.append(datetime(int(match.group(1)), int(match.group(2)), 1))
+        return sorted(months)
+
+    def has_month(self, chat_id: int, month: datetime) -> bool:
+        """Есть ли у месяца файл архива, в том числе еще не замененный .tmp"""
+        path = self.month_path(chat_id, month)
+        return os.path.exists(path) or os.path.exists(path + '.tmp')
+
+    def pending(self) -> List[Tuple[int, datetime, str]]:
+        """Незавершенные записи (.tmp), оставшиеся после сбоя архивации"""
+        result = []
+        for chat_id in self.chats():
+            directory = self._chat_dir(chat_id)
+            for name in os.listdir(directory):
+                match = MONTH_FILE.match(name[:-len('.tmp')]) if name.endswith('.tmp') else None
+                if match:
+                    month = datetime(int(match.group(1)), int(match.group(2)), 1)
+                    result.append((chat_id, month, os.path.join(directory, name)))
+        return result
+
+    @staticmethod
+    def read_file(path: str):
+        import pyarrow as pa
+        # Таблица ссылается на отображенный в память файл, данные не копируются
+        return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+    def read_table(self, chat_id: int, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                   columns: Optional[List[str]] = None, end_inclusive: bool = True):
+        """Транзакции чата из архива за диапазон [start_date, end_date] или None, если их нет"""
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        tables = []
+        for month in self.months(chat_id):
+            if end_date is not None and month > end_date:
+                continue
+            if start_date is not None and next_month(month) <= start_date:
+                continue
+            table = self.read_file(self.month_path(chat_id, month))
+            mask = None
+            if start_date is not None and month < start_date:
+                mask = pc.greater_equal(table['timestamp'], pa.scalar(start_date, pa.timestamp('us')))
+            if end_date is not None and next_month(month) > end_date:
+                compare = pc.less_equal if end_inclusive else pc.less
+                end_mask = compare(table['timestamp'], pa.scalar(end_date, pa.timestamp('us')))
+                mask = end_mask if mask is None else pc.and_(mask, end_mask)
+            if mask is not None:
+                table = table.filter(mask)
+            if columns is not None:
+                table = table.select(columns)
+            if table.num_rows:
+                tables.append(table)
+        if not tables:
+            return None
+        return pa.concat_tables(tables)
+
+    def read_columns(self, chat_id: int, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> Optional[Dict[str, np.ndarray]]:
+        """Колонки (timestamp, amount, type, category) в формате Database.get_transaction_columns"""
+        table = self.read_table(chat_id, start_date, end_date, ['timestamp', 'amount', 'type', 'category'])
+        if table is None:
+            return None
+        return {
+            # datetime64[us] -> datetime, как в колонках из базы
+            'timestamp': table['timestamp'].to_numpy().astype(object),
+            'amount': table['amount'].to_numpy(),
+            'type': table['type'].to_numpy(zero_copy_only=False),
+            'category': table['category'].to_numpy(zero_copy_only=False),
+        }
+
+    def iter_rows(self, chat_id: int, columns: List[str], batch_size: int = 5000) -> Iterator[List[tuple]]:
+        """Порции строк архива чата (кортежи колонок columns) по месяцам, от старых к новым"""
+        for month in self.months(chat_id):
+            table = self.read_file(self.month_path(chat_id, month)).select(columns)
+            for batch in table.to_batches(batch_size):
+                yield list(zip(*(batch.column(i).to_pylist() for i in range(batch.num_columns))))
+
+    def read_transactions(self, chat_id: int, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> List[Transaction]:
+        """Транзакции из архива в виде ORM-объектов (не привязаны к сессии)"""
+        table = self.read_table(chat_id, start_date, end_date)
+        if table is None:
+            return []
+        return [Transaction(**row) for row in table.to_pylist()]
+
+    def category_totals(self, chat_id: int, start_date: datetime, end_date: Optional[datetime], end_inclusive: bool) -> Dict[Tuple[str, str], float]:
+        """Суммы (тип, категория) -> сумма за диапазон"""
+        table = self.read_table(chat_id, start_date, end_date, ['type', 'category', 'amount'], end_inclusive)
+        if table is None:
+            return {}
+        grouped = table.group_by(['type', 'category']).aggregate([('amount', 'sum')])
+        return {
+            (type_, category): amount
+            for type_, category, amount in zip(
+                grouped['type'].to_pylist(), grouped['category'].to_pylist(), grouped['amount_sum'].to_pylist()
+            )
+        }
+
+    def daily_totals(self, chat_id: Optional[int] = None) -> Dict[Tuple[int, date, str, str], Tuple[float, int]]:
+        """Дневные суммы по архиву: (chat_id, day, type, category) -> (сумма, количество)"""
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        totals = defaultdict(lambda: [0.0, 0])
+        for chat in ([chat_id] if chat_id is not None else self.chats()):
+            table = self.read_table(chat, columns=['timestamp', 'type', 'category', 'amount'])
+            if table is None:
+                continue
+            table = table.append_column('day', pc.cast(table['timestamp'], pa.date32()))
+            grouped = table.group_by(['day', 'type', 'category']).aggregate([('amount', 'sum'), ('amount', 'count')])
+            for day, type_, category, amount, count in zip(
+                grouped['day'].to_pylist(), grouped['type'].to_pylist(), grouped['category'].to_pylist(),
+                grouped['amount_sum'].to_pylist(), grouped['amount_count'].to_pylist()
+            ):
+                totals[(chat, day, type_, category)][0] += amount
+                totals[(chat, day, type_, category)][1] += count
+        return {key: (amount, count) for key, (amount, count) in totals.items()}
+
+    def prepare_month(self, chat_id: int, month: datetime, table) -> str:
+        """Пишет месяц (вместе с уже архивированными строками) во временный файл"""
+        import pyarrow as pa
+
+        path = self.month_path(chat_id, month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            table = pa.concat_tables([self.read_file(path), table])
+        table = table.sort_by('timestamp')
+
+        tmp_path = path + '.tmp'
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        return tmp_path
+
+    @staticmethod
+    def commit_month(tmp_path: str):
+        os.replace(tmp_path, tmp_path[:-len('.tmp')])
+
+    @staticmethod
+    def discard_month(tmp_path: str):
+        os.remove(tmp_path)
@@ -0,0 +1,103 @@
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from models.transaction import Transaction
+from utils.archive import month_start
+
+class BudgetTracker:
+    """Бюджеты чатов и расходы текущего месяца по категориям в памяти.
+
+    Состояние чата загружается из базы при первом обращении (load) и затем
+    обновляется каждой новой транзакцией (add), поэтому проверка бюджета -
+    поиск в словаре. Чаты без бюджетов хранят только пустой набор лимитов.
+    Изменения версии данных чата и сумм выполняются под lock. Загрузка и
+    сверка с базой (Database.reconcile_budgets) применяют результат запроса,
+    только если версия чата за это время не изменилась и у чата нет
+    незавершенной записи (writing): иначе новая транзакция могла попасть и
+    в результат запроса, и в суммы в памяти.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Чат -> месяц, за который загружены суммы
+        self.months: Dict[int, datetime] = {}
+        # Чат -> категория -> месячный лимит
+        self.limits: Dict[int, Dict[str, float]] = {}
+        # (чат, месяц, категория) -> расходы
+        self.spent: Dict[Tuple[int, datetime, str], float] = {}
+        # Чат -> количество выполняющихся записей транзакций
+        self.writes: Dict[int, int] = {}
+
+    @contextmanager
+    def writing(self, chat_id: int):
+        """Отмечает запись транзакций чата на время от вставки до обновления сумм"""
+        with self.lock:
+            self.writes[chat_id] = self.writes.get(chat_id, 0) + 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                if self.writes[chat_id] > 1:
+                    self.writes[chat_id] -= 1
+                else:
+                    del self.writes[chat_id]
+
+    def is_writing(self, chat_id: int) -> bool:
+        return chat_id in self.writes
+
+    def is_loaded(self, chat_id: int, month: datetime) -> bool:
+        return self.months.get(chat_id) == month
+
+    def loaded_chats(self) -> List[Tuple[int, datetime]]:
+        with self.lock:
+            return list(self.months.items())
+
+    def load(self, chat_id: int, month: datetime, limits: Dict[str, float], spent: Dict[str, float]):
+        """Заменяет состояние чата загруженным из базы (вызывается под lock)"""
+        self._drop(chat_id)
+        self.months[chat_id] = month
+        self.limits[chat_id] = limits
+        # Суммы нужны только для категорий с бюджетом
+        for category in limits:
+            self.spent[(chat_id, month, category)] = spent.get(category, 0.0)
+
+    def invalidate(self, chat_id: int):
+        """Сбрасывает состояние чата: оно загрузится заново при следующей проверке (под lock)"""
+        self._drop(chat_id)
+        self.months.pop(chat_id, None)
+        self.limits.pop(chat_id, None)
+
+    def _drop(self, chat_id: int):
+        month = self.months.get(chat_id)
+        for category in self.limits.get(chat_id, ()):
+            self.spent.pop((chat_id, month, category), None)
+
+    def add(self, transaction: Transaction):
+        """Учитывает новую транзакцию в суммах загруженного месяца (под lock)"""
+        if transaction.type != 'expense':
+            return
+        key = (transaction.chat_id, month_start(transaction.timestamp or datetime.now()), transaction.category)
+        if key in self.spent:
+            self.spent[key] += transaction.amount
+
+    def status(self, chat_id: int, category: str) -> Optional[Tuple[float, float]]:
+        """(расходы, лимит) категории за загруженный месяц или None, если бюджета нет"""
+        with self.lock:
+            limit = self.limits.get(chat_id, {}).get(category)
+            if limit is None:
+                return None
+            return self.spent.get((chat_id, self.months[chat_id], category), 0.0), limit
+
+    def report(self, chat_id: int) -> List[Tuple[str, float, float]]:
+        """(категория, расходы, лимит) для всех бюджетов чата"""
+        with self.lock:
+            return self.entries(chat_id)
+
+    def entries(self, chat_id: int) -> List[Tuple[str, float, float]]:
+        """То же, что report, для вызова под lock"""
+        month = self.months.get(chat_id)
+        return [
+            (category, self.spent.get((chat_id, month, category), 0.0), limit)
+            for category, limit in sorted(self.limits.get(chat_id, {}).items())
+        ]
@@ -0,0 +1,84 @@
+import io
+import os
+import logging
+from collections import OrderedDict
+from typing import Hashable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Графики /report в порядке отправки
+REPORT_CHART_KINDS = ('pie_expense', 'pie_income', 'time_series')
+
+_MISSING = object()
+
+class ChartCache:
+    """LRU-кэш готовых изображений графиков с ограничением по размеру в байтах.
+
+    Ключ - (chat_id, вид графика, окно, версия данных чата). Версию повышает
+    Database.add_transaction, поэтому после новой транзакции старые графики
+    чата просто перестают запрашиваться и вытесняются по LRU.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        if max_bytes is None:
+            max_bytes = int(os.getenv('CHART_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+        self.max_bytes = max_bytes
+        self.entries: 'OrderedDict[Tuple, Optional[bytes]]' = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(chat_id: int, kind: str, window: Hashable, version: int) -> Tuple:
+        return (chat_id, kind, window, version)
+
+    def get(self, key: Tuple, default=_MISSING):
+        value = self.entries.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Tuple, value: Optional[bytes]):
+        """Сохраняет изображение (None - график пуст) и вытесняет старые записи"""
+        size = len(value) if value else 0
+        if size > self.max_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old:
+            self.size -= len(old)
+        self.entries[key] = value
+        self.size += size
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted) if evicted else 0
+            self.evictions += 1
+
+    def get_report(self, chat_id: int, window: Hashable, version: int) -> Optional[List[Optional[bytes]]]:
+        """Возвращает все графики /report или None, если хотя бы одного нет"""
+        charts = []
+        for kind in REPORT_CHART_KINDS:
+            chart = self.get(self.make_key(chat_id, kind, window, version))
+            if chart is _MISSING:
+                return None
+            charts.append(chart)
+        return charts
+
+    def put_report(self, chat_id: int, window: Hashable, version: int, charts: Sequence[Optional[io.BytesIO]]) -> List[Optional[bytes]]:
+        """Сохраняет графики /report и возвращает их в виде bytes"""
+        values = [chart.getvalue() if chart else None for chart in charts]
+        for kind, value in zip(REPORT_CHART_KINDS, values):
+            self.put(self.make_key(chat_id, kind, window, version), value)
+        return values
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'bytes': self.size,
+        }
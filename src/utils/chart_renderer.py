@@ -0,0 +1,163 @@
+import io
+import os
+import asyncio
+import logging
+import importlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+from utils import metrics
+
+# Модуль намеренно не импортирует matplotlib, seaborn и pandas: они
+# загружаются в процессах пула и при первом /report (или фоновом прогреве),
+# чтобы не замедлять запуск бота.
+
+logger = logging.getLogger(__name__)
+
+# Кодирование графиков: png, png8 (PNG с палитрой 256 цветов), jpeg или webp
+CHART_FORMAT = os.getenv('CHART_FORMAT', 'png8').lower()
+CHART_DPI = int(os.getenv('CHART_DPI', '100'))
+# Качество jpeg и webp
+CHART_QUALITY = int(os.getenv('CHART_QUALITY', '85'))
+CHART_EXTENSIONS = {'png': 'png', 'png8': 'png', 'jpeg': 'jpg', 'webp': 'webp'}
+
+def chart_filename(kind: str) -> str:
+    """Имя файла графика для отправки в Telegram"""
+    return f"{kind}.{CHART_EXTENSIONS.get(CHART_FORMAT, 'png')}"
+
+def columns_to_frame(columns: Dict):
+    """Собирает DataFrame из колонок Database.get_transaction_columns"""
+    import pandas as pd
+    df = pd.DataFrame(columns, copy=False)
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    return df
+
+def _warm_up_worker():
+    """Инициализатор процесса: заранее загружает графический стек"""
+    import matplotlib
+    matplotlib.use('Agg')
+    from utils import visualization
+    visualization.warm_up()
+    # Время графиков возвращается основному процессу вместе с результатом
+    metrics.buffer_chart_timings()
+
+def _render_chart(name: str, *args):
+    # Функция передается в процесс по имени, чтобы не импортировать visualization здесь
+    from utils import visualization
+    png = getattr(visualization, name)(*args)
+    return png, metrics.take_chart_timings()
+
+def _ping() -> int:
+    return os.getpid()
+
+class ChartRenderer:
+    """Рисует графики отчета параллельно в пуле процессов.
+
+    Количество процессов задается CHART_WORKERS. Процессы создаются в start()
+    до запуска event loop и загружают графический стек в фоне.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        if max_workers is None:
+            # Отчет состоит из трех графиков
+            max_workers = int(os.getenv('CHART_WORKERS', min(3, os.cpu_count() or 1)))
+        self.max_workers = max_workers
+        # Пул создается, когда в процессе уже работают потоки (база, метрики,
+        # отложенная запись), и пересоздается после сбоя. fork скопировал бы
+        # блокировки, захваченные этими потоками, поэтому процессы порождает
+        # forkserver - отдельный однопоточный процесс, который один раз
+        # загружает графический стек. Без forkserver (Windows, macOS) - spawn.
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            self.mp_context = multiprocessing.get_context('forkserver')
+            self.mp_context.set_forkserver_preload(['utils.chart_renderer', 'utils.visualization'])
+        else:
+            self.mp_context = multiprocessing.get_context('spawn')
+        self.executor: Optional[ProcessPoolExecutor] = None
+        # Защищает создание и замену пула
+        self.executor_lock = threading.Lock()
+        # Суммарное время построения и кодирования графиков в процессах пула
+        self.busy_seconds = 0.0
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=self.mp_context,
+            initializer=_warm_up_worker
+        )
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = self._create_executor()
+            return self.executor
+
+    def _replace_broken(self, broken: ProcessPoolExecutor) -> ProcessPoolExecutor:
+        """Пересоздает сломанный пул и возвращает рабочий.
+
+        Сбой замечают все графики, которые рисовались в пуле, но новый пул
+        создает только первый из них; остальные получают уже созданный.
+        """
+        with self.executor_lock:
+            if self.executor is not broken:
+                return self.executor
+            logger.error("Пул отрисовки графиков сломан, пересоздаю")
+            self.executor = self._create_executor()
+            executor = self.executor
+        # Процессы сломанного пула уже завершены, освобождаем его потоки и каналы
+        broken.shutdown(wait=False, cancel_futures=True)
+        return executor
+
+    def start(self):
+        """Запускает процессы пула, не дожидаясь их прогрева"""
+        executor = self._get_executor()
+        # Процессы пула создаются на первой задаче
+        for _ in range(self.max_workers):
+            executor.submit(_ping)
+        logger.info(f"Пул отрисовки графиков запущен: {self.max_workers} процесс(ов)")
+
+    def warm_up_in_background(self) -> threading.Thread:
+        """Загружает pandas в основном процессе в фоновом потоке"""
+        thread = threading.Thread(
+            target=importlib.import_module,
+            args=('pandas',),
+            name='chart-warm-up',
+            daemon=True
+        )
+        thread.start()
+        return thread
+
+    async def _render(self, name: str, *args) -> Optional[io.BytesIO]:
+        executor = self._get_executor()
+        loop = asyncio.get_running_loop()
+        try:
+            png, timings = await loop.run_in_executor(executor, _render_chart, name, *args)
+        except BrokenProcessPool:
+            # Процесс пула упал: пересоздаем пул и повторяем один раз
+            executor = self._replace_broken(executor)
+            png, timings = await loop.run_in_executor(executor, _render_chart, name, *args)
+        for chart, render_seconds, encode_seconds in timings:
+            metrics.observe_chart(chart, render_seconds, encode_seconds)
+            self.busy_seconds += render_seconds + encode_seconds
+        return io.BytesIO(png) if png is not None else None
+
+    async def render_report(self, columns: Dict, days: Optional[int] = 30) -> List[Optional[io.BytesIO]]:
+        """Рисует графики для /report параллельно, сохраняя их порядок.
+
+        columns - результат Database.get_transaction_columns; DataFrame
+        собирается один раз и используется всеми графиками. days - период
+        графика динамики (None - все переданные транзакции).
+        """
+        df = columns_to_frame(columns)
+        return list(await asyncio.gather(
+            self._render('render_pie_chart', df, 'expense'),
+            self._render('render_pie_chart', df, 'income'),
+            self._render('render_time_series', df, days),
+        ))
+
+    def close(self):
+        with self.executor_lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -1,10 +1,37 @@
+import io
 import os
+import csv
+import time
+import asyncio
 import logging
+import itertools
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Optional
-from sqlalchemy import create_engine, func
+from functools import partial
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import create_engine, event, func, insert, select
+from sqlalchemy.exc import DisconnectionError, InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, StaticPool
 from sqlalchemy.orm import sessionmaker
 from models.transaction import Base, Transaction
+from models.daily_total import DailyTotal
+from models.chat_category import ChatCategory
+from models.chat_budget import ChatBudget
+from models.processed_update import ProcessedUpdate
+from utils.metrics import DB_POOL_WAIT_SECONDS, DB_WRITE_DEAD_LETTERS, instrument_engine
+from utils.archive import ARCHIVE_COLUMNS, TransactionArchive, month_start, next_month, rows_to_table
+from utils.budgets import BudgetTracker
+from utils.transaction_csv import EXPORT_COLUMNS, ImportRow, StatementReader, write_csv
+from utils.rollups import (
+    add_daily_totals,
+    category_totals,
+    find_rollup_mismatches,
+    increment_daily_totals,
+    rebuild_daily_totals,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -16,42 +43,274 @@ def is_public_url(url: str) -> bool:
     """Проверяет, является ли URL публичным (ballast.proxy.rlwy.net)"""
     return 'ballast.proxy.rlwy.net' in url
 
+def get_database_url() -> str:
+    """Возвращает URL базы данных из переменных окружения"""
+    # Проверяем наличие переменных окружения
+    database_url = os.getenv('DATABASE_URL')
+    database_public_url = os.getenv('DATABASE_PUBLIC_URL')
+
+    logger.info("Проверка переменных окружения для подключения к базе данных")
+
+    if not database_url and not database_public_url:
+        # Без PostgreSQL используем встроенную SQLite базу из DATABASE_PATH
+        database_path = os.getenv('DATABASE_PATH')
+        if database_path:
+            logger.info(f"Использую SQLite базу: {database_path}")
+            return f"sqlite:///{database_path}"
+        logger.error("DATABASE_URL, DATABASE_PUBLIC_URL и DATABASE_PATH не найдены!")
+        logger.error("Проверьте, что PostgreSQL сервис и сервис с ботом находятся в одном проекте")
+        raise ValueError("DATABASE_URL, DATABASE_PUBLIC_URL и DATABASE_PATH не найдены в переменных окружения")
+
+    # Выбираем URL в зависимости от доступности
+    if database_url and database_public_url:
+        logger.info("Найдены оба URL базы данных:")
+        logger.info(f"Внутренний URL (postgres.railway.internal): {is_internal_url(database_url)}")
+        logger.info(f"Публичный URL (ballast.proxy.rlwy.net): {is_public_url(database_public_url)}")
+        # Используем внутренний URL, так как мы в Railway
+        logger.info("Использую внутренний URL (postgres.railway.internal)")
+    elif database_url:
+        logger.info("Использую доступный DATABASE_URL")
+    else:
+        database_url = database_public_url
+        logger.info("Использую доступный DATABASE_PUBLIC_URL")
+
+    # Удаляем 'postgres://' и заменяем на 'postgresql://' если необходимо
+    if database_url.startswith('postgres://'):
+        database_url = database_url.replace('postgres://', 'postgresql://', 1)
+        logger.info("URL базы данных обновлен для использования postgresql://")
+
+    return database_url
+
+def transaction_to_row(transaction: Transaction) -> dict:
+    """Преобразует транзакцию в словарь для массовой вставки"""
+    row = {
+        column.name: getattr(transaction, column.name)
+        for column in Transaction.__table__.columns
+        if column.name != 'id'
+    }
+    if row['timestamp'] is None:
+        row['timestamp'] = datetime.now()
+    return row
+
+# Колонки, которые нужны графикам отчета
+REPORT_COLUMNS = ('timestamp', 'amount', 'type', 'category')
+REPORT_DTYPES = {
+    # Преобразование в datetime64 дешевле сделать один раз в pandas
+    'timestamp': object,
+    'amount': np.float64,
+    'type': object,
+    'category': object,
+}
+
+def empty_columns() -> Dict[str, np.ndarray]:
+    return {name: np.array([], dtype=REPORT_DTYPES[name]) for name in REPORT_COLUMNS}
+
+def rows_to_columns(rows) -> Dict[str, np.ndarray]:
+    """Преобразует порцию строк (timestamp, amount, type, category) в массивы NumPy"""
+    if not rows:
+        return empty_columns()
+    return {
+        name: np.array(values, dtype=REPORT_DTYPES[name])
+        for name, values in zip(REPORT_COLUMNS, zip(*rows))
+    }
+
+# Порядок колонок массовой загрузки транзакций (/import)
+IMPORT_COLUMNS = ('amount', 'type', 'category', 'description', 'user_id', 'chat_id', 'timestamp')
+
+def concat_columns(chunks: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    if not chunks:
+        return empty_columns()
+    if len(chunks) == 1:
+        return chunks[0]
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in REPORT_COLUMNS}
+
+def _group_by_update(batch: List[Transaction]) -> List[List[Transaction]]:
+    """Делит пачку на записи отдельных обновлений (записи без update_id - по одной)"""
+    units: Dict[int, List[Transaction]] = {}
+    for transaction in batch:
+        key = transaction.update_id if transaction.update_id is not None else -id(transaction)
+        units.setdefault(key, []).append(transaction)
+    return list(units.values())
+
+class WriteBehindQueue:
+    """Очередь отложенной записи транзакций.
+
+    Транзакции накапливаются в памяти и записываются пачкой при достижении
+    batch_size или раз в flush_interval секунд в фоновом потоке.
+
+    Ошибка соединения с базой (TRANSIENT_ERRORS) возвращает пачку в начало
+    очереди без ограничения попыток и передается вызывающему. Любая другая
+    ошибка означает, что в пачке есть строка, которую база не примет: пачка
+    записывается по одному обновлению (все записи обновления Telegram
+    пишутся вместе с его строкой processed_updates), обновления с ошибкой
+    возвращаются в очередь, а не записанные за max_attempts сбросов строки
+    убираются в dead_letter с записью в лог. Такие строки не прерывают запись
+    и чтение своего чата.
+    """
+
+    # Ошибки, при которых повтор той же пачки может пройти
+    TRANSIENT_ERRORS = (OperationalError, InterfaceError, DisconnectionError, PoolTimeoutError)
+
+    def __init__(self, flush_func, batch_size: int = 100, flush_interval: float = 1.0, max_attempts: int = 3):
+        self.flush_func = flush_func
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.pending: List[Transaction] = []
+        # Неудачные попытки записи строк, id(транзакции) -> количество
+        self.attempts: Dict[int, int] = {}
+        # Строки, которые не удалось записать за max_attempts попыток
+        self.dead_letter: List[Transaction] = []
+        self.lock = threading.Lock()
+        # Сбросы выполняются строго по одному, чтобы сохранить порядок записей чата
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, name='db-write-behind', daemon=True)
+        self.thread.start()
+
+    def put(self, transaction: Transaction):
+        self.put_many([transaction])
+
+    def put_many(self, transactions: List[Transaction]):
+        """Ставит в очередь записи одного обновления: они попадут в одну пачку"""
+        with self.lock:
+            self.pending.extend(transactions)
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.wakeup.set()
+
+    def has_update(self, update_id: int) -> bool:
+        """Есть ли в очереди записи обновления update_id"""
+        with self.lock:
+            return any(t.update_id == update_id for t in self.pending)
+
+    def flush(self, chat_id: Optional[int] = None):
+        """Записывает ожидающие транзакции (все или только одного чата)"""
+        with self.flush_lock:
+            with self.lock:
+                if chat_id is None:
+                    batch, self.pending = self.pending, []
+                else:
+                    batch = [t for t in self.pending if t.chat_id == chat_id]
+                    if batch:
+                        self.pending = [t for t in self.pending if t.chat_id != chat_id]
+            if not batch:
+                return
+            try:
+                self.flush_func(batch)
+            except self.TRANSIENT_ERRORS:
+                # Возвращаем пачку в начало очереди, чтобы не потерять данные
+                self._requeue(batch)
+                raise
+            except Exception as e:
+                logger.warning(f"Пачка из {len(batch)} транзакций не записана ({str(e)}), записываю по одной")
+                self._flush_rows(batch)
+            else:
+                self._forget(batch)
+
+    def _flush_rows(self, batch: List[Transaction]):
+        """Записывает пачку по одному обновлению, чтобы отделить строки, которые база не принимает"""
+        units = _group_by_update(batch)
+        retry = []
+        for index, unit in enumerate(units):
+            try:
+                self.flush_func(unit)
+            except self.TRANSIENT_ERRORS:
+                # База недоступна: остаток пачки ждет следующего сброса
+                self._requeue(retry + [t for rest in units[index:] for t in rest])
+                raise
+            except Exception as e:
+                # Попытки считаются по первой записи обновления
+                key = id(unit[0])
+                attempts = self.attempts.get(key, 0) + 1
+                if attempts < self.max_attempts:
+                    self.attempts[key] = attempts
+                    retry.extend(unit)
+                    continue
+                self.attempts.pop(key, None)
+                self.dead_letter.extend(unit)
+                DB_WRITE_DEAD_LETTERS.inc(len(unit))
+                for transaction in unit:
+                    logger.error(
+                        f"Транзакция чата {transaction.chat_id} ({transaction.amount} {transaction.category}) "
+                        f"не записана за {attempts} попыток и исключена из очереди: {str(e)}"
+                    )
+            else:
+                self._forget(unit)
+        # Строки с ошибкой ждут следующего сброса; остальные транзакции чата
+        # уже записаны, поэтому чтение не прерывается
+        if retry:
+            self._requeue(retry)
+
+    def _requeue(self, batch: List[Transaction]):
+        with self.lock:
+            self.pending[:0] = batch
+
+    def _forget(self, batch: List[Transaction]):
+        if self.attempts:
+            for transaction in batch:
+                self.attempts.pop(id(transaction), None)
+
+    def _run(self):
+        while not self.stopped:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка отложенной записи транзакций: {str(e)}")
+
+    def close(self):
+        """Останавливает фоновый поток и записывает остаток очереди"""
+        self.stopped = True
+        self.wakeup.set()
+        self.thread.join()
+        self.flush()
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Настраивает каждое новое соединение SQLite"""
+    cursor = dbapi_connection.cursor()
+    # WAL позволяет читать параллельно с записью
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # В режиме WAL NORMAL безопасен при сбое приложения и не делает fsync на каждый коммит
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA mmap_size={int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))}")
+    # Отрицательное значение - размер кэша в КиБ
+    cursor.execute(f"PRAGMA cache_size=-{int(os.getenv('SQLITE_CACHE_SIZE_KB', '65536'))}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+class TimedQueuePool(QueuePool):
+    """QueuePool, который замеряет ожидание свободного соединения"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+
 class Database:
-    def __init__(self):
+    POOL_SIZE = 5
+    MAX_OVERFLOW = 10
+    # SQLite допускает одного писателя, поэтому большой пул не нужен
+    SQLITE_POOL_SIZE = 4
+
+    def __init__(self, write_behind: Optional[bool] = None, database_url: Optional[str] = None,
+                 pool_size: Optional[int] = None, max_overflow: Optional[int] = None):
+        # Размер пула можно ограничить, например, для нескольких процессов-шардов
+        if pool_size is not None:
+            self.POOL_SIZE = self.SQLITE_POOL_SIZE = pool_size
+        if max_overflow is not None:
+            self.MAX_OVERFLOW = max_overflow
+        
         # Логируем все переменные окружения (безопасно, так как это только для отладки)
         env_vars = {k: v for k, v in os.environ.items() if not k.startswith('RAILWAY_')}
         logger.info(f"Доступные переменные окружения: {list(env_vars.keys())}")
         
-        # Проверяем наличие переменных окружения
-        database_url = os.getenv('DATABASE_URL')
-        database_public_url = os.getenv('DATABASE_PUBLIC_URL')
-        
-        logger.info("Проверка переменных окружения для подключения к базе данных")
-        
-        if not database_url and not database_public_url:
-            logger.error("DATABASE_URL и DATABASE_PUBLIC_URL не найдены!")
-            logger.error("Проверьте, что PostgreSQL сервис и сервис с ботом находятся в одном проекте")
-            raise ValueError("DATABASE_URL и DATABASE_PUBLIC_URL не найдены в переменных окружения")
-        
-        # Выбираем URL в зависимости от доступности
-        if database_url and database_public_url:
-            logger.info("Найдены оба URL базы данных:")
-            logger.info(f"Внутренний URL (postgres.railway.internal): {is_internal_url(database_url)}")
-            logger.info(f"Публичный URL (ballast.proxy.rlwy.net): {is_public_url(database_public_url)}")
-            # Используем внутренний URL, так как мы в Railway
-            database_url = database_url
-            logger.info("Использую внутренний URL (postgres.railway.internal)")
-        elif database_url:
-            database_url = database_url
-            logger.info("Использую доступный DATABASE_URL")
-        else:
-            database_url = database_public_url
-            logger.info("Использую доступный DATABASE_PUBLIC_URL")
-            
-        # Удаляем 'postgres://' и заменяем на 'postgresql://' если необходимо
-        if database_url.startswith('postgres://'):
-            database_url = database_url.replace('postgres://', 'postgresql://', 1)
-            logger.info("URL базы данных обновлен для использования postgresql://")
+        if database_url is None:
+            database_url = get_database_url()
         
         # Логируем только хост и порт для безопасности
         db_parts = database_url.split('@')
@@ -62,27 +321,15 @@ class Database:
         
         try:
             logger.info("Попытка создания движка SQLAlchemy")
-            logger.info(f"Используемый URL: {database_url}")
             
-            # Добавляем параметры подключения для SQLAlchemy
-            connect_args = {
-                'connect_timeout': 30,  # Увеличиваем таймаут подключения
-                'keepalives': 1,        # Включаем keepalive
-                'keepalives_idle': 30,  # Время простоя перед отправкой keepalive
-                'keepalives_interval': 10,  # Интервал между keepalive
-                'keepalives_count': 5,   # Количество попыток keepalive
-                'sslmode': 'require'     # Требуем SSL подключение
-            }
-            
-            self.engine = create_engine(
-                database_url,
-                connect_args=connect_args,
-                pool_size=5,            # Размер пула соединений
-                max_overflow=10,        # Максимальное количество дополнительных соединений
-                pool_timeout=30,        # Таймаут ожидания соединения из пула
-                pool_recycle=1800       # Пересоздаем соединения каждые 30 минут
-            )
+            if database_url.startswith('sqlite'):
+                self.engine = self._create_sqlite_engine(database_url)
+            else:
+                logger.info(f"Используемый URL: {database_url}")
+                self.engine = self._create_postgres_engine(database_url)
             
+            # Время SQL-запросов для /metrics
+            instrument_engine(self.engine)
             self.Session = sessionmaker(bind=self.engine)
             logger.info("Движок SQLAlchemy создан успешно")
             
@@ -94,19 +341,223 @@ class Database:
             logger.error(f"Тип ошибки: {type(e).__name__}")
             raise
 
+        # Архив старых транзакций в файлах (python src/manage.py archive)
+        archive_path = os.getenv('ARCHIVE_PATH')
+        self.archive = TransactionArchive(archive_path) if archive_path else None
+        # /stats, дайджесты и бюджеты читают daily_totals
+        self._backfill_daily_totals()
+
+        # Режим отложенной записи включается явно
+        if write_behind is None:
+            write_behind = os.getenv('DB_WRITE_BEHIND', '0') == '1'
+        # Версия данных чата в этом процессе, меняется при каждой записи
+        self.data_versions = {}
+        self._version_counter = itertools.count(1)
+        # Бюджеты и расходы текущего месяца, загружаются по чатам при первой проверке
+        self.budgets = BudgetTracker()
+        
+        self.write_queue = None
+        if write_behind:
+            self.write_queue = WriteBehindQueue(
+                self._insert_batch,
+                batch_size=int(os.getenv('DB_WRITE_BATCH_SIZE', '100')),
+                flush_interval=float(os.getenv('DB_WRITE_FLUSH_INTERVAL', '1.0'))
+            )
+            logger.info("Включен режим отложенной записи транзакций")
+
+    def _create_postgres_engine(self, database_url: str):
+        # Добавляем параметры подключения для SQLAlchemy
+        connect_args = {
+            'connect_timeout': 30,  # Увеличиваем таймаут подключения
+            'keepalives': 1,        # Включаем keepalive
+            'keepalives_idle': 30,  # Время простоя перед отправкой keepalive
+            'keepalives_interval': 10,  # Интервал между keepalive
+            'keepalives_count': 5,   # Количество попыток keepalive
+            'sslmode': 'require'     # Требуем SSL подключение
+        }
+        
+        return create_engine(
+            database_url,
+            connect_args=connect_args,
+            poolclass=TimedQueuePool,
+            pool_size=self.POOL_SIZE,        # Размер пула соединений
+            max_overflow=self.MAX_OVERFLOW,  # Максимальное количество дополнительных соединений
+            pool_timeout=30,        # Таймаут ожидания соединения из пула
+            pool_recycle=1800       # Пересоздаем соединения каждые 30 минут
+        )
+
+    def _create_sqlite_engine(self, database_url: str):
+        database_path = database_url[len('sqlite:///'):]
+        connect_args = {
+            'check_same_thread': False,  # Соединения используются потоками AsyncDatabase
+            'timeout': 30                # Ожидание блокировки записи (busy timeout)
+        }
+        
+        if database_path in ('', ':memory:'):
+            # Одна общая база в памяти на все потоки
+            engine = create_engine('sqlite://', connect_args=connect_args, poolclass=StaticPool)
+            self.POOL_SIZE, self.MAX_OVERFLOW = 1, 0
+        else:
+            directory = os.path.dirname(database_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Постоянные соединения: прагмы и mmap настраиваются один раз на соединение
+            engine = create_engine(
+                database_url,
+                connect_args=connect_args,
+                poolclass=TimedQueuePool,
+                pool_size=self.SQLITE_POOL_SIZE,
+                max_overflow=0,
+                pool_timeout=30
+            )
+            self.POOL_SIZE, self.MAX_OVERFLOW = self.SQLITE_POOL_SIZE, 0
+        
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+        return engine
+
     def _init_db(self):
         Base.metadata.create_all(self.engine)
 
-    def add_transaction(self, transaction: Transaction) -> int:
+    def _backfill_daily_totals(self):
+        """Заполняет пустую daily_totals по существующим транзакциям.
+
+        Таблица пуста при первом запуске после ее появления (create_all или
+        миграция на базе без транзакций), а транзакции уже есть: без этого
+        /stats и дайджесты видели бы только новые записи.
+        """
         session = self.Session()
         try:
-            session.add(transaction)
+            if session.query(DailyTotal.chat_id).limit(1).first() is not None:
+                return
+            if session.query(Transaction.id).limit(1).first() is None:
+                return
+            logger.info("Таблица daily_totals пуста, заполняю ее по транзакциям")
+            started = time.perf_counter()
+            count = rebuild_daily_totals(session, archive=self.archive)
             session.commit()
-            return transaction.id
+            logger.info(f"daily_totals заполнена: {count} строк за {time.perf_counter() - started:.1f} с")
+        except Exception as e:
+            # Например, таблицу одновременно заполнил другой процесс
+            session.rollback()
+            logger.error(f"Не удалось заполнить daily_totals: {str(e)}, запустите python src/manage.py backfill-rollups")
+        finally:
+            session.close()
+
+    def add_transaction(self, transaction: Transaction) -> Optional[int]:
+        """Сохраняет транзакцию. В режиме отложенной записи id не возвращается"""
+        if self.write_queue is not None:
+            self.write_queue.put(transaction)
+            self._record_added(transaction)
+            return None
+        with self.budgets.writing(transaction.chat_id):
+            session = self.Session()
+            try:
+                session.add(transaction)
+                # Дневные суммы обновляются в той же транзакции
+                increment_daily_totals(session, [transaction])
+                session.commit()
+                self._record_added(transaction)
+                return transaction.id
+            finally:
+                session.close()
+
+    def add_transactions(self, transactions: List[Transaction], update_id: Optional[int] = None):
+        """Сохраняет записи одного сообщения одной транзакцией базы.
+
+        Если задан update_id, вместе с записями сохраняется строка
+        processed_updates, по которой повторно доставленное обновление
+        распознается в is_update_processed.
+        """
+        for transaction in transactions:
+            transaction.update_id = update_id
+        if self.write_queue is not None:
+            self.write_queue.put_many(transactions)
+            for transaction in transactions:
+                self._record_added(transaction)
+            return
+        chat_id = transactions[0].chat_id
+        with self.budgets.writing(chat_id):
+            session = self.Session()
+            try:
+                if update_id is not None:
+                    session.add(ProcessedUpdate(update_id=update_id, chat_id=chat_id))
+                session.add_all(transactions)
+                increment_daily_totals(session, transactions)
+                session.commit()
+                for transaction in transactions:
+                    self._record_added(transaction)
+            finally:
+                session.close()
+
+    def is_update_processed(self, update_id: int) -> bool:
+        """Сохранены ли уже записи обновления Telegram (в базе или в очереди отложенной записи)"""
+        if self.write_queue is not None and self.write_queue.has_update(update_id):
+            return True
+        session = self.Session()
+        try:
+            return session.get(ProcessedUpdate, update_id) is not None
         finally:
             session.close()
 
+    def prune_processed_updates(self, older_than: datetime) -> int:
+        """Удаляет отметки обновлений старше older_than: их уже не доставят повторно"""
+        session = self.Session()
+        try:
+            deleted = session.query(ProcessedUpdate).filter(
+                ProcessedUpdate.processed_at < older_than
+            ).delete(synchronize_session=False)
+            session.commit()
+            return deleted
+        finally:
+            session.close()
+
+    def flush_writes(self):
+        """Записывает всю очередь отложенной записи (без нее ничего не делает)"""
+        if self.write_queue is not None:
+            self.write_queue.flush()
+
+    def _record_added(self, transaction: Transaction):
+        # Версия и суммы бюджетов меняются вместе, см. reconcile_budgets
+        with self.budgets.lock:
+            self._bump_data_version(transaction.chat_id)
+            self.budgets.add(transaction)
+
+    def _bump_data_version(self, chat_id: int):
+        # next() у itertools.count атомарен под GIL, поэтому блокировка не нужна
+        self.data_versions[chat_id] = next(self._version_counter)
+
+    def get_data_version(self, chat_id: int) -> int:
+        """Версия данных чата: меняется после каждой новой транзакции"""
+        return self.data_versions.get(chat_id, 0)
+
+    def _insert_batch(self, transactions: List[Transaction]):
+        session = self.Session()
+        try:
+            session.execute(insert(Transaction.__table__), [transaction_to_row(t) for t in transactions])
+            # Пачка содержит все записи каждого своего обновления (put_many)
+            updates = {t.update_id: t.chat_id for t in transactions if t.update_id is not None}
+            if updates:
+                session.execute(insert(ProcessedUpdate.__table__), [
+                    {'update_id': update_id, 'chat_id': chat_id, 'processed_at': datetime.now()}
+                    for update_id, chat_id in updates.items()
+                ])
+            increment_daily_totals(session, transactions)
+            session.commit()
+        finally:
+            session.close()
+
+    def _flush_pending(self, chat_id: int):
+        # Чтение должно видеть только что записанные транзакции чата
+        if self.write_queue is not None:
+            self.write_queue.flush(chat_id)
+
+    def close(self):
+        if self.write_queue is not None:
+            self.write_queue.close()
+        self.engine.dispose()
+
     def get_transactions(self, chat_id: int, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> List[Transaction]:
+        self._flush_pending(chat_id)
         session = self.Session()
         try:
             query = session.query(Transaction).filter(Transaction.chat_id == chat_id)
@@ -116,32 +567,61 @@ class Database:
             if end_date:
                 query = query.filter(Transaction.timestamp <= end_date)
             
-            return query.all()
+            transactions = query.all()
         finally:
             session.close()
+        if self.archive is not None:
+            # Архивированные транзакции старше оставшихся в таблице
+            transactions = self.archive.read_transactions(chat_id, start_date, end_date) + transactions
+        return transactions
+
+    def get_transaction_columns(self, chat_id: int, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, chunk_size: int = 5000) -> Dict[str, np.ndarray]:
+        """Возвращает транзакции чата в виде колонок NumPy (timestamp, amount, type, category).
+
+        Строки читаются порциями по chunk_size без создания ORM-объектов,
+        архивированные транзакции - колонками из файлов архива.
+        """
+        self._flush_pending(chat_id)
+        stmt = select(
+            Transaction.timestamp,
+            Transaction.amount,
+            Transaction.type,
+            Transaction.category
+        ).where(Transaction.chat_id == chat_id)
+        
+        if start_date:
+            stmt = stmt.where(Transaction.timestamp >= start_date)
+        if end_date:
+            stmt = stmt.where(Transaction.timestamp <= end_date)
+        
+        chunks = []
+        if self.archive is not None:
+            archived = self.archive.read_columns(chat_id, start_date, end_date)
+            if archived is not None:
+                chunks.append(archived)
+        
+        stmt = stmt.order_by(Transaction.timestamp).execution_options(stream_results=True)
+        with self.engine.connect() as connection:
+            result = connection.execute(stmt)
+            chunks.extend(rows_to_columns(rows) for rows in result.partitions(chunk_size))
+        return concat_columns(chunks)
 
     def get_statistics(self, chat_id: int, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> dict:
+        self._flush_pending(chat_id)
         session = self.Session()
         try:
-            query = session.query(Transaction).filter(Transaction.chat_id == chat_id)
-            
-            if start_date:
-                query = query.filter(Transaction.timestamp >= start_date)
-            if end_date:
-                query = query.filter(Transaction.timestamp <= end_date)
-            
-            transactions = query.all()
-            
-            total_income = sum(t.amount for t in transactions if t.type == 'income')
-            total_expense = sum(t.amount for t in transactions if t.type == 'expense')
+            # Полные дни берем из daily_totals, неполные края диапазона - из transactions
+            rows = category_totals(session, chat_id, start_date, end_date, self.archive)
             
+            total_income = 0
+            total_expense = 0
             categories = {}
-            for t in transactions:
-                if t.type not in categories:
-                    categories[t.type] = {}
-                if t.category not in categories[t.type]:
-                    categories[t.type][t.category] = 0
-                categories[t.type][t.category] += t.amount
+            for type_, category, amount in rows:
+                if type_ == 'income':
+                    total_income += amount
+                elif type_ == 'expense':
+                    total_expense += amount
+                categories.setdefault(type_, {})[category] = amount
             
             return {
                 'total_income': total_income,
@@ -150,4 +630,464 @@ class Database:
                 'categories': categories
             }
         finally:
-            session.close() 
\ No newline at end of file
+            session.close()
+
+    def iter_export_rows(self, chat_id: int, chunk_size: int = 5000) -> Iterator[List[tuple]]:
+        """Порции транзакций чата для экспорта (колонки EXPORT_COLUMNS): сначала архив, затем таблица"""
+        self._flush_pending(chat_id)
+        if self.archive is not None:
+            yield from self.archive.iter_rows(chat_id, list(EXPORT_COLUMNS), chunk_size)
+        stmt = select(*[getattr(Transaction, name) for name in EXPORT_COLUMNS]).where(
+            Transaction.chat_id == chat_id
+        ).order_by(Transaction.timestamp).execution_options(stream_results=True)
+        with self.engine.connect() as connection:
+            for rows in connection.execute(stmt).partitions(chunk_size):
+                yield [tuple(row) for row in rows]
+
+    def export_csv(self, chat_id: int, path: str) -> int:
+        """Записывает транзакции чата в CSV порциями, не загружая их в память целиком.
+
+        Возвращает количество записанных транзакций.
+        """
+        # utf-8-sig - чтобы Excel правильно открыл кириллицу
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            return write_csv(self.iter_export_rows(chat_id), f)
+
+    def _copy_rows(self, session, rows: List[tuple]):
+        """Загружает строки (колонки IMPORT_COLUMNS) через COPY FROM STDIN (PostgreSQL)"""
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor = session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {Transaction.__tablename__} ({', '.join(IMPORT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                buffer
+            )
+        finally:
+            cursor.close()
+
+    def import_transactions(self, chat_id: int, user_id: int, rows: Iterable[ImportRow], batch_size: int = 5000,
+                            update_id: Optional[int] = None) -> int:
+        """Массово загружает транзакции чата одной транзакцией базы данных.
+
+        На PostgreSQL (psycopg2) строки загружаются через COPY, на остальных
+        СУБД - executemany пачками по batch_size. Дневные суммы копятся в
+        памяти и записываются одним запросом в конце, вместе с отметкой
+        обновления update_id. Возвращает количество загруженных транзакций.
+        """
+        self._flush_pending(chat_id)
+        use_copy = self.engine.dialect.name == 'postgresql' and self.engine.dialect.driver == 'psycopg2'
+        table = Transaction.__table__
+        totals = defaultdict(lambda: [0.0, 0])
+        count = 0
+        session = self.Session()
+        try:
+            batch = []
+            for timestamp, type_, amount, category, description in rows:
+                batch.append((amount, type_, category, description, user_id, chat_id, timestamp))
+                total = totals[(chat_id, timestamp.date(), type_, category)]
+                total[0] += amount
+                total[1] += 1
+                if len(batch) >= batch_size:
+                    self._load_batch(session, table, batch, use_copy)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                self._load_batch(session, table, batch, use_copy)
+                count += len(batch)
+            add_daily_totals(session, {key: (amount, rows) for key, (amount, rows) in totals.items()})
+            if update_id is not None:
+                session.add(ProcessedUpdate(update_id=update_id, chat_id=chat_id))
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        if count:
+            # Суммы бюджетов загрузятся заново вместе с импортированными строками
+            with self.budgets.lock:
+                self._bump_data_version(chat_id)
+                self.budgets.invalidate(chat_id)
+        return count
+
+    def _load_batch(self, session, table, batch: List[tuple], use_copy: bool):
+        if use_copy:
+            self._copy_rows(session, batch)
+        else:
+            session.execute(insert(table), [dict(zip(IMPORT_COLUMNS, row)) for row in batch])
+
+    def import_csv(self, chat_id: int, user_id: int, path: str, classify: Callable[[str], Tuple[str, bool]],
+                   categories: Iterable[str] = (), update_id: Optional[int] = None) -> Tuple[int, int]:
+        """Импортирует CSV (экспорт бота или банковскую выписку).
+
+        classify определяет категорию и признак дохода по тексту строки,
+        categories - категории, которые берутся из файла как есть.
+        Возвращает (загружено, пропущено строк).
+        """
+        reader = StatementReader(path, classify, categories)
+        imported = self.import_transactions(chat_id, user_id, reader.rows(), update_id=update_id)
+        return imported, reader.skipped
+
+    def get_chat_categories(self, chat_id: int) -> Dict[str, List[str]]:
+        """Пользовательские категории чата: категория -> ключевые слова"""
+        session = self.Session()
+        try:
+            categories = {}
+            query = session.query(ChatCategory).filter(ChatCategory.chat_id == chat_id)
+            for row in query.order_by(ChatCategory.category, ChatCategory.keyword):
+                categories.setdefault(row.category, []).append(row.keyword)
+            return categories
+        finally:
+            session.close()
+
+    def add_chat_keywords(self, chat_id: int, category: str, keywords: List[str]) -> Dict[str, List[str]]:
+        """Привязывает ключевые слова к категории чата и возвращает все категории чата"""
+        keywords = sorted({keyword.lower() for keyword in keywords})
+        session = self.Session()
+        try:
+            # Слово может принадлежать только одной категории чата
+            session.query(ChatCategory).filter(
+                ChatCategory.chat_id == chat_id,
+                ChatCategory.keyword.in_(keywords)
+            ).delete(synchronize_session=False)
+            session.add_all([
+                ChatCategory(chat_id=chat_id, keyword=keyword, category=category.lower())
+                for keyword in keywords
+            ])
+            session.commit()
+        finally:
+            session.close()
+        return self.get_chat_categories(chat_id)
+
+    def get_active_chats(self, month: datetime) -> List[int]:
+        """Чаты, у которых есть транзакции за месяц"""
+        session = self.Session()
+        try:
+            query = session.query(DailyTotal.chat_id).filter(
+                DailyTotal.day >= month.date(),
+                DailyTotal.day < next_month(month).date()
+            ).distinct()
+            return sorted(chat_id for chat_id, in query)
+        finally:
+            session.close()
+
+    def is_month_archived(self, chat_id: int, month: datetime) -> bool:
+        """Переносился ли месяц чата в архив (или переносится сейчас)"""
+        return self.archive is not None and self.archive.has_month(chat_id, month)
+
+    def get_month_fingerprint(self, chat_id: int, month: datetime) -> Tuple[int, float]:
+        """Количество и сумма транзакций чата за месяц: меняются при любом изменении данных месяца"""
+        self._flush_pending(chat_id)
+        session = self.Session()
+        try:
+            count, amount = session.query(func.sum(DailyTotal.count), func.sum(DailyTotal.amount)).filter(
+                DailyTotal.chat_id == chat_id,
+                DailyTotal.day >= month.date(),
+                DailyTotal.day < next_month(month).date()
+            ).one()
+            return int(count or 0), round(amount or 0.0, 6)
+        finally:
+            session.close()
+
+    def _query_budgets(self, chat_id: int, month: datetime) -> Tuple[Dict[str, float], Dict[str, float]]:
+        """Лимиты бюджетов чата и расходы по их категориям за месяц (из daily_totals)"""
+        session = self.Session()
+        try:
+            limits = {
+                row.category: row.amount
+                for row in session.query(ChatBudget).filter(ChatBudget.chat_id == chat_id)
+            }
+            spent = {}
+            if limits:
+                query = session.query(DailyTotal.category, func.sum(DailyTotal.amount)).filter(
+                    DailyTotal.chat_id == chat_id,
+                    DailyTotal.type == 'expense',
+                    DailyTotal.category.in_(list(limits)),
+                    DailyTotal.day >= month.date(),
+                    DailyTotal.day < next_month(month).date()
+                )
+                spent = dict(query.group_by(DailyTotal.category).all())
+            return limits, spent
+        finally:
+            session.close()
+
+    def _load_budgets(self, chat_id: int, month: datetime, attempts: int = 3) -> bool:
+        """Загружает бюджеты чата, если во время запроса не было записи транзакций чата"""
+        for _ in range(attempts):
+            version = self.get_data_version(chat_id)
+            self._flush_pending(chat_id)
+            limits, spent = self._query_budgets(chat_id, month)
+            with self.budgets.lock:
+                if self.get_data_version(chat_id) == version and not self.budgets.is_writing(chat_id):
+                    self.budgets.load(chat_id, month, limits, spent)
+                    return True
+        return False
+
+    def budgets_loaded(self, chat_id: int) -> bool:
+        return self.budgets.is_loaded(chat_id, month_start(datetime.now()))
+
+    def get_budget_status(self, chat_id: int, category: str) -> Optional[Tuple[float, float]]:
+        """(расходы за текущий месяц, лимит) категории или None, если бюджета нет.
+
+        После первой загрузки чата значение берется из памяти без запросов к базе.
+        """
+        month = month_start(datetime.now())
+        if not self.budgets.is_loaded(chat_id, month) and not self._load_budgets(chat_id, month):
+            return None
+        return self.budgets.status(chat_id, category)
+
+    def get_budgets(self, chat_id: int) -> List[Tuple[str, float, float]]:
+        """(категория, расходы за текущий месяц, лимит) для всех бюджетов чата"""
+        month = month_start(datetime.now())
+        if not self.budgets.is_loaded(chat_id, month):
+            self._load_budgets(chat_id, month)
+        return self.budgets.report(chat_id)
+
+    def set_chat_budget(self, chat_id: int, category: str, amount: float) -> List[Tuple[str, float, float]]:
+        """Задает месячный бюджет категории (0 - удаляет) и возвращает все бюджеты чата"""
+        category = category.lower()
+        session = self.Session()
+        try:
+            session.query(ChatBudget).filter(
+                ChatBudget.chat_id == chat_id,
+                ChatBudget.category == category
+            ).delete(synchronize_session=False)
+            if amount > 0:
+                session.add(ChatBudget(chat_id=chat_id, category=category, amount=amount))
+            session.commit()
+        finally:
+            session.close()
+        with self.budgets.lock:
+            self.budgets.invalidate(chat_id)
+        return self.get_budgets(chat_id)
+
+    def reconcile_budgets(self) -> int:
+        """Сверяет суммы бюджетов в памяти с базой и возвращает количество исправленных чатов.
+
+        Чаты без бюджетов и чаты прошлого месяца сбрасываются и загрузятся
+        при следующей проверке. Если во время запроса у чата появились
+        новые транзакции, он сверяется в следующий раз.
+        """
+        current = month_start(datetime.now())
+        fixed = 0
+        for chat_id, month in self.budgets.loaded_chats():
+            if month != current or not self.budgets.limits.get(chat_id):
+                with self.budgets.lock:
+                    self.budgets.invalidate(chat_id)
+                continue
+            version = self.get_data_version(chat_id)
+            self._flush_pending(chat_id)
+            limits, spent = self._query_budgets(chat_id, month)
+            with self.budgets.lock:
+                if (self.get_data_version(chat_id) != version or self.budgets.is_writing(chat_id)
+                        or not self.budgets.is_loaded(chat_id, month)):
+                    continue
+                expected = [(category, spent.get(category, 0.0), limit) for category, limit in sorted(limits.items())]
+                actual = self.budgets.entries(chat_id)
+                if len(expected) != len(actual) or any(
+                    e[0] != a[0] or abs(e[1] - a[1]) > 1e-6 or e[2] != a[2] for e, a in zip(expected, actual)
+                ):
+                    fixed += 1
+                    logger.warning(f"Бюджеты чата {chat_id} расходились с базой: {actual} -> {expected}")
+                self.budgets.load(chat_id, month, limits, spent)
+        return fixed
+
+    def rebuild_daily_totals(self, chat_id: Optional[int] = None) -> int:
+        """Заполняет daily_totals заново по существующим транзакциям"""
+        if self.write_queue is not None:
+            self.write_queue.flush()
+        session = self.Session()
+        try:
+            count = rebuild_daily_totals(session, chat_id, archive=self.archive)
+            session.commit()
+            return count
+        finally:
+            session.close()
+
+    def check_daily_totals(self, chat_id: Optional[int] = None) -> List[dict]:
+        """Возвращает расхождения между daily_totals и транзакциями"""
+        if self.write_queue is not None:
+            self.write_queue.flush()
+        session = self.Session()
+        try:
+            return find_rollup_mismatches(session, chat_id, archive=self.archive)
+        finally:
+            session.close()
+
+    def _recover_archive(self):
+        """Завершает архивацию, прерванную между записью файла и его заменой"""
+        session = self.Session()
+        try:
+            for chat_id, month, tmp_path in self.archive.pending():
+                table = TransactionArchive.read_file(tmp_path)
+                archived = set(zip(table['id'].to_pylist(), table['timestamp'].to_pylist()))
+                live = session.query(Transaction.id, Transaction.timestamp).filter(
+                    Transaction.chat_id == chat_id,
+                    Transaction.timestamp >= month,
+                    Transaction.timestamp < next_month(month)
+                )
+                # Строки еще в таблице - удаление не было закоммичено, файл не нужен
+                if any((row.id, row.timestamp) in archived for row in live):
+                    TransactionArchive.discard_month(tmp_path)
+                else:
+                    TransactionArchive.commit_month(tmp_path)
+        finally:
+            session.close()
+
+    def archive_transactions(self, older_than: datetime, chat_id: Optional[int] = None) -> int:
+        """Переносит в архив транзакции полных месяцев старше older_than.
+
+        Для каждого месяца чата файл архива пишется до удаления строк из
+        таблицы и заменяет прежний только после коммита удаления, поэтому
+        между коммитом и заменой строки месяца не видны ни в таблице, ни в
+        архиве. Дневные суммы не меняются, и отпечаток месяца тоже, поэтому
+        дайджесты архивированных месяцев не сохраняются (is_month_archived).
+        Возвращает количество перенесенных транзакций.
+        """
+        if self.archive is None:
+            raise ValueError("ARCHIVE_PATH не задан")
+        if self.write_queue is not None:
+            self.write_queue.flush()
+        self._recover_archive()
+
+        boundary = month_start(older_than)
+        columns = [getattr(Transaction, name) for name in ARCHIVE_COLUMNS]
+        moved = 0
+        session = self.Session()
+        try:
+            query = session.query(Transaction.chat_id, func.min(Transaction.timestamp)).filter(Transaction.timestamp < boundary)
+            if chat_id is not None:
+                query = query.filter(Transaction.chat_id == chat_id)
+            for chat, first in query.group_by(Transaction.chat_id).all():
+                month = month_start(first)
+                while month < boundary:
+                    rows = session.query(*columns).filter(
+                        Transaction.chat_id == chat,
+                        Transaction.timestamp >= month,
+                        Transaction.timestamp < next_month(month)
+                    ).all()
+                    if rows:
+                        tmp_path = self.archive.prepare_month(chat, month, rows_to_table(rows))
+                        try:
+                            ids = [row.id for row in rows]
+                            for i in range(0, len(ids), 500):
+                                session.query(Transaction).filter(
+                                    Transaction.id.in_(ids[i:i + 500])
+                                ).delete(synchronize_session=False)
+                            session.commit()
+                        except Exception:
+                            session.rollback()
+                            TransactionArchive.discard_month(tmp_path)
+                            raise
+                        TransactionArchive.commit_month(tmp_path)
+                        moved += len(rows)
+                        logger.info(f"Чат {chat}: {month:%Y-%m} перенесен в архив ({len(rows)} транзакций)")
+                    month = next_month(month)
+            return moved
+        finally:
+            session.close()
+
+class AsyncDatabase:
+    """Асинхронная обертка над Database.
+
+    Синхронные вызовы SQLAlchemy выполняются в ограниченном пуле потоков,
+    поэтому медленный запрос к базе не блокирует event loop бота.
+    """
+
+    def __init__(self, database: Database, max_workers: Optional[int] = None):
+        self.database = database
+        if max_workers is None:
+            # Больше потоков, чем соединений в пуле, все равно будут ждать соединения
+            max_workers = int(os.getenv(
+                'DB_EXECUTOR_WORKERS',
+                database.POOL_SIZE + database.MAX_OVERFLOW
+            ))
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='db')
+        # Суммарное время вызовов базы в пуле потоков
+        self.busy_seconds = 0.0
+        self.busy_lock = threading.Lock()
+
+    def _timed(self, func):
+        started = time.perf_counter()
+        try:
+            return func()
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.busy_lock:
+                self.busy_seconds += elapsed
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._timed, partial(func, *args, **kwargs))
+
+    async def add_transaction(self, transaction: Transaction) -> Optional[int]:
+        return await self._run(self.database.add_transaction, transaction)
+
+    def get_data_version(self, chat_id: int) -> int:
+        # Версия хранится в памяти, обращение к базе не требуется
+        return self.database.get_data_version(chat_id)
+
+    async def add_transactions(self, transactions: List[Transaction], update_id: Optional[int] = None):
+        return await self._run(self.database.add_transactions, transactions, update_id)
+
+    async def is_update_processed(self, update_id: int) -> bool:
+        return await self._run(self.database.is_update_processed, update_id)
+
+    async def prune_processed_updates(self, older_than: datetime) -> int:
+        return await self._run(self.database.prune_processed_updates, older_than)
+
+    async def flush_writes(self):
+        return await self._run(self.database.flush_writes)
+
+    async def get_transactions(self, chat_id: int, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> List[Transaction]:
+        return await self._run(self.database.get_transactions, chat_id, start_date, end_date)
+
+    async def get_transaction_columns(self, chat_id: int, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> Dict[str, np.ndarray]:
+        return await self._run(self.database.get_transaction_columns, chat_id, start_date, end_date)
+
+    async def export_csv(self, chat_id: int, path: str) -> int:
+        return await self._run(self.database.export_csv, chat_id, path)
+
+    async def import_csv(self, chat_id: int, user_id: int, path: str, classify: Callable[[str], Tuple[str, bool]],
+                         categories: Iterable[str] = (), update_id: Optional[int] = None) -> Tuple[int, int]:
+        return await self._run(self.database.import_csv, chat_id, user_id, path, classify, categories, update_id)
+
+    async def get_active_chats(self, month: datetime) -> List[int]:
+        return await self._run(self.database.get_active_chats, month)
+
+    def is_month_archived(self, chat_id: int, month: datetime) -> bool:
+        # Проверяются только файлы архива, обращение к базе не требуется
+        return self.database.is_month_archived(chat_id, month)
+
+    async def get_month_fingerprint(self, chat_id: int, month: datetime) -> Tuple[int, float]:
+        return await self._run(self.database.get_month_fingerprint, chat_id, month)
+
+    async def get_budget_status(self, chat_id: int, category: str) -> Optional[Tuple[float, float]]:
+        # Загруженные бюджеты проверяются в памяти, без пула потоков
+        if self.database.budgets_loaded(chat_id):
+            return self.database.get_budget_status(chat_id, category)
+        return await self._run(self.database.get_budget_status, chat_id, category)
+
+    async def get_budgets(self, chat_id: int) -> List[Tuple[str, float, float]]:
+        return await self._run(self.database.get_budgets, chat_id)
+
+    async def set_chat_budget(self, chat_id: int, category: str, amount: float) -> List[Tuple[str, float, float]]:
+        return await self._run(self.database.set_chat_budget, chat_id, category, amount)
+
+    async def reconcile_budgets(self) -> int:
+        return await self._run(self.database.reconcile_budgets)
+
+    async def get_chat_categories(self, chat_id: int) -> Dict[str, List[str]]:
+        return await self._run(self.database.get_chat_categories, chat_id)
+
+    async def add_chat_keywords(self, chat_id: int, category: str, keywords: List[str]) -> Dict[str, List[str]]:
+        return await self._run(self.database.add_chat_keywords, chat_id, category, keywords)
+
+    async def get_statistics(self, chat_id: int, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> dict:
+        return await self._run(self.database.get_statistics, chat_id, start_date, end_date)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.database.close()
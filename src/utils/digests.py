@@ -0,0 +1,108 @@
+import os
+import json
+from datetime import datetime
+from typing import Optional, Sequence
+from utils.archive import month_start
+from utils.chart_cache import REPORT_CHART_KINDS
+
+DIGEST_FILE = 'digest.json'
+
+def previous_month(now: Optional[datetime] = None) -> datetime:
+    first = month_start(now or datetime.now())
+    return datetime(first.year - (first.month == 1), (first.month - 2) % 12 + 1, 1)
+
+def parse_month(value: str) -> datetime:
+    """Месяц из строки ГГГГ-ММ"""
+    return datetime.strptime(value, '%Y-%m')
+
+class DigestStore:
+    """Готовые месячные дайджесты: статистика и графики закрытых месяцев.
+
+    Файлы лежат в {root}/chat_{chat_id}/{ГГГГ-ММ}/: графики отчета и
+    digest.json с отпечатком данных месяца (количество и сумма транзакций
+    по daily_totals), форматом графиков, статистикой и отметкой об отправке.
+    Дайджест используется, только пока отпечаток и формат совпадают: если в
+    закрытый месяц импортировали записи, он строится заново.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _dir(self, chat_id: int, month: datetime) -> str:
+        return os.path.join(self.root, f'chat_{chat_id}', f'{month:%Y-%m}')
+
+    @staticmethod
+    def _write(path: str, data: bytes):
+        # Файл заменяется целиком, чтобы читатель не увидел его наполовину записанным
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+
+    def load(self, chat_id: int, month: datetime, fingerprint: Sequence, chart_format: str) -> Optional[dict]:
+        """Дайджест {'stats', 'charts', 'sent'} или None, если его нет или он устарел"""
+        directory = self._dir(chat_id, month)
+        try:
+            with open(os.path.join(directory, DIGEST_FILE), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('fingerprint') != list(fingerprint) or meta.get('format') != chart_format:
+            return None
+        charts = []
+        for kind in REPORT_CHART_KINDS:
+            name = meta['charts'].get(kind)
+            if name is None:
+                charts.append(None)
+                continue
+            try:
+                with open(os.path.join(directory, name), 'rb') as f:
+                    charts.append(f.read())
+            except OSError:
+                return None
+        return {'stats': meta['stats'], 'charts': charts, 'sent': meta.get('sent', False)}
+
+    def save(self, chat_id: int, month: datetime, fingerprint: Sequence, chart_format: str,
+             stats: dict, charts: Sequence[Optional[bytes]], extension: str, sent: bool = False):
+        directory = self._dir(chat_id, month)
+        os.makedirs(directory, exist_ok=True)
+        names = {}
+        for kind, chart in zip(REPORT_CHART_KINDS, charts):
+            if chart is None:
+                names[kind] = None
+                continue
+            names[kind] = f'{kind}.{extension}'
+            self._write(os.path.join(directory, names[kind]), chart)
+        # digest.json пишется последним: до его замены дайджест считается прежним
+        meta = {
+            'fingerprint': list(fingerprint),
+            'format': chart_format,
+            'stats': stats,
+            'charts': names,
+            'sent': sent,
+            'created': datetime.now().isoformat(timespec='seconds'),
+        }
+        self._write(os.path.join(directory, DIGEST_FILE), json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+
+    def mark_sent(self, chat_id: int, month: datetime):
+        path = os.path.join(self._dir(chat_id, month), DIGEST_FILE)
+        with open(path, encoding='utf-8') as f:
+            meta = json.load(f)
+        meta['sent'] = True
+        self._write(path, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+
+class DutyCycle:
+    """Ограничение доли времени, которую фоновая работа занимает ресурс.
+
+    После работы длительностью used секунд при доле share нужна пауза
+    used * (1 - share) / share: за время работы и паузы ресурс занят
+    не больше доли share. Доля 1 - без пауз; нулевая или отрицательная
+    доля не имеет смысла и отклоняется.
+    """
+
+    def __init__(self, share: float):
+        if not 0 < share <= 1:
+            raise ValueError(f"Доля времени должна быть в диапазоне (0, 1], получено {share}")
+        self.share = share
+
+    def pause(self, used: float) -> float:
+        return used * (1 - self.share) / self.share
@@ -1,5 +1,5 @@
 import re
-from typing import Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 from dataclasses import dataclass
 
 @dataclass
@@ -9,11 +9,153 @@ class ParsedTransaction:
     category: str
     description: str
 
+@dataclass
+class _Entry:
+    start: int
+    end: int
+    amount: Optional[float] = None
+    income: bool = False
+    category_rank: Optional[int] = None
+
+    def merge(self, other: '_Entry'):
+        self.start = min(self.start, other.start)
+        self.end = max(self.end, other.end)
+        if self.amount is None:
+            self.amount = other.amount
+        self.income = self.income or other.income
+        if other.category_rank is not None and (self.category_rank is None or other.category_rank < self.category_rank):
+            self.category_rank = other.category_rank
+
+def trie_pattern(words: Iterable[str]) -> str:
+    """Строит регулярное выражение из префиксного дерева слов.
+
+    В отличие от простой альтернативы "a|b|c", общие префиксы проверяются
+    один раз, поэтому стоимость поиска почти не зависит от числа слов.
+    Из слов с общим началом побеждает самое длинное.
+    """
+    trie: dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node: dict) -> str:
+        end = '' in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return f'(?:{body})?' if end else body
+
+    return build(trie)
+
+class KeywordMatcher:
+    """Предкомпилированный разборщик сообщений.
+
+    Одно регулярное выражение находит за один проход разделители записей,
+    суммы и все ключевые слова (доходов и категорий). Категория записи -
+    первая в порядке словаря, ключевое слово которой встретилось в записи.
+    """
+
+    AMOUNT_PATTERN = r'\d+(?:\.\d{1,2})?'
+    # Запятая перед цифрой - часть числа, а не разделитель записей
+    SEPARATOR_PATTERN = r'[;\n]|,(?!\d)'
+
+    def __init__(self, categories: Dict[str, Iterable[str]], income_keywords: Iterable[str], default_category: str = 'другое'):
+        self.default_category = default_category
+        self.category_names: List[str] = list(categories)
+        # Ключевое слово -> (признак дохода, ранг категории)
+        self.keywords: Dict[str, Tuple[bool, Optional[int]]] = {}
+        for rank, keywords in enumerate(categories.values()):
+            for keyword in keywords:
+                keyword = keyword.lower()
+                if keyword not in self.keywords:
+                    self.keywords[keyword] = (False, rank)
+        for keyword in income_keywords:
+            keyword = keyword.lower()
+            _, rank = self.keywords.get(keyword, (False, None))
+            self.keywords[keyword] = (True, rank)
+
+        # Текст приводится к нижнему регистру один раз, поэтому флаг IGNORECASE не нужен
+        self.pattern = re.compile(
+            rf'(?P<sep>{self.SEPARATOR_PATTERN})|(?P<amount>{self.AMOUNT_PATTERN})|(?P<keyword>{trie_pattern(self.keywords)})'
+        )
+
+    def _scan(self, text: str) -> List[_Entry]:
+        # text уже в нижнем регистре
+        segments = []
+        current = _Entry(start=0, end=len(text))
+        for match in self.pattern.finditer(text):
+            kind = match.lastgroup
+            if kind == 'sep':
+                current.end = match.start()
+                segments.append(current)
+                current = _Entry(start=match.end(), end=len(text))
+            elif kind == 'amount':
+                # В записи учитывается только первое число
+                if current.amount is None:
+                    current.amount = float(match.group())
+            else:
+                income, rank = self.keywords[match.group()]
+                current.income = current.income or income
+                if rank is not None and (current.category_rank is None or rank < current.category_rank):
+                    current.category_rank = rank
+        segments.append(current)
+        return segments
+
+    def parse(self, text: str) -> List[ParsedTransaction]:
+        """Разбирает сообщение на записи: по одной на каждую часть с суммой.
+
+        Части без суммы присоединяются к соседней записи, поэтому сообщение
+        с одной суммой разбирается целиком, как и раньше.
+        """
+        lowered = text.lower()
+        # Позиции совпадений переносятся на исходный текст, если длина не изменилась
+        source = text if len(lowered) == len(text) else lowered
+        entries: List[_Entry] = []
+        leading: Optional[_Entry] = None
+        for segment in self._scan(lowered):
+            if segment.amount is not None:
+                if leading is not None:
+                    segment.merge(leading)
+                    leading = None
+                entries.append(segment)
+            elif entries:
+                entries[-1].merge(segment)
+            elif leading is None:
+                leading = segment
+            else:
+                leading.merge(segment)
+
+        result = []
+        for entry in entries:
+            if entry.category_rank is None:
+                category = self.default_category
+            else:
+                category = self.category_names[entry.category_rank]
+            result.append(ParsedTransaction(
+                amount=entry.amount,
+                type='income' if entry.income else 'expense',
+                category=category,
+                description=text.strip() if len(entries) == 1 else source[entry.start:entry.end].strip()
+            ))
+        return result
+
+    def classify(self, text: str) -> Tuple[str, bool]:
+        """Категория и признак дохода по ключевым словам текста без учета сумм"""
+        entry = _Entry(start=0, end=len(text))
+        for segment in self._scan(text.lower()):
+            entry.merge(segment)
+        if entry.category_rank is None:
+            return self.default_category, entry.income
+        return self.category_names[entry.category_rank], entry.income
+
 class MessageParser:
     # Словарь ключевых слов для определения типа транзакции
     INCOME_KEYWORDS = {'доход', 'зарплата', 'прибыль', '+'}
     EXPENSE_KEYWORDS = {'расход', 'трата', 'покупка', '-'}
-    
+
     # Словарь категорий по умолчанию
     DEFAULT_CATEGORIES = {
         'продукты': ['еда', 'продукты', 'магазин'],
@@ -25,35 +167,52 @@ class MessageParser:
         'другое': ['другое', 'прочее']
     }
 
+    _default_matcher: Optional[KeywordMatcher] = None
+    # Разборщики чатов со своими категориями (None - у чата их нет)
+    _chat_matchers: Dict[int, Optional[KeywordMatcher]] = {}
+
+    @classmethod
+    def default_matcher(cls) -> KeywordMatcher:
+        if cls._default_matcher is None:
+            cls._default_matcher = KeywordMatcher(cls.DEFAULT_CATEGORIES, cls.INCOME_KEYWORDS)
+        return cls._default_matcher
+
+    @classmethod
+    def set_chat_categories(cls, chat_id: int, categories: Dict[str, List[str]]):
+        """Задает категории чата. Они проверяются раньше категорий по умолчанию"""
+        if not categories:
+            cls._chat_matchers[chat_id] = None
+            return
+        merged = {category: list(keywords) for category, keywords in categories.items()}
+        for category, keywords in cls.DEFAULT_CATEGORIES.items():
+            merged.setdefault(category, []).extend(keywords)
+        cls._chat_matchers[chat_id] = KeywordMatcher(merged, cls.INCOME_KEYWORDS)
+
+    @classmethod
+    def has_chat_categories(cls, chat_id: int) -> bool:
+        """Загружены ли уже категории чата"""
+        return chat_id in cls._chat_matchers
+
+    @classmethod
+    def matcher(cls, chat_id: Optional[int] = None) -> KeywordMatcher:
+        if chat_id is not None:
+            matcher = cls._chat_matchers.get(chat_id)
+            if matcher is not None:
+                return matcher
+        return cls.default_matcher()
+
+    @classmethod
+    def parse_entries(cls, text: str, chat_id: Optional[int] = None) -> List[ParsedTransaction]:
+        """Парсит сообщение с одной или несколькими записями ("500 продукты, 200 такси")"""
+        return cls.matcher(chat_id).parse(text)
+
+    @classmethod
+    def classify(cls, text: str, chat_id: Optional[int] = None) -> Tuple[str, bool]:
+        """Категория и признак дохода для текста без суммы (например, строки выписки)"""
+        return cls.matcher(chat_id).classify(text)
+
     @classmethod
-    def parse_message(cls, text: str) -> Optional[ParsedTransaction]:
+    def parse_message(cls, text: str, chat_id: Optional[int] = None) -> Optional[ParsedTransaction]:
         """Парсит сообщение и извлекает информацию о транзакции"""
-        # Ищем сумму в сообщении
-        amount_match = re.search(r'(\d+(?:\.\d{1,2})?)', text)
-        if not amount_match:
-            return None
-
-        amount = float(amount_match.group(1))
-        
-        # Определяем тип транзакции
-        transaction_type = 'expense'
-        if any(keyword in text.lower() for keyword in cls.INCOME_KEYWORDS):
-            transaction_type = 'income'
-        
-        # Определяем категорию
-        category = 'другое'
-        text_lower = text.lower()
-        for cat, keywords in cls.DEFAULT_CATEGORIES.items():
-            if any(keyword in text_lower for keyword in keywords):
-                category = cat
-                break
-        
-        # Формируем описание
-        description = text.strip()
-        
-        return ParsedTransaction(
-            amount=amount,
-            type=transaction_type,
-            category=category,
-            description=description
-        ) 
\ No newline at end of file
+        entries = cls.parse_entries(text, chat_id)
+        return entries[0] if entries else None
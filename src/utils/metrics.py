@@ -0,0 +1,283 @@
+import io
+import os
+import time
+import random
+import pstats
+import cProfile
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Модуль использует только стандартную библиотеку: он импортируется в
+# основном процессе, процессах графиков и шардах и не должен замедлять запуск.
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм в секундах
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+class Registry:
+    """Набор метрик процесса в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self.metrics: List['_Metric'] = []
+        self.lock = threading.Lock()
+
+    def register(self, metric: '_Metric'):
+        with self.lock:
+            self.metrics.append(metric)
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+class _Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = dict(self.values)
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                for key, value in values.items()]
+
+class Gauge(_Metric):
+    """Значения считываются при каждом запросе /metrics функцией collect.
+
+    collect возвращает {кортеж значений меток: значение}.
+    """
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, collect: Callable[[], Dict[Tuple[str, ...], float]],
+                 labelnames: Sequence[str] = (), registry: Registry = REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.collect = collect
+
+    def samples(self) -> List[str]:
+        try:
+            values = self.collect()
+        except Exception as e:
+            logger.error(f"Ошибка чтения метрики {self.name}: {str(e)}")
+            return []
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                for key, value in values.items()]
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Registry = REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # Метки -> [количество в каждой корзине, сумма, количество]
+        self.values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self.values.items()}
+        lines = []
+        for key, (counts, total, count) in values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="{}"'.format(_format_value(bound))
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+# Метрики бота
+HANDLER_SECONDS = Histogram('bot_handler_seconds', 'Время обработки обновления', ['handler'])
+HANDLER_ERRORS = Counter('bot_handler_errors_total', 'Ошибки обработчиков', ['handler'])
+TELEGRAM_SEND_SECONDS = Histogram('bot_telegram_send_seconds', 'Время отправки ответа в Telegram', ['method'])
+TELEGRAM_SENT_BYTES = Counter('bot_telegram_sent_bytes_total', 'Объем отправленных в Telegram файлов', ['method'])
+DB_STATEMENT_SECONDS = Histogram('db_statement_seconds', 'Время выполнения SQL-запроса', ['statement'])
+DB_POOL_WAIT_SECONDS = Histogram('db_pool_checkout_wait_seconds', 'Ожидание соединения из пула')
+DB_WRITE_DEAD_LETTERS = Counter('db_write_behind_dead_letters_total', 'Транзакции отложенной записи, исключенные из очереди после ошибок')
+CHART_RENDER_SECONDS = Histogram('chart_render_seconds', 'Время подготовки данных и построения фигуры графика', ['chart'])
+CHART_ENCODE_SECONDS = Histogram('chart_encode_seconds', 'Время отрисовки и кодирования графика в изображение (savefig)', ['chart'])
+DIGESTS = Counter('bot_digests_total', 'Месячные дайджесты фоновой задачи (rendered, cached, sent)', ['result'])
+
+# Процессы пула графиков не отдают /metrics: время графиков копится
+# в буфере и возвращается основному процессу вместе с результатом
+_chart_timings: Optional[List[Tuple[str, float, float]]] = None
+
+def observe_chart(chart: str, render_seconds: float, encode_seconds: float):
+    CHART_RENDER_SECONDS.observe(render_seconds, chart=chart)
+    CHART_ENCODE_SECONDS.observe(encode_seconds, chart=chart)
+    if _chart_timings is not None:
+        _chart_timings.append((chart, render_seconds, encode_seconds))
+
+def buffer_chart_timings():
+    """Включает буфер времени графиков (в процессе пула графиков)"""
+    global _chart_timings
+    _chart_timings = []
+
+def take_chart_timings() -> List[Tuple[str, float, float]]:
+    global _chart_timings
+    if _chart_timings is None:
+        return []
+    timings, _chart_timings = _chart_timings, []
+    return timings
+
+# Профилирование медленных обработчиков: PROFILE_SLOW_HANDLERS - порог в секундах,
+# PROFILE_SAMPLE_RATE - доля профилируемых вызовов
+PROFILE_SLOW_HANDLERS = float(os.getenv('PROFILE_SLOW_HANDLERS', '0'))
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0.1'))
+# cProfile нельзя включить дважды, поэтому профилируется один вызов за раз
+_profiling = False
+
+def _log_profile(name: str, elapsed: float, profiler: cProfile.Profile):
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(25)
+    logger.warning(f"Медленный обработчик {name}: {elapsed:.3f} с\n{out.getvalue()}")
+
+def track_handler(name: str):
+    """Декоратор обработчика: гистограмма времени, ошибки и профилирование.
+
+    Профиль cProfile охватывает весь поток event loop, поэтому в него
+    попадают и параллельно работающие обработчики.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            global _profiling
+            profiler = None
+            if PROFILE_SLOW_HANDLERS > 0 and not _profiling and random.random() < PROFILE_SAMPLE_RATE:
+                _profiling = True
+                profiler = cProfile.Profile()
+                profiler.enable()
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=name)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                HANDLER_SECONDS.observe(elapsed, handler=name)
+                if profiler is not None:
+                    profiler.disable()
+                    _profiling = False
+                    if elapsed >= PROFILE_SLOW_HANDLERS:
+                        _log_profile(name, elapsed, profiler)
+        return wrapper
+    return decorator
+
+def instrument_engine(engine):
+    """Подключает замер времени SQL-запросов через события SQLAlchemy"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_started'].pop()
+        words = statement.split(None, 1)
+        DB_STATEMENT_SECONDS.observe(time.perf_counter() - started, statement=words[0].upper() if words else '')
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        stack = context.connection.info.get('query_started') if context.connection is not None else None
+        if stack:
+            stack.pop()
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        payload = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port: int, host: Optional[str] = None) -> ThreadingHTTPServer:
+    """Запускает HTTP-сервер /metrics в фоновом потоке"""
+    host = host or os.getenv('METRICS_HOST', '127.0.0.1')
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,218 @@
+import logging
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import Date, cast, func
+from sqlalchemy.orm import Session
+from models.transaction import Transaction
+from models.daily_total import DailyTotal
+
+logger = logging.getLogger(__name__)
+
+# Ключ дневной суммы: (chat_id, day, type, category)
+RollupKey = Tuple[int, date, str, str]
+
+def _dialect(session: Session) -> str:
+    return session.get_bind().dialect.name
+
+def _day_expression(session: Session):
+    """Выражение для даты транзакции (SQLite не умеет CAST в DATE)"""
+    if _dialect(session) == 'sqlite':
+        return func.date(Transaction.timestamp)
+    return cast(Transaction.timestamp, Date)
+
+def _to_date(value) -> date:
+    if isinstance(value, str):
+        return date.fromisoformat(value)
+    return value
+
+def group_transactions(transactions: Iterable[Transaction]) -> Dict[RollupKey, Tuple[float, int]]:
+    """Группирует транзакции по ключу дневной суммы"""
+    totals = defaultdict(lambda: [0.0, 0])
+    for t in transactions:
+        timestamp = t.timestamp or datetime.now()
+        key = (t.chat_id, timestamp.date(), t.type, t.category)
+        totals[key][0] += t.amount
+        totals[key][1] += 1
+    return {key: (amount, count) for key, (amount, count) in totals.items()}
+
+def increment_daily_totals(session: Session, transactions: Iterable[Transaction]):
+    """Добавляет транзакции к дневным суммам в текущей транзакции сессии"""
+    add_daily_totals(session, group_transactions(transactions))
+
+def add_daily_totals(session: Session, totals: Dict[RollupKey, Tuple[float, int]]):
+    """Прибавляет сгруппированные суммы (ключ -> (сумма, количество)) к daily_totals"""
+    rows = [
+        {'chat_id': chat_id, 'day': day, 'type': type_, 'category': category,
+         'amount': amount, 'count': count}
+        for (chat_id, day, type_, category), (amount, count) in totals.items()
+    ]
+    if not rows:
+        return
+
+    dialect = _dialect(session)
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(DailyTotal.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['chat_id', 'day', 'type', 'category'],
+            set_={
+                'amount': DailyTotal.__table__.c.amount + stmt.excluded.amount,
+                'count': DailyTotal.__table__.c.count + stmt.excluded.count,
+            }
+        )
+        session.execute(stmt, rows)
+        return
+
+    # Для остальных СУБД: чтение и обновление строки
+    for row in rows:
+        total = session.get(DailyTotal, (row['chat_id'], row['day'], row['type'], row['category']))
+        if total is None:
+            session.add(DailyTotal(**row))
+        else:
+            total.amount += row['amount']
+            total.count += row['count']
+
+def _raw_totals_query(session: Session, chat_id: Optional[int]):
+    day = _day_expression(session)
+    query = session.query(
+        Transaction.chat_id,
+        day,
+        Transaction.type,
+        Transaction.category,
+        func.sum(Transaction.amount),
+        func.count(Transaction.id)
+    )
+    if chat_id is not None:
+        query = query.filter(Transaction.chat_id == chat_id)
+    return query.group_by(Transaction.chat_id, day, Transaction.type, Transaction.category)
+
+def _expected_totals(session: Session, chat_id: Optional[int], archive=None) -> Dict[RollupKey, Tuple[float, int]]:
+    """Дневные суммы по исходным транзакциям: из таблицы и из архива"""
+    totals = {}
+    for chat, day, type_, category, amount, rows in _raw_totals_query(session, chat_id):
+        totals[(chat, _to_date(day), type_, category)] = (amount, rows)
+    if archive is not None:
+        for key, (amount, rows) in archive.daily_totals(chat_id).items():
+            live_amount, live_rows = totals.get(key, (0.0, 0))
+            totals[key] = (live_amount + amount, live_rows + rows)
+    return totals
+
+def rebuild_daily_totals(session: Session, chat_id: Optional[int] = None, archive=None) -> int:
+    """Пересчитывает дневные суммы из транзакций (все чаты или один).
+
+    Архивированные транзакции (archive - TransactionArchive) тоже учитываются.
+    Возвращает количество записанных строк. Коммит выполняет вызывающий код.
+    """
+    delete_query = session.query(DailyTotal)
+    if chat_id is not None:
+        delete_query = delete_query.filter(DailyTotal.chat_id == chat_id)
+    delete_query.delete(synchronize_session=False)
+
+    count = 0
+    batch = []
+    for (chat, day, type_, category), (amount, rows) in _expected_totals(session, chat_id, archive).items():
+        batch.append({'chat_id': chat, 'day': day, 'type': type_,
+                      'category': category, 'amount': amount, 'count': rows})
+        if len(batch) >= 1000:
+            session.execute(DailyTotal.__table__.insert(), batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        session.execute(DailyTotal.__table__.insert(), batch)
+        count += len(batch)
+    return count
+
+def find_rollup_mismatches(session: Session, chat_id: Optional[int] = None, tolerance: float = 1e-6, archive=None) -> List[dict]:
+    """Сравнивает дневные суммы с исходными транзакциями (включая архив)"""
+    expected = _expected_totals(session, chat_id, archive)
+    query = session.query(DailyTotal)
+    if chat_id is not None:
+        query = query.filter(DailyTotal.chat_id == chat_id)
+    actual = {
+        (t.chat_id, t.day, t.type, t.category): (t.amount, t.count)
+        for t in query
+    }
+
+    mismatches = []
+    for key in sorted(set(expected) | set(actual), key=str):
+        expected_amount, expected_count = expected.get(key, (0.0, 0))
+        actual_amount, actual_count = actual.get(key, (0.0, 0))
+        if expected_count != actual_count or abs(expected_amount - actual_amount) > tolerance:
+            chat, day, type_, category = key
+            mismatches.append({
+                'chat_id': chat, 'day': day, 'type': type_, 'category': category,
+                'expected_amount': expected_amount, 'actual_amount': actual_amount,
+                'expected_count': expected_count, 'actual_count': actual_count,
+            })
+    return mismatches
+
+def _is_midnight(value: datetime) -> bool:
+    return value.time() == time.min
+
+def split_range(start_date: Optional[datetime], end_date: Optional[datetime]):
+    """Делит диапазон на полные дни (из daily_totals) и неполные края (из transactions).
+
+    Возвращает (use_rollup, first_day, end_day, raw_ranges): полные дни
+    first_day <= day < end_day (None - без ограничения) и список диапазонов
+    (start, end, end_inclusive) для чтения исходных транзакций. Если полных дней
+    нет, use_rollup ложно и весь диапазон читается из transactions.
+    """
+    first_day = None
+    if start_date is not None:
+        first_day = start_date.date() if _is_midnight(start_date) else start_date.date() + timedelta(days=1)
+    end_day = end_date.date() if end_date is not None else None
+
+    if first_day is not None and end_day is not None and first_day >= end_day:
+        return False, None, None, [(start_date, end_date, True)]
+
+    raw_ranges = []
+    if start_date is not None and not _is_midnight(start_date):
+        raw_ranges.append((start_date, datetime.combine(first_day, time.min), False))
+    if end_date is not None:
+        raw_ranges.append((datetime.combine(end_day, time.min), end_date, True))
+    return True, first_day, end_day, raw_ranges
+
+def category_totals(session: Session, chat_id: int, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, archive=None) -> List[Tuple[str, str, float]]:
+    """Суммы (тип, категория, сумма) за диапазон дат по дневным суммам.
+
+    Дневные суммы хранятся и для архивированных транзакций, поэтому архив
+    (archive - TransactionArchive) читается только для неполных краев диапазона.
+    """
+    use_rollup, first_day, end_day, raw_ranges = split_range(start_date, end_date)
+    totals = defaultdict(float)
+
+    if use_rollup:
+        query = session.query(
+            DailyTotal.type,
+            DailyTotal.category,
+            func.sum(DailyTotal.amount)
+        ).filter(DailyTotal.chat_id == chat_id)
+        if first_day is not None:
+            query = query.filter(DailyTotal.day >= first_day)
+        if end_day is not None:
+            query = query.filter(DailyTotal.day < end_day)
+        for type_, category, amount in query.group_by(DailyTotal.type, DailyTotal.category):
+            totals[(type_, category)] += amount
+
+    for range_start, range_end, end_inclusive in raw_ranges:
+        query = session.query(
+            Transaction.type,
+            Transaction.category,
+            func.sum(Transaction.amount)
+        ).filter(Transaction.chat_id == chat_id)
+        query = query.filter(Transaction.timestamp >= range_start)
+        if end_inclusive:
+            query = query.filter(Transaction.timestamp <= range_end)
+        else:
+            query = query.filter(Transaction.timestamp < range_end)
+        for type_, category, amount in query.group_by(Transaction.type, Transaction.category):
+            totals[(type_, category)] += amount
+        if archive is not None:
+            for key, amount in archive.category_totals(chat_id, range_start, range_end, end_inclusive).items():
+                totals[key] += amount
+
+    return [(type_, category, amount) for (type_, category), amount in totals.items()]
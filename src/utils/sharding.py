@@ -0,0 +1,375 @@
+import os
+import time
+import queue
+import signal
+import asyncio
+import logging
+import threading
+import multiprocessing
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+# Фабрика приложения шарда: (номер шарда, число шардов) -> Application без updater
+ApplicationFactory = Callable[[int, int], Application]
+# Вызывается в процессе шарда перед подтверждением: делает записи обработанных
+# обновлений постоянными (например, сбрасывает очередь отложенной записи)
+AckBarrier = Callable[[], Awaitable[None]]
+
+# Сообщения шарда диспетчеру: (состояние, номера обновлений)
+STARTED = 'started'    # обработчик начал обновление
+HANDLED = 'handled'    # обработчик завершился, записи могут быть еще в памяти
+DURABLE = 'durable'    # записи обновления сохранены, повторно передавать не нужно
+
+def shard_for(chat_id: int, shards: int) -> int:
+    """Номер шарда для чата: все обновления чата попадают в один процесс"""
+    return chat_id % shards
+
+def connection_budget_per_shard(budget: int, shards: int) -> int:
+    """Делит общий лимит соединений с базой между шардами.
+
+    Каждому шарду нужно хотя бы одно соединение, поэтому шардов не может
+    быть больше лимита: иначе сумма превысила бы DB_CONNECTION_BUDGET.
+    """
+    if budget < shards:
+        raise ValueError(
+            f"DB_CONNECTION_BUDGET={budget} меньше числа шардов SHARD_WORKERS={shards}: "
+            f"каждому шарду нужно хотя бы одно соединение"
+        )
+    return budget // shards
+
+async def _run_worker(application: Application, inbox, acks, heartbeat, heartbeat_interval: float,
+                      ack_barrier: Optional[AckBarrier], ack_interval: float):
+    loop = asyncio.get_running_loop()
+    processing = set()
+    # Обработанные, но еще не подтвержденные обновления (при ack_barrier)
+    handled: List[int] = []
+
+    async def beat():
+        while True:
+            heartbeat.value = time.time()
+            await asyncio.sleep(heartbeat_interval)
+
+    async def confirm():
+        nonlocal handled
+        if not handled:
+            return
+        seqs, handled = handled, []
+        try:
+            await ack_barrier()
+        except Exception as e:
+            # Обновления подтвердятся после следующего успешного сброса
+            handled[:0] = seqs
+            logger.error(f"Не удалось сохранить записи перед подтверждением: {str(e)}")
+            return
+        acks.send((DURABLE, seqs))
+
+    async def confirm_periodically():
+        while True:
+            await asyncio.sleep(ack_interval)
+            await confirm()
+
+    async def process(seq: int, update: Update):
+        async def run():
+            # Выполняется, когда update_processor дошел до обновления в очереди чата
+            acks.send((STARTED, [seq]))
+            await application.process_update(update)
+
+        try:
+            # Как Application с concurrent_updates, но с подтверждением после обработки
+            await application.update_processor.process_update(update, run())
+        finally:
+            if ack_barrier is None:
+                acks.send((DURABLE, [seq]))
+            else:
+                acks.send((HANDLED, [seq]))
+                handled.append(seq)
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        background = [asyncio.create_task(beat())]
+        if ack_barrier is not None:
+            background.append(asyncio.create_task(confirm_periodically()))
+        try:
+            while True:
+                data = await loop.run_in_executor(None, inbox.recv)
+                if data is None:
+                    break
+                seq, update = data
+                # Задачи создаются в порядке получения, порядок в чате сохраняет update_processor
+                task = asyncio.create_task(process(seq, Update.de_json(update, application.bot)))
+                processing.add(task)
+                task.add_done_callback(processing.discard)
+        finally:
+            for task in background:
+                task.cancel()
+            # Дожидаемся обработки уже полученных обновлений
+            if processing:
+                await asyncio.gather(*processing, return_exceptions=True)
+            if ack_barrier is not None:
+                await confirm()
+            await application.stop()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+
+def _worker_main(index: int, shards: int, factory: ApplicationFactory, inbox, acks, heartbeat, heartbeat_interval: float,
+                 ack_barrier: Optional[AckBarrier], ack_interval: float):
+    """Точка входа процесса-шарда"""
+    # Ctrl+C получает вся группа процессов, остановкой шардов управляет диспетчер
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    application = factory(index, shards)
+    logger.info(f"Шард {index} запущен (pid {os.getpid()})")
+    asyncio.run(_run_worker(application, inbox, acks, heartbeat, heartbeat_interval, ack_barrier, ack_interval))
+
+class _Shard:
+    """Процесс-шард, канал обновлений и канал подтверждений их обработки"""
+
+    def __init__(self, index: int, mp_context):
+        self.index = index
+        self.process: Optional[multiprocessing.Process] = None
+        # Обновления, еще не переданные в канал
+        self.outbox: queue.Queue = queue.Queue()
+        self.reader, self.writer = mp_context.Pipe(duplex=False)
+        self.ack_reader, self.ack_writer = mp_context.Pipe(duplex=False)
+        # Устанавливается, когда прочитаны все подтверждения текущего процесса
+        self.acks_closed = threading.Event()
+        self.heartbeat = mp_context.Value('d', 0.0, lock=False)
+        self.lock = threading.Lock()
+        # Переданные, но еще не подтвержденные шардом обновления: номер -> данные
+        self.unacked: Dict[int, dict] = {}
+        # Обновления, которые шард начал, но еще не закончил обрабатывать
+        self.started: Set[int] = set()
+        # Сколько процессов шарда завершилось во время обработки обновления
+        self.failures: Dict[int, int] = {}
+        # Обновления, исключенные после max_deliveries неудачных попыток
+        self.dead_letter: List[dict] = []
+        self.next_seq = 0
+        # Меняется при каждом перезапуске шарда
+        self.generation = 0
+        self.restarts = 0
+        self.routed = 0
+        self.redelivered = 0
+
+class ShardedDispatcher:
+    """Распределяет обновления по процессам-шардам по chat_id.
+
+    Каждый шард - отдельный процесс со своим Application, пулом соединений
+    и кэшами. Обновления одного чата всегда попадают в один шард и
+    обрабатываются в порядке получения. Фоновый поток следит за шардами и
+    перезапускает упавшие или зависшие (без heartbeat дольше health_timeout).
+
+    Доставка - "хотя бы один раз": шард подтверждает обновление, когда его
+    записи сохранены (после ack_barrier, если он задан, - не чаще раза в
+    ack_interval секунд), и все неподтвержденные обновления упавшего шарда по
+    порядку передаются новому процессу. Повторы отсеивает само приложение
+    шарда (по update_id). Обновление, во время обработки которого процесс
+    шарда завершался max_deliveries раз, больше не передается: оно убирается
+    в dead_letter с записью в лог.
+    """
+
+    def __init__(self, factory: ApplicationFactory, shards: int,
+                 heartbeat_interval: float = 1.0, health_timeout: float = 30.0,
+                 startup_timeout: float = 60.0, ack_barrier: Optional[AckBarrier] = None,
+                 ack_interval: float = 1.0, max_deliveries: int = 3):
+        self.factory = factory
+        self.heartbeat_interval = heartbeat_interval
+        self.health_timeout = health_timeout
+        self.startup_timeout = startup_timeout
+        self.ack_barrier = ack_barrier
+        self.ack_interval = ack_interval
+        self.max_deliveries = max_deliveries
+        # spawn: шард начинает с чистого интерпретатора без потоков и event loop диспетчера
+        self.mp_context = multiprocessing.get_context('spawn')
+        self.shards = [_Shard(index, self.mp_context) for index in range(shards)]
+        self.stopping = threading.Event()
+        self.threads: List[threading.Thread] = []
+
+    def _spawn(self, shard: _Shard):
+        # Время на запуск процесса засчитывается как heartbeat
+        shard.heartbeat.value = time.time() + self.startup_timeout - self.health_timeout
+        shard.acks_closed.clear()
+        shard.process = self.mp_context.Process(
+            target=_worker_main,
+            args=(shard.index, len(self.shards), self.factory, shard.reader, shard.ack_writer,
+                  shard.heartbeat, self.heartbeat_interval, self.ack_barrier, self.ack_interval),
+            # Не daemon: шард сам запускает процессы отрисовки графиков
+            name=f'shard-{shard.index}'
+        )
+        shard.process.start()
+        # Копия пишущего конца есть только у шарда: после его завершения
+        # чтение подтверждений получит EOF
+        shard.ack_writer.close()
+
+    def start(self):
+        for shard in self.shards:
+            self._spawn(shard)
+            for target, name in ((self._send_loop, 'sender'), (self._ack_loop, 'acks')):
+                thread = threading.Thread(target=target, args=(shard,), name=f'shard-{shard.index}-{name}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+        monitor = threading.Thread(target=self._monitor, name='shard-monitor', daemon=True)
+        monitor.start()
+        self.threads.append(monitor)
+        logger.info(f"Запущено шардов: {len(self.shards)}")
+
+    def route(self, update: Update):
+        """Отправляет обновление в шард его чата (без ожидания)"""
+        chat_id = update.effective_chat.id if update.effective_chat else 0
+        shard = self.shards[shard_for(chat_id, len(self.shards))]
+        shard.routed += 1
+        shard.outbox.put(update.to_dict())
+
+    def _send_loop(self, shard: _Shard):
+        # Отправка в канал может блокироваться, пока шард не прочитает данные,
+        # поэтому она выполняется в отдельном потоке, а не в event loop
+        while True:
+            data = shard.outbox.get()
+            with shard.lock:
+                if data is not None:
+                    seq = shard.next_seq
+                    shard.next_seq += 1
+                    shard.unacked[seq] = data
+                    data = (seq, data)
+                generation = shard.generation
+            while True:
+                with shard.lock:
+                    # Обновление уже передал новому процессу перезапуск (_restart)
+                    if data is not None and shard.generation != generation:
+                        break
+                    writer = shard.writer
+                if writer is None:
+                    # Шард перезапускается
+                    time.sleep(0.1)
+                    continue
+                try:
+                    writer.send(data)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            if data is None:
+                return
+
+    def _ack_loop(self, shard: _Shard):
+        while True:
+            reader = shard.ack_reader
+            try:
+                state, seqs = reader.recv()
+            except (EOFError, OSError):
+                # Процесс шарда завершился: ждем канал нового процесса
+                reader.close()
+                shard.acks_closed.set()
+                while shard.ack_reader is reader:
+                    if self.stopping.is_set():
+                        return
+                    time.sleep(0.1)
+                continue
+            with shard.lock:
+                for seq in seqs:
+                    if state == STARTED:
+                        shard.started.add(seq)
+                    else:
+                        shard.started.discard(seq)
+                    if state == DURABLE:
+                        shard.unacked.pop(seq, None)
+                        shard.failures.pop(seq, None)
+
+    def _restart(self, shard: _Shard, reason: str):
+        process = shard.process
+        logger.error(f"Шард {shard.index} (pid {process.pid}) {reason}, перезапускаю")
+        if process.is_alive():
+            process.kill()
+        process.join(timeout=5)
+        # Подтверждения, которые шард успел отправить, не нужно передавать заново
+        if not shard.acks_closed.wait(5):
+            logger.warning(f"Не дождался подтверждений шарда {shard.index}")
+
+        # Останавливаем отправку: обновления, переданные старому процессу, но
+        # не подтвержденные им, передаются новому процессу по порядку
+        with shard.lock:
+            old_reader, old_writer = shard.reader, shard.writer
+            shard.writer = None
+            shard.generation += 1
+            # Процесс завершился во время обработки этих обновлений
+            for seq in shard.started & shard.unacked.keys():
+                shard.failures[seq] = shard.failures.get(seq, 0) + 1
+                if shard.failures[seq] >= self.max_deliveries:
+                    self._dead_letter(shard, seq)
+            shard.started.clear()
+            pending = list(shard.unacked.items())
+        # Закрытие канала прерывает отправку, зависшую на заполненном канале
+        old_reader.close()
+        old_writer.close()
+
+        shard.reader, writer = self.mp_context.Pipe(duplex=False)
+        shard.ack_reader, shard.ack_writer = self.mp_context.Pipe(duplex=False)
+        shard.restarts += 1
+        shard.redelivered += len(pending)
+        self._spawn(shard)
+        for data in pending:
+            writer.send(data)
+        with shard.lock:
+            shard.writer = writer
+        logger.info(f"Шард {shard.index} перезапущен, повторно передано неподтвержденных обновлений: {len(pending)}")
+
+    def _dead_letter(self, shard: _Shard, seq: int):
+        data = shard.unacked.pop(seq)
+        attempts = shard.failures.pop(seq)
+        shard.dead_letter.append(data)
+        message = data.get('message') or {}
+        chat_id = (message.get('chat') or {}).get('id')
+        logger.error(
+            f"Обновление {data.get('update_id')} чата {chat_id}: шард {shard.index} завершался "
+            f"во время его обработки {attempts} раз(а), обновление исключено из доставки"
+        )
+
+    def check_health(self):
+        now = time.time()
+        for shard in self.shards:
+            if self.stopping.is_set():
+                return
+            if not shard.process.is_alive():
+                self._restart(shard, f"завершился с кодом {shard.process.exitcode}")
+            elif now - shard.heartbeat.value > self.health_timeout:
+                self._restart(shard, "не отвечает")
+
+    def _monitor(self):
+        while not self.stopping.wait(self.heartbeat_interval):
+            try:
+                self.check_health()
+            except Exception as e:
+                logger.error(f"Ошибка проверки шардов: {str(e)}")
+
+    def stats(self) -> List[dict]:
+        now = time.time()
+        return [
+            {
+                'shard': shard.index,
+                'pid': shard.process.pid if shard.process else None,
+                'alive': bool(shard.process and shard.process.is_alive()),
+                'restarts': shard.restarts,
+                'routed': shard.routed,
+                'backlog': shard.outbox.qsize(),
+                'unacked': len(shard.unacked),
+                'redelivered': shard.redelivered,
+                'dead_letter': len(shard.dead_letter),
+                'heartbeat_age': max(0.0, now - shard.heartbeat.value),
+            }
+            for shard in self.shards
+        ]
+
+    def stop(self, timeout: float = 30.0):
+        """Останавливает шарды, дав им обработать уже полученные обновления"""
+        self.stopping.set()
+        for shard in self.shards:
+            shard.outbox.put(None)
+        deadline = time.time() + timeout
+        for thread in self.threads:
+            thread.join(timeout=max(0.0, deadline - time.time()))
+        for shard in self.shards:
+            shard.process.join(timeout=max(0.0, deadline - time.time()))
+            if shard.process.is_alive():
+                shard.process.terminate()
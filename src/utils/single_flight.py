@@ -0,0 +1,36 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable
+
+class SingleFlight:
+    """Объединяет одинаковые одновременные вызовы.
+
+    Первый вызов с ключом выполняет работу, остальные вызовы с тем же ключом,
+    пришедшие до ее окончания, ждут и получают его результат. Готовые
+    результаты не хранятся: повторный вызов после окончания выполняет работу
+    заново (кэшированием занимаются ChartCache и DigestStore).
+    """
+
+    def __init__(self):
+        self.inflight: Dict[Hashable, asyncio.Future] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable]):
+        task = self.inflight.get(key)
+        if task is None:
+            self.executed += 1
+            # Работа выполняется отдельной задачей: отмена первого вызова
+            # не должна отменять ее для остальных
+            task = asyncio.ensure_future(func())
+            self.inflight[key] = task
+            task.add_done_callback(lambda done: self.inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            'executed': self.executed,
+            'coalesced': self.coalesced,
+            'inflight': len(self.inflight),
+        }
@@ -0,0 +1,176 @@
+import csv
+import re
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Колонки CSV экспорта; тот же файл можно загрузить обратно через /import
+EXPORT_COLUMNS = ('timestamp', 'type', 'amount', 'category', 'description', 'user_id')
+
+# Строка импорта: (timestamp, type, amount, category, description)
+ImportRow = Tuple[datetime, str, float, str, str]
+
+# Названия колонок выписок: точное совпадение или вхождение подстроки
+HEADER_ALIASES = {
+    'timestamp': ('timestamp', 'date', 'дата'),
+    'amount': ('amount', 'сумма'),
+    'type': ('type', 'тип'),
+    'category': ('category', 'категория'),
+    'description': ('description', 'описание', 'назначение', 'комментарий', 'details'),
+}
+
+TYPE_VALUES = {
+    'income': 'income', 'доход': 'income', 'приход': 'income',
+    'expense': 'expense', 'расход': 'expense', 'списание': 'expense',
+}
+
+# Даты выписок: "31.01.2024", "31/01/2024 12:30", "31.01.2024 12:30:45".
+# Разбор регулярным выражением в несколько раз быстрее strptime
+DAY_FIRST_DATE = re.compile(r'(\d{1,2})[./](\d{1,2})[./](\d{4})(?:[ T](\d{1,2}):(\d{2})(?::(\d{2}))?)?$')
+
+# Заголовок ищется среди первых строк: в выписках ему часто предшествует шапка
+HEADER_SEARCH_ROWS = 20
+
+# Пробелы (включая неразрывные) между разрядами, апострофы и обозначения валют
+_AMOUNT_JUNK = re.compile(r"[\s'₽$€]|руб\.?|rub", re.IGNORECASE)
+
+def write_csv(batches: Iterable[List[tuple]], file) -> int:
+    """Пишет порции строк (колонки EXPORT_COLUMNS) в текстовый файл, возвращает количество строк"""
+    writer = csv.writer(file)
+    writer.writerow(EXPORT_COLUMNS)
+    count = 0
+    for rows in batches:
+        writer.writerows(
+            (timestamp.isoformat(sep=' ', timespec='seconds'), type_, f'{amount:.2f}', category, description or '', user_id)
+            for timestamp, type_, amount, category, description, user_id in rows
+        )
+        count += len(rows)
+    return count
+
+def parse_amount(value: str) -> Tuple[float, Optional[str]]:
+    """Сумма и ее явный знак ('+', '-' или None): "-1 234,56 ₽" -> (1234.56, '-')"""
+    value = _AMOUNT_JUNK.sub('', value).replace('−', '-').replace(',', '.')
+    sign = value[0] if value[:1] in ('+', '-') else None
+    amount = float(value.lstrip('+-'))
+    return amount, sign
+
+class StatementReader:
+    """Потоковое чтение CSV: экспорт бота или банковская выписка.
+
+    Кодировка (UTF-8 или cp1251) и разделитель определяются по началу файла,
+    колонки - по заголовку (HEADER_ALIASES). Категория строки берется из
+    колонки категории, если это уже категория бота, иначе определяется
+    classify по тексту категории и описания. Тип без колонки типа задает
+    знак суммы: минус - расход, плюс - доход, без знака - ключевые слова.
+    """
+
+    def __init__(self, path: str, classify: Callable[[str], Tuple[str, bool]], categories: Iterable[str] = ()):
+        self.path = path
+        self.classify = classify
+        self.categories = set(categories)
+        self.skipped = 0
+        # Описания в выписке повторяются, поэтому категория каждого текста определяется один раз
+        self._classified: Dict[str, Tuple[str, bool]] = {}
+
+    def _open(self):
+        with open(self.path, 'rb') as f:
+            head = f.read(64 * 1024)
+        try:
+            # Обрезанный на границе символ не считается ошибкой кодировки
+            head.decode('utf-8-sig')
+            encoding = 'utf-8-sig'
+        except UnicodeDecodeError as e:
+            encoding = 'utf-8-sig' if e.start >= len(head) - 3 else 'cp1251'
+        text = head.decode(encoding, errors='ignore')
+        # Разделителей в строке обычно больше, чем десятичных запятых в суммах
+        delimiter = max(',;\t', key=text.count)
+        return open(self.path, encoding=encoding, newline=''), delimiter
+
+    @staticmethod
+    def _find_columns(header: List[str]) -> Dict[str, int]:
+        names = [name.strip().lower() for name in header]
+        columns = {}
+        for field, aliases in HEADER_ALIASES.items():
+            # Сначала точное совпадение, затем первая колонка, содержащая псевдоним
+            for exact in (True, False):
+                for index, name in enumerate(names):
+                    if index in columns.values():
+                        continue
+                    if any(name == alias if exact else alias in name for alias in aliases):
+                        columns[field] = index
+                        break
+                if field in columns:
+                    break
+        return columns
+
+    @staticmethod
+    def _parse_timestamp(value: str) -> datetime:
+        match = DAY_FIRST_DATE.match(value)
+        if match is not None:
+            day, month, year, hour, minute, second = match.groups()
+            return datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0))
+        parsed = datetime.fromisoformat(value)
+        # Транзакции хранятся в местном времени без часового пояса
+        return parsed.astimezone().replace(tzinfo=None) if parsed.tzinfo else parsed
+
+    def _parse_row(self, row: List[str], columns: Dict[str, int]) -> ImportRow:
+        def get(field: str) -> str:
+            index = columns.get(field)
+            return row[index].strip() if index is not None and index < len(row) else ''
+
+        timestamp = self._parse_timestamp(get('timestamp'))
+        amount, sign = parse_amount(get('amount'))
+        description = get('description')
+        category = get('category').lower()
+        type_ = TYPE_VALUES.get(get('type').lower())
+
+        income = False
+        if category not in self.categories:
+            text = f'{category} {description}'
+            classified = self._classified.get(text)
+            if classified is None:
+                classified = self._classified[text] = self.classify(text)
+            category, income = classified
+        if type_ is None:
+            if sign == '-':
+                type_ = 'expense'
+            elif sign == '+' or income:
+                type_ = 'income'
+            else:
+                type_ = 'expense'
+        return timestamp, type_, amount, category, description
+
+    def rows(self) -> Iterator[ImportRow]:
+        """Строки файла; строки, которые не удалось разобрать, считаются в skipped"""
+        file, delimiter = self._open()
+        with file:
+            reader = csv.reader(file, delimiter=delimiter)
+            columns = None
+            for _ in range(HEADER_SEARCH_ROWS):
+                try:
+                    header = next(reader, None)
+                except csv.Error as e:
+                    raise ValueError(f"Ошибка чтения CSV: {e}") from e
+                if header is None:
+                    break
+                found = self._find_columns(header)
+                if 'timestamp' in found and 'amount' in found:
+                    columns = found
+                    break
+            if columns is None:
+                raise ValueError("В файле не найдены колонки даты и суммы")
+
+            try:
+                for row in reader:
+                    if not any(value.strip() for value in row):
+                        continue
+                    try:
+                        parsed = self._parse_row(row, columns)
+                    except (ValueError, IndexError):
+                        self.skipped += 1
+                        continue
+                    if parsed[2] == 0:
+                        self.skipped += 1
+                        continue
+                    yield parsed
+            except csv.Error as e:
+                raise ValueError(f"Ошибка чтения CSV: {e}") from e
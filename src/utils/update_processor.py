@@ -0,0 +1,73 @@
+import sys
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Optional
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает обновления разных чатов параллельно, а одного чата - по очереди.
+
+    Обновления одного чата ждут друг друга на блокировке чата, поэтому
+    записи из одного чата никогда не переупорядочиваются. asyncio.Lock
+    пропускает ожидающих в порядке очереди, а Application создает задачи
+    в порядке получения обновлений.
+
+    Слот из max_concurrent_updates обновление занимает, только когда подошла
+    очередь его чата: иначе очередь одного чата заняла бы все слоты, ожидая
+    блокировки, и обновления остальных чатов стояли бы за ней.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        # BaseUpdateProcessor.process_update (@final) берет слот своего семафора
+        # до do_process_update, то есть до очереди чата. Базовый семафор
+        # создается по свойству max_concurrent_updates и не должен ограничивать,
+        # поэтому на время __init__ свойство возвращает sys.maxsize, а слоты
+        # выдает свой семафор уже после блокировки чата
+        self._max_updates = sys.maxsize
+        super().__init__(sys.maxsize)
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates должно быть положительным")
+        self._max_updates = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        # Сколько обновлений чата сейчас обрабатывается или ждет блокировки
+        self._chat_waiters: Dict[int, int] = {}
+
+    @property
+    def max_concurrent_updates(self) -> int:
+        return self._max_updates
+
+    @staticmethod
+    def _chat_id(update: object) -> Optional[int]:
+        if isinstance(update, Update) and update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        chat_id = self._chat_id(update)
+        if chat_id is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        self._chat_waiters[chat_id] = self._chat_waiters.get(chat_id, 0) + 1
+        try:
+            async with lock:
+                async with self._slots:
+                    await coroutine
+        finally:
+            self._chat_waiters[chat_id] -= 1
+            # Блокировки неактивных чатов не храним
+            if not self._chat_waiters[chat_id]:
+                del self._chat_waiters[chat_id]
+                del self._chat_locks[chat_id]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
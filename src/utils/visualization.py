@@ -1,81 +1,120 @@
 import io
-from typing import Dict, List
-import matplotlib.pyplot as plt
+import time
+from typing import List, Optional
+from matplotlib.figure import Figure
 import seaborn as sns
 from datetime import datetime, timedelta
 import pandas as pd
 from models.transaction import Transaction
-import plotly.graph_objects as go
+from utils.metrics import observe_chart
+from utils.chart_renderer import CHART_DPI, CHART_FORMAT, CHART_QUALITY
+
+def transactions_to_frame(transactions: List[Transaction]) -> pd.DataFrame:
+    """Собирает DataFrame (timestamp, amount, type, category) из ORM-объектов"""
+    return pd.DataFrame(
+        [(t.timestamp, t.amount, t.type, t.category) for t in transactions],
+        columns=['timestamp', 'amount', 'type', 'category']
+    )
+
+def _quantize_png(png: bytes) -> bytes:
+    """Переводит PNG в палитру из 256 цветов: графики почти не меняются, а файл меньше в 2-4 раза"""
+    from PIL import Image
+    image = Image.open(io.BytesIO(png)).convert('RGB')
+    buf = io.BytesIO()
+    image.quantize(256, method=Image.Quantize.FASTOCTREE).save(buf, format='PNG')
+    return buf.getvalue()
+
+def _encode_figure(fig: Figure, chart: str, started: float, **savefig_kwargs) -> bytes:
+    """Кодирует график (CHART_FORMAT, CHART_DPI) и записывает время построения и кодирования"""
+    encode_started = time.perf_counter()
+    buf = io.BytesIO()
+    if CHART_FORMAT in ('jpeg', 'webp'):
+        fig.savefig(buf, format=CHART_FORMAT, dpi=CHART_DPI, pil_kwargs={'quality': CHART_QUALITY}, **savefig_kwargs)
+        image = buf.getvalue()
+    else:
+        fig.savefig(buf, format='png', dpi=CHART_DPI, **savefig_kwargs)
+        image = _quantize_png(buf.getvalue()) if CHART_FORMAT == 'png8' else buf.getvalue()
+    observe_chart(chart, encode_started - started, time.perf_counter() - encode_started)
+    return image
+
+def render_pie_chart(df: pd.DataFrame, transaction_type: str) -> Optional[bytes]:
+    """Рисует круговую диаграмму по категориям и возвращает изображение"""
+    started = time.perf_counter()
+    df = df.loc[df['type'] == transaction_type, ['category', 'amount']]
+
+    if df.empty:
+        return None
+
+    # Один сектор на категорию, а не на каждую транзакцию
+    totals = df.groupby('category')['amount'].sum().sort_values(ascending=False)
+
+    fig = Figure(figsize=(10, 8))
+    ax = fig.subplots()
+    ax.pie(totals.values, labels=totals.index, autopct='%1.1f%%')
+    ax.set_title(f'Распределение по категориям ({transaction_type})')
+    return _encode_figure(fig, f'pie_{transaction_type}', started)
+
+def render_time_series(df: pd.DataFrame, days: Optional[int] = 30) -> Optional[bytes]:
+    """Рисует график доходов/расходов по времени и возвращает изображение.
+
+    days - сколько последних дней показывать; None - весь переданный период
+    (например, закрытый месяц).
+    """
+    started = time.perf_counter()
+    if df.empty:
+        return None
+
+    df = pd.DataFrame({
+        'date': df['timestamp'].dt.date,
+        'amount': df['amount'],
+        'type': df['type'],
+    })
+    if days is not None:
+        start_date = datetime.now().date() - timedelta(days=days)
+        df = df[df['date'] >= start_date]
+
+    fig = Figure(figsize=(12, 6))
+    ax = fig.subplots()
+    sns.lineplot(data=df, x='date', y='amount', hue='type', ax=ax)
+    ax.set_title('Динамика доходов и расходов')
+    ax.tick_params(axis='x', labelrotation=45)
+    return _encode_figure(fig, 'time_series', started, bbox_inches='tight')
+
+def render_category_bar_chart(df: pd.DataFrame) -> Optional[bytes]:
+    """Рисует столбчатую диаграмму по категориям и возвращает изображение"""
+    started = time.perf_counter()
+    if df.empty:
+        return None
+
+    fig = Figure(figsize=(12, 6))
+    ax = fig.subplots()
+    sns.barplot(data=df, x='category', y='amount', hue='type', ax=ax)
+    ax.set_title('Сравнение доходов и расходов по категориям')
+    ax.tick_params(axis='x', labelrotation=45)
+    return _encode_figure(fig, 'category_bar', started, bbox_inches='tight')
+
+def _to_buffer(png: Optional[bytes]) -> Optional[io.BytesIO]:
+    return io.BytesIO(png) if png is not None else None
+
+def warm_up():
+    """Первая отрисовка загружает шрифты и кэши рендера - выполняем ее заранее"""
+    fig = Figure(figsize=(1, 1))
+    fig.subplots().set_title('прогрев')
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
 
 class Visualizer:
     @staticmethod
     def create_pie_chart(transactions: List[Transaction], transaction_type: str) -> io.BytesIO:
         """Создает круговую диаграмму для расходов или доходов по категориям"""
-        df = pd.DataFrame([
-            {'category': t.category, 'amount': t.amount}
-            for t in transactions if t.type == transaction_type
-        ])
-        
-        if df.empty:
-            return None
-
-        plt.figure(figsize=(10, 8))
-        plt.pie(df['amount'], labels=df['category'], autopct='%1.1f%%')
-        plt.title(f'Распределение по категориям ({transaction_type})')
-        
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
-        plt.close()
-        return buf
+        return _to_buffer(render_pie_chart(transactions_to_frame(transactions), transaction_type))
 
     @staticmethod
     def create_time_series(transactions: List[Transaction], days: int = 30) -> io.BytesIO:
         """Создает график расходов/доходов по времени"""
-        df = pd.DataFrame([
-            {
-                'date': t.timestamp.date(),
-                'amount': t.amount,
-                'type': t.type
-            }
-            for t in transactions
-        ])
-        
-        if df.empty:
-            return None
-
-        start_date = datetime.now().date() - timedelta(days=days)
-        df = df[df['date'] >= start_date]
-        
-        plt.figure(figsize=(12, 6))
-        sns.lineplot(data=df, x='date', y='amount', hue='type')
-        plt.title('Динамика доходов и расходов')
-        plt.xticks(rotation=45)
-        
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', bbox_inches='tight')
-        buf.seek(0)
-        plt.close()
-        return buf
+        return _to_buffer(render_time_series(transactions_to_frame(transactions), days))
 
     @staticmethod
     def create_category_bar_chart(transactions: List[Transaction]) -> io.BytesIO:
         """Создает столбчатую диаграмму по категориям"""
-        df = pd.DataFrame([
-            {'category': t.category, 'amount': t.amount, 'type': t.type}
-            for t in transactions
-        ])
-        
-        if df.empty:
-            return None
-
-        plt.figure(figsize=(12, 6))
-        sns.barplot(data=df, x='category', y='amount', hue='type')
-        plt.title('Сравнение доходов и расходов по категориям')
-        plt.xticks(rotation=45)
-        
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', bbox_inches='tight')
-        buf.seek(0)
-        plt.close()
-        return buf 
\ No newline at end of file
+        return _to_buffer(render_category_bar_chart(transactions_to_frame(transactions)))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Модули бота импортируются так же, как в src/main.py
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
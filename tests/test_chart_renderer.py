@@ -0,0 +1,50 @@
+import asyncio
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+
+from utils.chart_renderer import ChartRenderer
+
+
+class FakeExecutor(Executor):
+    """Пул без процессов: сломанный отвечает BrokenProcessPool на каждую задачу"""
+
+    def __init__(self, broken: bool):
+        self.broken = broken
+        self.shut_down = False
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        if self.broken:
+            future.set_exception(BrokenProcessPool('worker died'))
+        else:
+            future.set_result((b'chart', []))
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self.shut_down = True
+
+
+def test_broken_pool_is_replaced_once(monkeypatch):
+    renderer = ChartRenderer(max_workers=1)
+    created = []
+
+    def create_executor():
+        # Первый пул сломан, следующие работают
+        executor = FakeExecutor(broken=not created)
+        created.append(executor)
+        return executor
+
+    monkeypatch.setattr(renderer, '_create_executor', create_executor)
+
+    async def render_three():
+        return await asyncio.gather(*(renderer._render('render_pie_chart') for _ in range(3)))
+
+    charts = asyncio.run(render_three())
+    assert [chart.getvalue() for chart in charts] == [b'chart'] * 3
+    assert len(created) == 2
+    broken, replacement = created
+    assert broken.shut_down
+    assert renderer.executor is replacement
+
+    renderer.close()
+    assert replacement.shut_down and renderer.executor is None
@@ -0,0 +1,93 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import main
+from utils.archive import TransactionArchive
+from utils.digests import DigestStore, DutyCycle, parse_month, previous_month
+from utils.single_flight import SingleFlight
+
+
+@pytest.mark.parametrize('share', [0, -0.5, 1.5])
+def test_duty_cycle_rejects_invalid_share(share):
+    with pytest.raises(ValueError):
+        DutyCycle(share)
+
+
+def test_duty_cycle_pause():
+    assert DutyCycle(0.5).pause(2.0) == 2.0
+    assert DutyCycle(0.2).pause(1.0) == pytest.approx(4.0)
+    assert DutyCycle(1).pause(5.0) == 0.0
+
+
+class FakeJobQueue:
+    def __init__(self):
+        self.jobs = []
+
+    def run_daily(self, callback, time, name=None):
+        self.jobs.append(name)
+
+
+class FakeApplication:
+    def __init__(self):
+        self.job_queue = FakeJobQueue()
+
+
+@pytest.mark.parametrize('cpu, db, scheduled', [
+    (0.5, 0.2, True),
+    (0, 0.2, False),
+    (0.5, 0, False),
+    (-1, 0.2, False),
+    (0.5, 2, False),
+])
+def test_schedule_jobs_checks_budgets(monkeypatch, tmp_path, cpu, db, scheduled):
+    monkeypatch.setattr(main, 'digest_store', DigestStore(str(tmp_path)))
+    monkeypatch.setattr(main, 'DIGEST_CPU_BUDGET', cpu)
+    monkeypatch.setattr(main, 'DIGEST_DB_BUDGET', db)
+    application = FakeApplication()
+    main.schedule_jobs(application)
+    assert application.job_queue.jobs == (['digests'] if scheduled else [])
+
+
+def test_months():
+    assert previous_month(datetime(2024, 1, 15)) == datetime(2023, 12, 1)
+    assert parse_month('2024-03') == datetime(2024, 3, 1)
+
+
+class FakeDatabase:
+    """Отпечаток месяца не меняется при архивации, как и в Database"""
+
+    def __init__(self, archive: TransactionArchive):
+        self.archive = archive
+
+    async def get_month_fingerprint(self, chat_id, month):
+        return (2, 300.0)
+
+    def is_month_archived(self, chat_id, month):
+        return self.archive.has_month(chat_id, month)
+
+
+@pytest.mark.parametrize('archive_file, saved', [
+    (None, True),
+    # Строки удалены из таблицы, но файл архива еще не заменен
+    ('2024-02.arrow.tmp', False),
+    ('2024-02.arrow', False),
+])
+def test_digest_is_not_saved_for_archived_month(monkeypatch, tmp_path, archive_file, saved):
+    archive = TransactionArchive(str(tmp_path / 'archive'))
+    if archive_file is not None:
+        (tmp_path / 'archive' / 'chat_1').mkdir(parents=True)
+        (tmp_path / 'archive' / 'chat_1' / archive_file).write_bytes(b'')
+    store = DigestStore(str(tmp_path / 'digests'))
+    month = datetime(2024, 2, 1)
+
+    async def render(chat_id, month):
+        return {'stats': {'categories': {}}, 'charts': [None, None, None], 'sent': False}
+
+    monkeypatch.setattr(main, 'db', FakeDatabase(archive))
+    monkeypatch.setattr(main, 'digest_store', store)
+    monkeypatch.setattr(main, 'single_flight', SingleFlight())
+    monkeypatch.setattr(main, 'render_month_digest', render)
+    asyncio.run(main.get_month_digest(1, month))
+    assert (store.load(1, month, [2, 300.0], main.CHART_FORMAT) is not None) == saved
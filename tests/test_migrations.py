@@ -0,0 +1,82 @@
+import os
+
+import sqlalchemy as sa
+from alembic import command
+from alembic.config import Config
+
+from models.transaction import Base
+import models.chat_budget  # noqa: F401
+import models.chat_category  # noqa: F401
+import models.daily_total  # noqa: F401
+import models.processed_update  # noqa: F401
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+TABLES = {'transactions', 'daily_totals', 'chat_categories', 'chat_budgets', 'processed_updates'}
+
+
+def alembic_config(monkeypatch, path: str) -> Config:
+    for variable in ('DATABASE_URL', 'DATABASE_PUBLIC_URL'):
+        monkeypatch.delenv(variable, raising=False)
+    monkeypatch.setenv('DATABASE_PATH', path)
+    config = Config(os.path.join(ROOT, 'alembic.ini'))
+    config.set_main_option('script_location', os.path.join(ROOT, 'migrations'))
+    return config
+
+
+def table_names(path: str) -> set:
+    engine = sa.create_engine(f'sqlite:///{path}')
+    try:
+        return set(sa.inspect(engine).get_table_names()) - {'alembic_version'}
+    finally:
+        engine.dispose()
+
+
+def test_upgrade_and_downgrade_empty_database(monkeypatch, tmp_path):
+    path = str(tmp_path / 'empty.db')
+    config = alembic_config(monkeypatch, path)
+
+    command.upgrade(config, 'head')
+    assert table_names(path) == TABLES
+
+    command.downgrade(config, 'base')
+    assert table_names(path) == set()
+
+    command.upgrade(config, 'head')
+    assert table_names(path) == TABLES
+
+
+def test_upgrade_database_created_by_create_all(monkeypatch, tmp_path):
+    path = str(tmp_path / 'existing.db')
+    engine = sa.create_engine(f'sqlite:///{path}')
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+    command.upgrade(alembic_config(monkeypatch, path), 'head')
+    assert table_names(path) == TABLES
+
+
+def test_daily_totals_migration_backfills_existing_transactions(monkeypatch, tmp_path):
+    path = str(tmp_path / 'old.db')
+    config = alembic_config(monkeypatch, path)
+    command.upgrade(config, '0001')
+    engine = sa.create_engine(f'sqlite:///{path}')
+    try:
+        with engine.begin() as connection:
+            connection.execute(sa.text(
+                "INSERT INTO transactions (amount, type, category, description, user_id, chat_id, timestamp) VALUES "
+                "(100, 'expense', 'продукты', '', 1, 1, '2024-03-01 10:00:00'),"
+                "(50, 'expense', 'продукты', '', 1, 1, '2024-03-01 20:00:00'),"
+                "(30, 'income', 'зарплата', '', 1, 2, '2024-03-02 00:00:00')"
+            ))
+
+        command.upgrade(config, 'head')
+        with engine.connect() as connection:
+            rows = connection.execute(sa.text(
+                "SELECT chat_id, day, type, category, amount, count FROM daily_totals ORDER BY chat_id"
+            )).all()
+        assert [tuple(row) for row in rows] == [
+            (1, '2024-03-01', 'expense', 'продукты', 150.0, 2),
+            (2, '2024-03-02', 'income', 'зарплата', 30.0, 1),
+        ]
+    finally:
+        engine.dispose()
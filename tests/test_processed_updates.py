@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models.processed_update import ProcessedUpdate
+from models.transaction import Transaction
+from utils.database import Database
+
+CHAT_ID = 1
+
+
+def make_transactions(*amounts) -> list:
+    return [
+        Transaction(amount=amount, type='expense', category='продукты', description='',
+                    user_id=1, chat_id=CHAT_ID, timestamp=datetime.now())
+        for amount in amounts
+    ]
+
+
+@pytest.fixture(params=[False, True], ids=['direct', 'write_behind'])
+def db(request, tmp_path, monkeypatch):
+    monkeypatch.setenv('DB_WRITE_FLUSH_INTERVAL', '3600')
+    database = Database(write_behind=request.param, database_url=f'sqlite:///{tmp_path / "bot.db"}')
+    yield database
+    database.close()
+
+
+def test_update_is_marked_with_its_transactions(db):
+    assert not db.is_update_processed(10)
+    db.add_transactions(make_transactions(100, 200), update_id=10)
+    # В режиме отложенной записи отметка видна еще до сброса очереди
+    assert db.is_update_processed(10)
+
+    db.flush_writes()
+    assert db.is_update_processed(10)
+    assert db.get_statistics(CHAT_ID)['total_expense'] == 300
+    session = db.Session()
+    try:
+        assert session.query(ProcessedUpdate).filter(ProcessedUpdate.update_id == 10).one().chat_id == CHAT_ID
+    finally:
+        session.close()
+
+
+def test_prune_keeps_recent_marks(db):
+    db.add_transactions(make_transactions(100), update_id=11)
+    db.flush_writes()
+    assert db.prune_processed_updates(datetime.now() - timedelta(hours=1)) == 0
+    assert db.prune_processed_updates(datetime.now() + timedelta(seconds=1)) == 1
+    assert not db.is_update_processed(11)
+
+
+def test_write_behind_fallback_keeps_update_atomic(tmp_path, monkeypatch):
+    monkeypatch.setenv('DB_WRITE_FLUSH_INTERVAL', '3600')
+    db = Database(write_behind=True, database_url=f'sqlite:///{tmp_path / "bot.db"}')
+    try:
+        db.add_transactions(make_transactions(100, None), update_id=20)
+        db.add_transactions(make_transactions(50), update_id=21)
+        for _ in range(db.write_queue.max_attempts):
+            db.write_queue.flush()
+
+        # Обновление с плохой строкой не записано целиком, соседнее - записано
+        assert [t.amount for t in db.write_queue.dead_letter] == [100, None]
+        assert not db.is_update_processed(20)
+        assert db.is_update_processed(21)
+        assert db.get_statistics(CHAT_ID)['total_expense'] == 50
+    finally:
+        db.close()
@@ -0,0 +1,105 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from models.daily_total import DailyTotal
+from models.transaction import Transaction
+from utils.database import Database, transaction_to_row
+from utils.rollups import split_range
+
+CHAT_ID = 1
+DAY = datetime(2024, 3, 1)
+
+
+def test_split_range_non_midnight_start():
+    start, end = DAY + timedelta(hours=10), DAY + timedelta(days=4, hours=15)
+    use_rollup, first_day, end_day, raw_ranges = split_range(start, end)
+    assert use_rollup
+    assert (first_day, end_day) == (date(2024, 3, 2), date(2024, 3, 5))
+    assert raw_ranges == [
+        (start, datetime(2024, 3, 2), False),
+        (datetime(2024, 3, 5), end, True),
+    ]
+
+
+def test_split_range_end_at_midnight():
+    start, end = DAY, DAY + timedelta(days=4)
+    use_rollup, first_day, end_day, raw_ranges = split_range(start, end)
+    assert use_rollup
+    assert (first_day, end_day) == (date(2024, 3, 1), date(2024, 3, 5))
+    # Конец включается: транзакции ровно в полночь читаются из transactions
+    assert raw_ranges == [(end, end, True)]
+
+
+@pytest.mark.parametrize('start, end', [
+    (DAY + timedelta(hours=10), DAY + timedelta(hours=18)),
+    (DAY, DAY + timedelta(hours=18)),
+    (DAY + timedelta(hours=23), DAY + timedelta(days=1, hours=1)),
+])
+def test_split_range_shorter_than_a_day(start, end):
+    assert split_range(start, end) == (False, None, None, [(start, end, True)])
+
+
+def test_split_range_open_ends():
+    assert split_range(None, None) == (True, None, None, [])
+    start = DAY + timedelta(hours=10)
+    assert split_range(start, None) == (True, date(2024, 3, 2), None, [(start, datetime(2024, 3, 2), False)])
+
+
+def make_rows(chat_id: int = CHAT_ID) -> list:
+    # Транзакции на границах дней и внутри них
+    moments = [
+        DAY, DAY + timedelta(hours=9), DAY + timedelta(hours=23, minutes=59),
+        DAY + timedelta(days=1), DAY + timedelta(days=1, hours=12),
+        DAY + timedelta(days=2), DAY + timedelta(days=3, hours=6), DAY + timedelta(days=4),
+    ]
+    return [
+        transaction_to_row(Transaction(amount=10 * (i + 1), type='expense', category='продукты',
+                                       description='', user_id=1, chat_id=chat_id, timestamp=moment))
+        for i, moment in enumerate(moments)
+    ]
+
+
+def expected_expense(rows, start, end) -> float:
+    return sum(row['amount'] for row in rows if start <= row['timestamp'] <= end)
+
+
+@pytest.mark.parametrize('start, end', [
+    (DAY + timedelta(hours=9), DAY + timedelta(days=3, hours=6)),
+    (DAY, DAY + timedelta(days=4)),
+    (DAY + timedelta(hours=1), DAY + timedelta(hours=23, minutes=59)),
+    (DAY + timedelta(days=1), DAY + timedelta(days=1)),
+])
+def test_statistics_match_raw_transactions(tmp_path, start, end):
+    db = Database(write_behind=False, database_url=f'sqlite:///{tmp_path / "bot.db"}')
+    try:
+        rows = make_rows()
+        for row in rows:
+            db.add_transaction(Transaction(**row))
+        assert db.get_statistics(CHAT_ID, start, end)['total_expense'] == expected_expense(rows, start, end)
+    finally:
+        db.close()
+
+
+def test_empty_rollup_is_filled_on_start(tmp_path):
+    url = f'sqlite:///{tmp_path / "bot.db"}'
+    db = Database(write_behind=False, database_url=url)
+    rows = make_rows() + make_rows(chat_id=2)
+    # Транзакции, записанные до появления daily_totals
+    with db.engine.begin() as connection:
+        connection.execute(Transaction.__table__.insert(), rows)
+    db.close()
+
+    db = Database(write_behind=False, database_url=url)
+    try:
+        session = db.Session()
+        try:
+            assert sum(total.count for total in session.query(DailyTotal)) == len(rows)
+        finally:
+            session.close()
+        assert db.get_statistics(CHAT_ID)['total_expense'] == expected_expense(make_rows(), DAY, DAY + timedelta(days=4))
+        assert db.get_active_chats(DAY) == [1, 2]
+        assert db.get_month_fingerprint(CHAT_ID, DAY)[0] == len(make_rows())
+        assert db.check_daily_totals() == []
+    finally:
+        db.close()
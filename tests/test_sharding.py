@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+
+import pytest
+from telegram import Update
+
+from utils.sharding import ShardedDispatcher, connection_budget_per_shard, shard_for
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+from fake_bot_api import FakeBotAPI  # noqa: E402
+
+
+def test_budget_is_split_between_shards():
+    assert connection_budget_per_shard(15, 4) == 3
+    assert connection_budget_per_shard(4, 4) == 1
+
+
+def test_more_shards_than_connections_is_rejected():
+    with pytest.raises(ValueError):
+        connection_budget_per_shard(3, 4)
+
+
+def test_chat_always_goes_to_one_shard():
+    assert shard_for(-100123, 3) == shard_for(-100123, 3)
+    assert {shard_for(chat_id, 3) for chat_id in range(30)} == {0, 1, 2}
+
+
+def make_shard_application(index: int, count: int):
+    """Приложение шарда для теста: 'boom' завершает процесс, остальное получает ответ"""
+    from telegram.ext import Application, MessageHandler, filters
+
+    async def reply(update, context):
+        if update.message.text == 'boom':
+            os._exit(1)
+        await update.message.reply_text('ok')
+
+    application = Application.builder().token('123456:test').base_url(os.environ['TEST_BOT_API']).updater(None).build()
+    application.add_handler(MessageHandler(filters.TEXT, reply))
+    return application
+
+
+def test_update_that_kills_shard_is_dead_lettered(monkeypatch):
+    api = FakeBotAPI()
+    api.start()
+    monkeypatch.setenv('TEST_BOT_API', api.base_url)
+    dispatcher = ShardedDispatcher(make_shard_application, 1, heartbeat_interval=0.2, max_deliveries=3)
+    dispatcher.start()
+    try:
+        dispatcher.route(Update.de_json(api.make_update(-1, 'hello'), None))
+        assert api.wait_for_sent(1, 60)
+
+        dispatcher.route(Update.de_json(api.make_update(-2, 'boom'), None))
+        deadline = time.monotonic() + 120
+        while not dispatcher.stats()[0]['dead_letter'] and time.monotonic() < deadline:
+            time.sleep(0.2)
+        stats = dispatcher.stats()[0]
+        assert stats['dead_letter'] == 1
+        assert stats['restarts'] == 3
+        assert stats['unacked'] == 0
+        assert dispatcher.shards[0].dead_letter[0]['message']['text'] == 'boom'
+
+        # Шард после исключения обновления продолжает работать
+        dispatcher.route(Update.de_json(api.make_update(-1, 'again'), None))
+        assert api.wait_for_sent(2, 60)
+        assert len(api.sent) == 2
+    finally:
+        dispatcher.stop()
+        api.stop()
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from utils.single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+        release = asyncio.Event()
+
+        async def work():
+            calls.append(1)
+            await release.wait()
+            return 'digest'
+
+        waiters = [asyncio.ensure_future(flight.run(('chat', 'month'), work)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*waiters)
+        return flight, calls, results
+
+    flight, calls, results = asyncio.run(scenario())
+    assert results == ['digest'] * 3
+    assert len(calls) == 1
+    assert flight.stats() == {'executed': 1, 'coalesced': 2, 'inflight': 0}
+
+
+def test_finished_result_is_not_kept():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            return len(calls)
+
+        first = await flight.run('key', work)
+        second = await flight.run('key', work)
+        return flight, first, second
+
+    flight, first, second = asyncio.run(scenario())
+    assert (first, second) == (1, 2)
+    assert flight.stats()['inflight'] == 0
+
+
+def test_error_reaches_all_waiters_and_is_not_cached():
+    async def scenario():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def failing():
+            await release.wait()
+            raise RuntimeError('render failed')
+
+        waiters = [asyncio.ensure_future(flight.run('key', failing)) for _ in range(2)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+
+        async def work():
+            return 'ok'
+
+        return results, await flight.run('key', work)
+
+    results, retry = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert retry == 'ok'
+
+
+def test_cancelled_waiter_does_not_cancel_work():
+    async def scenario():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return 'digest'
+
+        first = asyncio.ensure_future(flight.run('key', work))
+        second = asyncio.ensure_future(flight.run('key', work))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) == 'digest'
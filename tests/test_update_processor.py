@@ -0,0 +1,64 @@
+import asyncio
+import time
+from datetime import datetime
+
+import pytest
+from telegram import Chat, Message, Update
+
+from utils.update_processor import ChatOrderedUpdateProcessor
+
+
+def make_update(update_id: int, chat_id: int) -> Update:
+    chat = Chat(chat_id, Chat.GROUP)
+    return Update(update_id, message=Message(update_id, datetime.now(), chat, text='500 продукты'))
+
+
+@pytest.mark.asyncio
+async def test_backlogged_chat_does_not_block_other_chats():
+    processor = ChatOrderedUpdateProcessor(4)
+    finished = {}
+
+    async def handle(update_id: int, delay: float):
+        await asyncio.sleep(delay)
+        finished[update_id] = time.monotonic()
+
+    started = time.monotonic()
+    tasks = [
+        asyncio.create_task(processor.process_update(make_update(i, 1), handle(i, 0.1)))
+        for i in range(10)
+    ]
+    tasks.append(asyncio.create_task(processor.process_update(make_update(100, 2), handle(100, 0.1))))
+    await asyncio.gather(*tasks)
+
+    # Обновление второго чата не ждет очередь первого (10 x 0.1 с)
+    assert finished[100] - started < 0.3
+    # Обновления первого чата обработаны по порядку
+    assert sorted(range(10), key=finished.get) == list(range(10))
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limit_is_kept():
+    processor = ChatOrderedUpdateProcessor(2)
+    running = 0
+    peak = 0
+
+    async def handle():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+
+    await asyncio.gather(*(
+        processor.process_update(make_update(i, i % 5), handle()) for i in range(20)
+    ))
+    assert peak == 2
+    # Блокировки завершенных чатов удалены
+    assert not processor._chat_locks
+
+
+@pytest.mark.asyncio
+async def test_limit_is_reported_and_validated():
+    assert ChatOrderedUpdateProcessor(8).max_concurrent_updates == 8
+    with pytest.raises(ValueError):
+        ChatOrderedUpdateProcessor(0)
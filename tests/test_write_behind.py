@@ -0,0 +1,66 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from models.transaction import Transaction
+from utils.database import Database, WriteBehindQueue
+
+CHAT_ID = 1
+
+
+def make_transaction(amount, chat_id: int = CHAT_ID) -> Transaction:
+    return Transaction(amount=amount, type='expense', category='продукты', description='',
+                       user_id=1, chat_id=chat_id, timestamp=datetime.now())
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # Сбросы вызываются из теста, фоновый поток не должен успеть раньше
+    monkeypatch.setenv('DB_WRITE_FLUSH_INTERVAL', '3600')
+    database = Database(write_behind=True, database_url=f'sqlite:///{tmp_path / "bot.db"}')
+    yield database
+    database.close()
+
+
+def test_poison_row_does_not_block_chat(db):
+    for amount in (100, None, 200):
+        db.add_transaction(make_transaction(amount))
+
+    # Чтение сбрасывает очередь чата и не падает из-за строки с NULL в amount
+    stats = db.get_statistics(CHAT_ID)
+    assert stats['total_expense'] == 300
+    assert len(db.write_queue.pending) == 1
+
+    for _ in range(db.write_queue.max_attempts - 1):
+        db.write_queue.flush()
+    assert db.write_queue.pending == []
+    assert [t.amount for t in db.write_queue.dead_letter] == [None]
+
+    # Следующие записи чата проходят обычной пачкой
+    db.add_transaction(make_transaction(50))
+    assert db.get_statistics(CHAT_ID)['total_expense'] == 350
+
+
+def test_transient_error_keeps_batch():
+    calls = []
+
+    def flush_func(batch):
+        calls.append(len(batch))
+        if len(calls) == 1:
+            raise OperationalError('INSERT', {}, Exception('connection lost'))
+
+    queue = WriteBehindQueue(flush_func, flush_interval=3600)
+    try:
+        for amount in (1, 2, 3):
+            queue.put(make_transaction(amount))
+        with pytest.raises(OperationalError):
+            queue.flush()
+        # Пачка целиком вернулась в очередь, попытки не считаются
+        assert [t.amount for t in queue.pending] == [1, 2, 3]
+        assert not queue.attempts
+        queue.flush()
+        assert calls == [3, 3]
+        assert queue.pending == [] and queue.dead_letter == []
+    finally:
+        queue.close()